@@ -0,0 +1,273 @@
+"""Columnar snapshot of the transactions ledger for the analytics endpoints.
+
+The snapshot holds one NumPy column per field (transaction id, customer code, ledger day and
+the four amounts in grams and rupees), sorted by customer and then date, so per-customer
+questions are a bincount or a cumulative sum over contiguous runs. Snapshots are immutable:
+applying changes returns a new one, so a query keeps reading the one it started with while
+the server swaps in the next. They are saved as an uncompressed .npz file, which reloads in
+about the time it takes to read it from disk.
+
+Transaction ids are kept as 64-bit BLAKE2 digests: they are only needed to find deleted
+transactions, and numeric columns keep every copy of the frame cheap.
+"""
+import itertools
+import json
+import os
+from hashlib import blake2b
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+AMOUNTS = ("gold_in", "gold_out", "cash_in", "labour_charge")
+COLUMNS = ("id", "customer", "day", *AMOUNTS)
+DECIMALS = {"gold_in": 3, "gold_out": 3, "cash_in": 2, "labour_charge": 2}
+FORMAT_VERSION = 1
+EPOCH = np.datetime64("1970-01-01", "D")
+SEPARATOR = "\x00"  # joins customer ids into one blob in the saved file
+VERSIONS = itertools.count(1)
+
+
+def day_number(value: date) -> int:
+    return int((np.datetime64(value, "D") - EPOCH).astype(np.int64))
+
+
+def day_date(number: int) -> date:
+    return date(1970, 1, 1) + timedelta(days=int(number))
+
+
+def id_digests(ids: Iterable[str]) -> np.ndarray:
+    ids = list(ids)
+    return np.fromiter((int.from_bytes(blake2b(str(id).encode(), digest_size=8).digest(), "little", signed=True)
+                        for id in ids), dtype=np.int64, count=len(ids))
+
+
+def transactions_frame(documents: List[dict], scales: Dict[str, int]) -> pd.DataFrame:
+    """Transactions as read from storage -> id, customer_id, day and amounts in grams/rupees.
+
+    `scales` divides stored amounts back to display units (the fixed-point scales, or 1).
+    Rows whose date does not parse are left out rather than failing the whole refresh.
+    """
+    records = pd.DataFrame.from_records(documents, columns=["id", "customer_id", "date", *AMOUNTS])
+    dates = pd.to_datetime(records["date"].astype(str).str[:10], format="%Y-%m-%d", errors="coerce")
+    valid = dates.notna().to_numpy()
+    frame = pd.DataFrame({
+        "id": id_digests(records["id"].to_numpy()[valid]),
+        "customer_id": records["customer_id"].to_numpy()[valid],
+        "day": (dates.to_numpy()[valid].astype("datetime64[D]") - EPOCH).astype(np.int32),
+    })
+    for field in AMOUNTS:
+        frame[field] = pd.to_numeric(records[field], errors="coerce").fillna(0).to_numpy(np.float64)[valid] / scales.get(field, 1)
+    return frame
+
+
+def concat(frames: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    frames = list(frames)
+    return pd.concat(frames, ignore_index=True) if frames else transactions_frame([], {})
+
+
+def group_ends(codes: np.ndarray) -> np.ndarray:
+    """Index of the last row of every run of equal customer codes."""
+    return np.flatnonzero(np.r_[codes[1:] != codes[:-1], True]) if len(codes) else codes
+
+
+class LedgerSnapshot:
+    def __init__(self, frame: pd.DataFrame, customers: pd.Index, names: Dict[str, str], watermark: Optional[str]):
+        self.frame = frame  # id, customer (code into customers), day, amounts; sorted by customer, day
+        self.customers = customers
+        self.names = names
+        self.watermark = watermark  # sync log position of the last change included
+        self.version = next(VERSIONS)
+
+    @classmethod
+    def build(cls, frames: Iterable[pd.DataFrame], names: Dict[str, str], watermark: Optional[str]) -> "LedgerSnapshot":
+        frame = concat(frames)
+        customers = pd.Index(frame["customer_id"].unique())
+        return cls(sort_frame(encode_customers(frame, customers)), customers, names, watermark)
+
+    def apply(self, removed: Iterable[str], added: Iterable[pd.DataFrame], names: Dict[str, str], watermark: Optional[str]) -> "LedgerSnapshot":
+        """A new snapshot without the `removed` ids and with the `added` transaction frames."""
+        removed = id_digests(removed)
+        added = concat(added)
+        if not len(removed) and not len(added):
+            return LedgerSnapshot(self.frame, self.customers, {**self.names, **names}, watermark)
+        columns = {name: self.frame[name].to_numpy() for name in COLUMNS}
+        if len(removed):
+            kept = ~np.isin(columns["id"], removed)
+            columns = {name: values[kept] for name, values in columns.items()}
+        customers = self.customers
+        if len(added):
+            unknown = pd.Index(added["customer_id"].unique()).difference(customers)
+            customers = customers.append(unknown) if len(unknown) else customers
+            added = sort_frame(encode_customers(added, customers))
+            # Merge the (few) new rows into the sorted columns instead of sorting everything again.
+            positions = np.searchsorted(sort_key(columns), sort_key(added), side="right")
+            columns = {name: np.insert(values, positions, added[name].to_numpy()) for name, values in columns.items()}
+        return LedgerSnapshot(pd.DataFrame(columns), customers, {**self.names, **names}, watermark)
+
+    def save(self, path: Path):
+        """Write the snapshot next to `path` and move it into place, so readers never see half a file."""
+        meta = {"format": FORMAT_VERSION, "watermark": self.watermark, "names": self.names,
+                "saved_at": datetime.utcnow().isoformat()}
+        arrays = {
+            "meta": np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8),
+            "id": self.frame["id"].to_numpy(),
+            "customers": np.frombuffer(SEPARATOR.join(self.customers).encode(), dtype=np.uint8),
+            "customer": self.frame["customer"].to_numpy(),
+            "day": self.frame["day"].to_numpy(),
+            **{field: self.frame[field].to_numpy() for field in AMOUNTS},
+        }
+        temporary = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        with open(temporary, "wb") as file:
+            np.savez(file, **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional["LedgerSnapshot"]:
+        """The saved snapshot, or None if there is none (or it was written by another format version)."""
+        if not path.exists():
+            return None
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(data["meta"].tobytes())
+            if meta.get("format") != FORMAT_VERSION:
+                return None
+            customers = data["customers"].tobytes().decode()
+            frame = pd.DataFrame({
+                "id": data["id"],
+                "customer": data["customer"],
+                "day": data["day"],
+                **{field: data[field] for field in AMOUNTS},
+            })
+        customers = pd.Index(customers.split(SEPARATOR) if customers else [], dtype=object)
+        return cls(frame, customers, meta["names"], meta["watermark"])
+
+    def stats(self) -> dict:
+        return {
+            "transactions": len(self.frame),
+            "customers": len(self.customers),
+            "version": self.version,
+            "memory_bytes": int(self.frame.memory_usage(index=False).sum()),
+        }
+
+    # Queries
+    def mask(self, start: Optional[date] = None, end: Optional[date] = None, customer_id: Optional[str] = None) -> np.ndarray:
+        selected = np.ones(len(self.frame), dtype=bool)
+        day = self.frame["day"].to_numpy()
+        if start:
+            selected &= day >= day_number(start)
+        if end:
+            selected &= day <= day_number(end)
+        if customer_id is not None:
+            code = self.customers.get_indexer([customer_id])[0]
+            selected &= self.frame["customer"].to_numpy() == code
+        return selected
+
+    def customer_row(self, code: int) -> dict:
+        customer_id = self.customers[code]
+        return {"customer_id": customer_id, "customer_name": self.names.get(customer_id)}
+
+    def outstanding(self, limit: int) -> List[dict]:
+        """Customers with the most gold held for them, with their money balance and last activity."""
+        codes = self.frame["customer"].to_numpy()
+        size = len(self.customers)
+        columns = {field: self.frame[field].to_numpy() for field in AMOUNTS}
+        gold = np.bincount(codes, weights=columns["gold_in"] - columns["gold_out"], minlength=size)
+        money = np.bincount(codes, weights=columns["cash_in"] + columns["labour_charge"], minlength=size)
+        counts = np.bincount(codes, minlength=size)
+        last_day = np.zeros(size, dtype=np.int64)
+        ends = group_ends(codes)
+        last_day[codes[ends]] = self.frame["day"].to_numpy()[ends]
+
+        active = np.flatnonzero(counts)
+        top = active[np.argsort(-gold[active], kind="stable")[:limit]]
+        return [{
+            **self.customer_row(code),
+            "gold_balance": round(float(gold[code]), 3),
+            "money_balance": round(float(money[code]), 2),
+            "transaction_count": int(counts[code]),
+            "last_transaction": day_date(last_day[code]).isoformat(),
+        } for code in top]
+
+    def aging(self, as_of: date, edges: List[int], customer_id: Optional[str] = None) -> List[dict]:
+        """Gold still held on `as_of`, bucketed by how many days ago it was received.
+
+        Returns are matched against the oldest receipts first (FIFO), per customer: a receipt is
+        outstanding for the part of the customer's cumulative receipts beyond everything returned.
+        """
+        selected = self.mask(end=as_of, customer_id=customer_id)
+        codes = self.frame["customer"].to_numpy()[selected]
+        gold_in = self.frame["gold_in"].to_numpy()[selected]
+        returned = np.bincount(codes, weights=self.frame["gold_out"].to_numpy()[selected], minlength=len(self.customers))
+
+        # Cumulative receipts within each customer's run of rows (the frame is sorted by customer).
+        total = np.cumsum(gold_in)
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if len(codes) else codes
+        before_run = np.repeat((total - gold_in)[starts], np.diff(np.r_[starts, len(codes)]))
+        received = total - before_run
+        outstanding = np.clip(received - np.maximum(received - gold_in, returned[codes]), 0, None)
+
+        age = day_number(as_of) - self.frame["day"].to_numpy()[selected]
+        bucket = np.searchsorted(np.asarray(edges), age, side="left")
+        gold = np.bincount(bucket, weights=outstanding, minlength=len(edges) + 1)
+        held = outstanding > 1e-9
+        customers = np.bincount(np.unique(bucket[held] * len(self.customers) + codes[held]) // max(len(self.customers), 1),
+                                minlength=len(edges) + 1)
+        bounds = [0, *[edge + 1 for edge in edges]]
+        return [{
+            "bucket": f"{low}-{edges[index]}" if index < len(edges) else f"{low}+",
+            "min_days": low,
+            "max_days": edges[index] if index < len(edges) else None,
+            "gold": round(float(gold[index]), 3),
+            "customers": int(customers[index]),
+        } for index, low in enumerate(bounds)]
+
+    def top_customers(self, metric: str, limit: int, start: Optional[date] = None, end: Optional[date] = None) -> List[dict]:
+        selected = self.mask(start, end)
+        codes = self.frame["customer"].to_numpy()[selected]
+        totals = np.bincount(codes, weights=self.frame[metric].to_numpy()[selected], minlength=len(self.customers))
+        counts = np.bincount(codes, minlength=len(self.customers))
+        active = np.flatnonzero(counts)
+        top = active[np.argsort(-totals[active], kind="stable")[:limit]]
+        return [{**self.customer_row(code), "value": round(float(totals[code]), DECIMALS[metric]),
+                 "transaction_count": int(counts[code])} for code in top]
+
+    def trends(self, start: Optional[date] = None, end: Optional[date] = None, customer_id: Optional[str] = None) -> List[dict]:
+        """Monthly sums with the change against the previous month, in percent (None after an empty month)."""
+        selected = self.mask(start, end, customer_id)
+        if not selected.any():
+            return []
+        days = self.frame["day"].to_numpy()[selected].astype("timedelta64[D]") + EPOCH
+        months = days.astype("datetime64[M]").astype(np.int64)
+        first = months.min()
+        index = months - first
+        size = int(index.max()) + 1
+        sums = {field: np.bincount(index, weights=self.frame[field].to_numpy()[selected], minlength=size) for field in AMOUNTS}
+        counts = np.bincount(index, minlength=size)
+
+        rows = []
+        for position in range(size):
+            month = str(np.datetime64(int(first + position), "M"))
+            row = {"month": month, **{field: round(float(sums[field][position]), DECIMALS[field]) for field in AMOUNTS},
+                   "transaction_count": int(counts[position]), "change": {}}
+            for field in AMOUNTS:
+                previous = sums[field][position - 1] if position else 0
+                row["change"][field] = round(float((sums[field][position] - previous) / previous * 100), 1) if previous else None
+            rows.append(row)
+        return rows
+
+
+def encode_customers(frame: pd.DataFrame, customers: pd.Index) -> pd.DataFrame:
+    frame = frame.assign(customer=customers.get_indexer(frame["customer_id"]).astype(np.int32))
+    return frame.drop(columns="customer_id")[list(COLUMNS)]
+
+
+def sort_key(columns) -> np.ndarray:
+    """One int64 per row ordering like (customer, day), for a frame or a dict of columns."""
+    return (np.asarray(columns["customer"], dtype=np.int64) << 32) + np.asarray(columns["day"], dtype=np.int64) + 2**31
+
+
+def sort_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    order = np.lexsort((frame["day"].to_numpy(), frame["customer"].to_numpy()))
+    return frame.take(order).reset_index(drop=True)
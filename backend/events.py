@@ -0,0 +1,50 @@
+"""In-process event bus feeding the live dashboard stream.
+
+Publishing costs one queue put per connected client and never touches the database, so idle
+streams cost nothing beyond their keepalives. Each subscriber has a bounded queue; when a
+client falls behind, its backlog is replaced by a single RESYNC marker and it catches up
+with one fresh snapshot instead of growing memory.
+"""
+import asyncio
+from typing import Optional, Set
+
+# Event telling subscribers that deltas were lost and totals must be re-read.
+RESYNC = "resync"
+
+
+def sse(event: str, data: bytes, id: Optional[int] = None) -> bytes:
+    """One Server-Sent Events message; `data` is a single line of JSON."""
+    head = f"id: {id}\n" if id is not None else ""
+    return f"{head}event: {event}\n".encode() + b"data: " + data + b"\n\n"
+
+
+class EventBus:
+    def __init__(self, max_queue: int = 256):
+        self.max_queue = max_queue
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.sequence = 0
+        self.overflows = 0
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(self.max_queue)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, event: str, data: dict):
+        """Queue (sequence, event, data) for every subscriber. Must be called from the event loop."""
+        self.sequence += 1
+        message = (self.sequence, event, data)
+        for queue in self.subscribers:
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.overflows += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait((self.sequence, RESYNC, {}))
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self.subscribers), "sequence": self.sequence, "overflows": self.overflows}
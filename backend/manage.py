@@ -0,0 +1,680 @@
+"""Maintenance commands for the Goldsmith Ledger backend.
+
+Run from the backend directory, e.g. ``python manage.py verify-balances``.
+"""
+import asyncio
+import json
+import logging
+import math
+import os
+import platform
+import random
+import subprocess
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+import typer
+
+import server
+from storage import MongoStorage, QueryAudit, create_storage
+
+cli = typer.Typer(help="Goldsmith Ledger maintenance commands")
+
+
+def run(coroutine):
+    """Run a ledger coroutine from server with the configured storage opened around it."""
+    async def main():
+        server.storage = server.open_storage()
+        try:
+            return await coroutine
+        finally:
+            await server.storage.close()
+
+    return asyncio.run(main())
+
+
+@cli.command("verify-balances")
+def verify_balances(
+    fix: bool = typer.Option(False, "--fix", help="Overwrite drifted balances with the recomputed values"),
+):
+    """Recompute every customer balance from the raw ledger and report drift."""
+    drift = run(server.rebuild_balances(fix=fix))
+    for item in drift:
+        typer.echo(json.dumps(item, default=str))
+    if not drift:
+        typer.echo("All balances match the ledger.")
+    elif fix:
+        typer.echo(f"Rebuilt {len(drift)} balance(s).")
+    else:
+        typer.echo(f"{len(drift)} balance(s) drifted. Re-run with --fix to rebuild them.")
+        raise typer.Exit(code=1)
+
+
+@cli.command("rebuild-rollups")
+def rebuild_rollups():
+    """Recompute the day and month rollups from the raw ledger."""
+    count = run(server.rebuild_rollups())
+    typer.echo(f"Rebuilt {count} rollup(s).")
+
+
+@cli.command("rebuild-checkpoints")
+def rebuild_checkpoints():
+    """Recompute month-end balance checkpoints from the monthly rollups."""
+    count = run(server.rebuild_checkpoints())
+    typer.echo(f"Rebuilt {count} checkpoint(s).")
+
+
+@cli.command("migrate-fixed-point")
+def migrate_fixed_point():
+    """Convert float gold and money amounts to integer milligrams and paise."""
+    if not server.FIXED_POINT:
+        typer.echo("Set LEDGER_FIXED_POINT=1 before migrating, so the API reads the converted data.", err=True)
+        raise typer.Exit(code=1)
+    typer.echo(json.dumps(run(server.migrate_fixed_point())))
+
+
+@cli.command("migrate-compact-schema")
+def migrate_compact_schema():
+    """Rewrite customers, transactions and jobs in the compact layout and report sizes."""
+    if not server.COMPACT_SCHEMA:
+        typer.echo("Set LEDGER_COMPACT_SCHEMA=1 before migrating, so the API reads the converted data.", err=True)
+        raise typer.Exit(code=1)
+
+    async def migrate():
+        if not isinstance(server.storage, MongoStorage):
+            return None
+        return await server.migrate_compact_schema()
+
+    result = run(migrate())
+    if result is None:
+        typer.echo("The compact schema only applies to the Mongo backend.", err=True)
+        raise typer.Exit(code=1)
+    typer.echo(json.dumps(result, indent=2))
+
+
+@cli.command("prune-sync-log")
+def prune_sync_log(
+    days: float = typer.Option(server.SYNC_RETENTION_DAYS, help="Keep sync log entries and idempotency keys this many days"),
+):
+    """Delete old sync log entries; devices with an older cursor download the ledger again."""
+    typer.echo(json.dumps(run(server.prune_sync_log(days))))
+
+
+@cli.command("ensure-indexes")
+def ensure_indexes(
+    report: bool = typer.Option(False, "--report", help="Print expected and actual indexes afterwards"),
+):
+    """Create any missing index the API relies on."""
+    async def ensure():
+        await server.ensure_indexes()
+        return await server.index_report() if report else None
+
+    result = run(ensure())
+    if report:
+        typer.echo(json.dumps(result, indent=2, default=str))
+    else:
+        typer.echo("Indexes are in place.")
+
+
+@cli.command("build-analytics")
+def build_analytics():
+    """Build the analytics snapshot from the ledger and save it to ANALYTICS_SNAPSHOT_PATH.
+
+    Workers starting with ANALYTICS enabled load this file and catch up from its watermark
+    instead of each reading the whole ledger.
+    """
+    if server.analytics is None:
+        typer.echo("The analytics snapshot needs pandas and numpy; install backend/requirements.txt.", err=True)
+        raise typer.Exit(code=1)
+
+    async def build():
+        snapshot = await server.build_analytics_snapshot()
+        await server.save_analytics_snapshot(snapshot)
+        return snapshot.stats()
+
+    result = run(build())
+    typer.echo(json.dumps({**result, "path": str(server.ANALYTICS_SNAPSHOT_PATH),
+                           "file_bytes": server.ANALYTICS_SNAPSHOT_PATH.stat().st_size}))
+
+
+@cli.command("bench-analytics")
+def bench_analytics(
+    sizes: str = typer.Option("100000,1000000", help="Comma-separated snapshot sizes (transactions)"),
+    customers: int = typer.Option(2000, help="Number of customers the transactions are spread over"),
+    repeat: int = typer.Option(20, help="Calls timed per query and size"),
+):
+    """Time the analytics queries, an incremental update and a save/load on synthetic snapshots.
+
+    The snapshots are generated in memory, so this measures the columnar engine alone.
+    """
+    import tempfile
+
+    import numpy as np
+
+    from analytics import LedgerSnapshot, transactions_frame
+
+    rng = np.random.default_rng(1)
+    customer_ids = [str(uuid.uuid4()) for _ in range(customers)]
+    first_day = server.DateType(2023, 1, 1)
+
+    def documents(count: int) -> List[dict]:
+        return [{
+            "id": str(uuid.uuid4()),
+            "customer_id": customer_ids[rng.integers(customers)],
+            "date": (first_day + server.timedelta(days=int(rng.integers(730)))).isoformat(),
+            "gold_in": float(rng.uniform(0, 20)), "gold_out": float(rng.uniform(0, 20)),
+            "cash_in": float(rng.uniform(0, 5000)), "labour_charge": float(rng.uniform(0, 500)),
+        } for _ in range(count)]
+
+    for size in [int(size) for size in sizes.split(",") if size.strip()]:
+        frames = [transactions_frame(documents(min(100000, size - start)), {}) for start in range(0, size, 100000)]
+        snapshot = LedgerSnapshot.build(frames, {customer_id: customer_id[:8] for customer_id in customer_ids}, None)
+        queries = {
+            "outstanding": lambda: snapshot.outstanding(50),
+            "aging": lambda: snapshot.aging(server.DateType(2025, 1, 1), [30, 60, 90]),
+            "top_customers": lambda: snapshot.top_customers("labour_charge", 10, server.DateType(2024, 1, 1)),
+            "trends": lambda: snapshot.trends(),
+            "customer_trends": lambda: snapshot.trends(customer_id=customer_ids[0]),
+            "apply_100": lambda: snapshot.apply([], [transactions_frame(documents(100), {})], {}, None),
+        }
+        row = {"transactions": size, "customers": customers}
+        for name, query in queries.items():
+            query()  # warm up
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                query()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            row[f"{name}_p50_ms"] = round(timings[len(timings) // 2], 3)
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "snapshot.npz"
+            started = time.perf_counter()
+            snapshot.save(path)
+            row["save_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            started = time.perf_counter()
+            LedgerSnapshot.load(path)
+            row["load_ms"] = round((time.perf_counter() - started) * 1000, 1)
+            row["file_bytes"] = path.stat().st_size
+        typer.echo(json.dumps(row))
+
+
+@cli.command("month-end-statements")
+def month_end_statements(
+    month: Optional[str] = typer.Option(None, help="Month to render, YYYY-MM (default: last month)"),
+    format: str = typer.Option("pdf", help="pdf, csv or html"),
+    output: Path = typer.Option(Path("statements"), help="Directory the statements are written to"),
+    concurrency: int = typer.Option(0, help="Statements prepared at a time (default: twice STATEMENT_WORKERS)"),
+):
+    """Render every customer's statement for a month, in parallel across STATEMENT_WORKERS processes."""
+    month = month or server.previous_month(server.DateType.today().isoformat()[:7])
+    try:
+        server.datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        typer.echo(f"Expected --month as YYYY-MM, got {month!r}.", err=True)
+        raise typer.Exit(code=1)
+    if format not in server.MEDIA_TYPES:
+        typer.echo(f"Expected --format pdf, csv or html, got {format!r}.", err=True)
+        raise typer.Exit(code=1)
+
+    async def render():
+        try:
+            return await server.month_end_statements(month, format, output, concurrency)
+        finally:
+            await server.close_statement_pool()
+
+    typer.echo(json.dumps(run(render())))
+
+
+async def _seed_ledger(storage, transactions: int, customers: int, batch_size: int = 10000):
+    """Fill `storage` with random customers, transactions dated over two years and jobs.
+
+    Returns the customer and job ids. Balances, rollups and checkpoints are rebuilt afterwards.
+    """
+    customer_ids = [str(uuid.uuid4()) for _ in range(customers)]
+    await storage.insert_many("customers", [
+        {"id": customer_id, "name": f"Customer {i}", "created_at": server.datetime.utcnow()}
+        for i, customer_id in enumerate(customer_ids)
+    ])
+    first_day = server.DateType(2023, 1, 1)
+    remaining = transactions
+    while remaining > 0:
+        batch = []
+        for _ in range(min(batch_size, remaining)):
+            batch.append(server.stored({
+                "id": str(uuid.uuid4()),
+                "customer_id": random.choice(customer_ids),
+                "customer_name": "",
+                "date": (first_day + server.timedelta(days=random.randrange(730))).isoformat(),
+                "work_description": "benchmark",
+                "gold_in": round(random.uniform(0, 20), 3),
+                "gold_out": round(random.uniform(0, 20), 3),
+                "cash_in": round(random.uniform(0, 5000), 2),
+                "labour_charge": round(random.uniform(0, 500), 2),
+                "created_at": server.datetime.utcnow(),
+            }))
+        await storage.insert_many("transactions", batch)
+        remaining -= len(batch)
+    job_ids = [str(uuid.uuid4()) for _ in range(min(customers, 1000))]
+    await storage.insert_many("jobs", [
+        {"id": job_id, "customer_id": random.choice(customer_ids), "customer_name": "",
+         "work_description": "benchmark", "status": random.choice(["In Progress", "Completed", "Delivered"]),
+         "created_at": server.datetime.utcnow()}
+        for job_id in job_ids
+    ])
+    await server.rebuild_balances(fix=True)
+    await server.rebuild_rollups()
+    await server.rebuild_checkpoints()
+    return customer_ids, job_ids
+
+
+async def _bench_dashboard(sizes, customers: int, repeat: int):
+    results = []
+    for size in sizes:
+        server.storage = create_storage(f"ledger_bench_{uuid.uuid4().hex[:8]}", compact=server.COMPACT_SCHEMA)
+        try:
+            await server.ensure_indexes()
+            await _seed_ledger(server.storage, size, customers)
+            await server.compute_dashboard_stats()  # warm up
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                await server.compute_dashboard_stats()
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results.append({
+                "transactions": size,
+                "customers": customers,
+                "p50_ms": round(timings[len(timings) // 2], 3),
+                "max_ms": round(timings[-1], 3),
+            })
+        finally:
+            await server.storage.drop()
+    return results
+
+
+@cli.command("bench-dashboard")
+def bench_dashboard(
+    sizes: str = typer.Option("1000,10000,100000,1000000", help="Comma-separated ledger sizes to seed"),
+    customers: int = typer.Option(500, help="Number of customers the transactions are spread over"),
+    repeat: int = typer.Option(50, help="Dashboard calls timed per ledger size"),
+):
+    """Seed scratch databases of increasing size and time the dashboard aggregation."""
+    size_list = [int(size) for size in sizes.split(",") if size.strip()]
+    for row in asyncio.run(_bench_dashboard(size_list, customers, repeat)):
+        typer.echo(json.dumps(row))
+
+
+@cli.command("bench-serialization")
+def bench_serialization(
+    rows: int = typer.Option(1000, help="Rows per response"),
+    repeat: int = typer.Option(200, help="Responses encoded per path"),
+):
+    """Compare per-row cost of model round-tripping against the fast list serializer."""
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    documents = [
+        {
+            "id": str(uuid.uuid4()),
+            "customer_id": str(uuid.uuid4()),
+            "customer_name": f"Customer {i}",
+            "date": "2024-01-01",
+            "work_description": "Ring resizing",
+            "gold_in": round(random.uniform(0, 20), 3),
+            "gold_out": round(random.uniform(0, 20), 3),
+            "cash_in": random.randint(0, 5000),
+            "labour_charge": round(random.uniform(0, 500), 2),
+            "remarks": None,
+            "created_at": server.datetime.utcnow().replace(microsecond=random.randint(0, 999) * 1000),
+        }
+        for i in range(rows)
+    ]
+    adapter = TypeAdapter(List[server.Transaction])
+
+    def model_path():
+        # What the routes used to do: build models, re-validate through response_model, encode with json.
+        content = [server.Transaction(**document) for document in documents]
+        value = adapter.validate_python(content, from_attributes=True)
+        return json.dumps(jsonable_encoder(adapter.dump_python(value, mode="json")),
+                          ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+    def fast_path():
+        encode = server.row_encoder(server.Transaction)
+        return server.dumps([encode(document) for document in documents])
+
+    if model_path() != fast_path():
+        typer.echo("Fast path output differs from the model path.", err=True)
+        raise typer.Exit(code=1)
+
+    for name, path in (("model", model_path), ("fast", fast_path)):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            path()
+        elapsed = time.perf_counter() - started
+        typer.echo(json.dumps({
+            "path": name,
+            "rows": rows,
+            "ms_per_response": round(elapsed / repeat * 1000, 3),
+            "us_per_row": round(elapsed / repeat / rows * 1e6, 3),
+        }))
+
+
+# Load benchmark
+# Operation -> function(rng, customer_ids, job_ids) returning (method, url, params, json body).
+LOAD_OPERATIONS = {
+    "dashboard": lambda rng, customers, jobs: ("GET", "/api/dashboard", None, None),
+    "customers": lambda rng, customers, jobs: ("GET", "/api/customers", {"limit": 100}, None),
+    "transactions": lambda rng, customers, jobs: ("GET", "/api/transactions", {"limit": 100}, None),
+    "customer_transactions": lambda rng, customers, jobs: (
+        "GET", "/api/transactions", {"customer_id": rng.choice(customers), "limit": 100}, None),
+    "balance": lambda rng, customers, jobs: ("GET", f"/api/customer/{rng.choice(customers)}/balance", None, None),
+    "balance_as_of": lambda rng, customers, jobs: (
+        "GET", f"/api/customer/{rng.choice(customers)}/balance",
+        {"as_of": (server.DateType(2023, 1, 1) + server.timedelta(days=rng.randrange(730))).isoformat()}, None),
+    "jobs": lambda rng, customers, jobs: ("GET", "/api/jobs", {"limit": 100}, None),
+    "rollup_report": lambda rng, customers, jobs: (
+        "GET", "/api/reports/rollup", {"granularity": "month", "customer_id": rng.choice(customers)}, None),
+    "create_transaction": lambda rng, customers, jobs: ("POST", "/api/transactions", None, {
+        "customer_id": rng.choice(customers), "work_description": "benchmark",
+        "gold_in": round(rng.uniform(0, 20), 3), "cash_in": round(rng.uniform(0, 5000), 2)}),
+    "create_job": lambda rng, customers, jobs: ("POST", "/api/jobs", None, {
+        "customer_id": rng.choice(customers), "work_description": "benchmark"}),
+    "update_job": lambda rng, customers, jobs: (
+        "PUT", f"/api/jobs/{rng.choice(jobs)}", {"status": rng.choice(["In Progress", "Completed", "Delivered"])}, None),
+}
+LOAD_WORKLOADS = {
+    # Workload -> operation weights
+    "read": {"dashboard": 20, "customers": 5, "transactions": 10, "customer_transactions": 20, "balance": 25,
+             "balance_as_of": 5, "jobs": 10, "rollup_report": 5},
+    "mixed": {"dashboard": 15, "customers": 5, "transactions": 10, "customer_transactions": 15, "balance": 20,
+              "balance_as_of": 5, "jobs": 5, "rollup_report": 5, "create_transaction": 15, "create_job": 3,
+              "update_job": 2},
+    "write": {"create_transaction": 70, "create_job": 15, "update_job": 15},
+}
+
+
+# Query-plan audit
+# Requests issued besides one of each LOAD_OPERATIONS, for query shapes the load mix does not cover.
+class Upload(dict):
+    """A multipart request body (field -> (file name, content)) in place of a JSON one."""
+
+
+AUDIT_SYNC_PUSH = [
+    {"key": "audit-1", "collection": "customers", "op": "upsert", "document": {"id": "audit-customer", "name": "Audit"}},
+    {"key": "audit-2", "collection": "customers", "op": "upsert", "document": {"id": "audit-customer", "phone": "1"}},
+    {"key": "audit-3", "collection": "jobs", "op": "upsert", "document": {
+        "id": "audit-job", "customerId": "audit-import", "workDescription": "audit", "status": "In Progress"}},
+    {"key": "audit-4", "collection": "jobs", "op": "upsert", "document": {"id": "audit-job", "status": "Completed"}},
+    {"key": "audit-5", "collection": "transactions", "op": "upsert", "document": {
+        "id": "audit-transaction", "customerId": "audit-import", "workDescription": "audit", "date": "2023-04-01"}},
+    {"key": "audit-6", "collection": "jobs", "op": "delete", "id": "audit-missing"},
+]
+AUDIT_BACKUP = {
+    "customers": [{"id": "audit-import", "name": "Audit import"}],
+    "transactions": [{"id": "audit-imported", "customerId": "audit-import", "workDescription": "audit",
+                      "date": "2023-05-01", "goldIn": 1.5}],
+    "jobs": [{"id": "audit-imported-job", "customerId": "audit-import", "workDescription": "audit",
+              "status": "In Progress"}],
+}
+AUDIT_REQUESTS = [
+    lambda rng, customers, jobs: ("GET", "/api/jobs", {"status": "In Progress", "limit": 100}, None),
+    lambda rng, customers, jobs: ("GET", "/api/reports/rollup", {"granularity": "day", "from": "2023-03-01",
+                                                                  "to": "2023-06-30"}, None),
+    lambda rng, customers, jobs: ("GET", "/api/export/transactions", {"customer_id": rng.choice(customers),
+                                                                       "from": "2023-03-01", "to": "2023-06-30"}, None),
+    lambda rng, customers, jobs: ("GET", "/api/export/customers", {"format": "csv"}, None),
+    lambda rng, customers, jobs: ("GET", "/api/sync", {"since": server.encode_cursor(
+        {"at": server.datetime.utcnow() - server.timedelta(hours=1), "_id": ""}, server.SYNC_SORT)}, None),
+    lambda rng, customers, jobs: ("GET", f"/api/customer/{rng.choice(customers)}/statement",
+                                  {"format": "csv", "from": "2023-03-01", "to": "2023-06-30"}, None),
+    # Writes outside the load workloads; the sync push creates what the deletes remove.
+    lambda rng, customers, jobs: ("POST", "/api/import", None, Upload(file=("ledger.json", json.dumps(AUDIT_BACKUP)))),
+    lambda rng, customers, jobs: ("POST", "/api/sync", None, {"changes": AUDIT_SYNC_PUSH}),
+    lambda rng, customers, jobs: ("DELETE", "/api/transactions/audit-transaction", None, None),
+    lambda rng, customers, jobs: ("DELETE", "/api/jobs/audit-job", None, None),
+    lambda rng, customers, jobs: ("DELETE", "/api/customers/audit-customer", None, None),
+]
+
+
+def _latency_summary(latencies: List[float], errors: int, elapsed: float) -> dict:
+    latencies = sorted(latencies)
+
+    def percentile(fraction):
+        # Nearest-rank percentile
+        return round(latencies[max(0, math.ceil(fraction * len(latencies)) - 1)], 3) if latencies else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(latencies[-1], 3) if latencies else None,
+    }
+
+
+async def _load_worker(client, weights: dict, rng: random.Random, deadline: float, customer_ids, job_ids, samples: list):
+    operations, operation_weights = list(weights), list(weights.values())
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, operation_weights)[0]
+        method, url, params, body = LOAD_OPERATIONS[operation](rng, customer_ids, job_ids)
+        started = time.perf_counter()
+        response = await client.request(method, url, params=params, json=body)
+        samples.append((operation, (time.perf_counter() - started) * 1000, response.status_code >= 400))
+
+
+async def _run_load(client, workload: str, concurrency: int, duration: float, seed: int, customer_ids, job_ids) -> tuple:
+    samples = []
+    deadline = time.perf_counter() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        _load_worker(client, LOAD_WORKLOADS[workload], random.Random(seed * 1000 + worker), deadline,
+                     customer_ids, job_ids, samples)
+        for worker in range(concurrency)
+    ))
+    return samples, time.perf_counter() - started
+
+
+async def _bench_load(sizes, customers: int, workloads, concurrencies, duration: float, warmup: float, seed: int):
+    from httpx import ASGITransport, AsyncClient
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per request otherwise
+    results = []
+    for size in sizes:
+        server.storage = create_storage(f"ledger_bench_{uuid.uuid4().hex[:8]}", compact=server.COMPACT_SCHEMA)
+        try:
+            await server.ensure_indexes()
+            random.seed(seed)
+            customer_ids, job_ids = await _seed_ledger(server.storage, size, customers)
+            for collection in ("customers", "transactions", "jobs"):
+                server.read_cache.invalidate(collection)
+            server.storage = server.with_write_buffer(server.storage)
+            async with AsyncClient(transport=ASGITransport(app=server.app), base_url="http://bench") as client:
+                for workload in workloads:
+                    for concurrency in concurrencies:
+                        if warmup:
+                            await _run_load(client, workload, concurrency, warmup, seed, customer_ids, job_ids)
+                        samples, elapsed = await _run_load(client, workload, concurrency, duration, seed,
+                                                           customer_ids, job_ids)
+                        endpoints = {}
+                        for operation in sorted({operation for operation, _, _ in samples}):
+                            latencies = [ms for name, ms, _ in samples if name == operation]
+                            errors = sum(1 for name, _, error in samples if name == operation and error)
+                            endpoints[operation] = _latency_summary(latencies, errors, elapsed)
+                        results.append({
+                            "transactions": size,
+                            "customers": customers,
+                            "workload": workload,
+                            "concurrency": concurrency,
+                            "duration_s": round(elapsed, 3),
+                            **_latency_summary([ms for _, ms, _ in samples], sum(error for _, _, error in samples), elapsed),
+                            "endpoints": endpoints,
+                        })
+        finally:
+            await server.storage.drop()
+    return results
+
+
+async def _audit_queries(size: int, customers: int, seed: int) -> List[dict]:
+    from httpx import ASGITransport, AsyncClient
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    server.storage = create_storage(f"ledger_audit_{uuid.uuid4().hex[:8]}", compact=server.COMPACT_SCHEMA)
+    try:
+        await server.ensure_indexes()
+        random.seed(seed)
+        customer_ids, job_ids = await _seed_ledger(server.storage, size, customers)
+        for collection in ("customers", "transactions", "jobs"):
+            server.read_cache.invalidate(collection)
+        server.storage.audit = QueryAudit()
+        rng = random.Random(seed)
+        async with AsyncClient(transport=ASGITransport(app=server.app), base_url="http://audit") as client:
+            for request in [*LOAD_OPERATIONS.values(), *AUDIT_REQUESTS]:
+                method, url, params, body = request(rng, customer_ids, job_ids)
+                payload = {"files": body} if isinstance(body, Upload) else {"json": body}
+                response = await client.request(method, url, params=params, **payload)
+                response.raise_for_status()
+                if "X-Next-Cursor" in response.headers:  # the keyset page filter is a shape of its own
+                    params = {**params, "after": response.headers["X-Next-Cursor"]}
+                    (await client.request(method, url, params=params)).raise_for_status()
+        return server.storage.audit.report()
+    finally:
+        await server.storage.drop()
+
+
+def _percent_change(before, after):
+    if not before or after is None:
+        return None
+    return round((after - before) / before * 100, 1)
+
+
+def _compare_load(baseline: dict, results: List[dict]):
+    """Per-endpoint throughput and latency change against a previous bench-load output file."""
+    previous = {(row["transactions"], row["workload"], row["concurrency"]): row for row in baseline.get("results", [])}
+    for row in results:
+        before_row = previous.get((row["transactions"], row["workload"], row["concurrency"]))
+        if before_row is None:
+            continue
+        for endpoint, after in {"all": row, **row["endpoints"]}.items():
+            before = before_row if endpoint == "all" else before_row["endpoints"].get(endpoint)
+            if before is None:
+                continue
+            yield {
+                "transactions": row["transactions"],
+                "workload": row["workload"],
+                "concurrency": row["concurrency"],
+                "endpoint": endpoint,
+                **{f"{metric}_change_pct": _percent_change(before[metric], after[metric])
+                   for metric in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")},
+            }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@cli.command("bench-load")
+def bench_load(
+    sizes: str = typer.Option("1000,100000,1000000", help="Comma-separated ledger sizes to seed"),
+    customers: int = typer.Option(500, help="Number of customers the transactions are spread over"),
+    workloads: str = typer.Option("read,mixed,write", help=f"Comma-separated workloads: {', '.join(LOAD_WORKLOADS)}"),
+    concurrency: str = typer.Option("1,8,32", help="Comma-separated numbers of concurrent clients"),
+    duration: float = typer.Option(10.0, help="Seconds each workload is measured for"),
+    warmup: float = typer.Option(1.0, help="Seconds each workload runs before measuring"),
+    storage: str = typer.Option("sqlite", help="Backend for the scratch databases: sqlite or mongo"),
+    seed: int = typer.Option(1, help="Random seed for the seeded ledger and the request mix"),
+    output: Optional[Path] = typer.Option(None, help="Write the results as JSON to this file"),
+    compare: Optional[Path] = typer.Option(None, help="Previous --output file to compare against"),
+):
+    """Drive the API in-process with concurrent mixed workloads against scratch ledgers and report latency."""
+    workload_list = [workload.strip() for workload in workloads.split(",") if workload.strip()]
+    unknown = set(workload_list) - set(LOAD_WORKLOADS)
+    if unknown:
+        typer.echo(f"Unknown workload(s): {', '.join(sorted(unknown))}", err=True)
+        raise typer.Exit(code=1)
+    os.environ["LEDGER_STORAGE"] = storage
+    size_list = [int(size) for size in sizes.split(",") if size.strip()]
+    concurrency_list = [int(clients) for clients in concurrency.split(",") if clients.strip()]
+    started_at = server.datetime.utcnow().isoformat()
+    results = asyncio.run(_bench_load(size_list, customers, workload_list, concurrency_list, duration, warmup, seed))
+
+    for row in results:
+        typer.echo(json.dumps({key: value for key, value in row.items() if key != "endpoints"}))
+    document = {
+        "meta": {
+            "started_at": started_at,
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "storage": storage,
+            "fixed_point": server.FIXED_POINT,
+            "compact_schema": server.COMPACT_SCHEMA,
+            "write_buffer": {"max_batch": server.WRITE_BUFFER_MAX_BATCH,
+                             "linger_ms": server.WRITE_BUFFER_LINGER_MS} if server.WRITE_BUFFER else None,
+            "options": {"sizes": size_list, "customers": customers, "workloads": workload_list,
+                        "concurrency": concurrency_list, "duration": duration, "warmup": warmup, "seed": seed},
+        },
+        "results": results,
+    }
+    if output:
+        output.write_text(json.dumps(document, indent=2))
+    if compare:
+        for row in _compare_load(json.loads(compare.read_text()), results):
+            typer.echo(json.dumps(row))
+
+
+@cli.command("audit-queries")
+def audit_queries(
+    size: int = typer.Option(10000, help="Number of transactions to seed"),
+    customers: int = typer.Option(200, help="Number of customers the transactions are spread over"),
+    storage: str = typer.Option("sqlite", help="Backend for the scratch database: sqlite or mongo"),
+    seed: int = typer.Option(1, help="Random seed for the seeded ledger and the requests"),
+    strict: bool = typer.Option(True, help="Exit with status 1 if any query shape is flagged"),
+):
+    """Issue every route's queries against a scratch ledger and report each query shape's plan.
+
+    Shapes whose plan scans a whole collection or sorts in memory are listed first and flagged.
+    """
+    os.environ["LEDGER_STORAGE"] = storage
+    report = asyncio.run(_audit_queries(size, customers, seed))
+    for entry in report:
+        typer.echo(json.dumps(entry, default=str))
+    flagged = [entry for entry in report if entry.get("flags")]
+    typer.echo(f"{len(report)} query shapes, {len(flagged)} flagged.", err=True)
+    if flagged and strict:
+        raise typer.Exit(code=1)
+
+
+@cli.command("serve")
+def serve(
+    host: str = typer.Option("0.0.0.0", help="Interface to listen on"),
+    port: int = typer.Option(8001, help="Port to listen on"),
+    workers: int = typer.Option(os.cpu_count() or 1, help="Number of worker processes"),
+):
+    """Serve the API with uvicorn, one process per worker, to use every core of the shop server.
+
+    Each worker imports the app and opens its own database client in the app lifespan; size
+    MONGO_MAX_POOL_SIZE per worker. Process-local state is per worker: the read cache only sees
+    its own worker's writes (READ_CACHE_TTL_SECONDS bounds how stale another worker's reads can
+    be, and ETAG_LIFETIME_SECONDS, 300 unless set, how long its ETags can hide them), and
+    /metrics and /api/admin/query-plans describe the worker that answered.
+    SQLite is meant for one worker (--workers 1): several can share the file in WAL mode, but
+    writes take turns on its lock, and a worker's storage thread queues every query behind a
+    write waiting for that lock. Use MongoDB to serve from several workers.
+    Put a load balancer's health checks on /healthz (liveness) and /readyz (readiness).
+    """
+    import uvicorn
+
+    if workers > 1:
+        os.environ.setdefault("ETAG_LIFETIME_SECONDS", "300")
+    uvicorn.run("server:app", host=host, port=port, workers=workers, proxy_headers=True)
+
+
+if __name__ == "__main__":
+    cli()
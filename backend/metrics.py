@@ -0,0 +1,204 @@
+"""Request and database metrics in the Prometheus text exposition format.
+
+Samples are kept in plain dicts, so recording one costs a few dict operations and a bisect.
+HTTP metrics are only updated from the event loop thread; database metrics come from
+pymongo's monitoring callbacks, which Motor runs on its worker threads, and take
+Metrics.lock. Rendering takes the same lock, so it never iterates a dict being resized.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, Optional, Tuple
+
+from bson import json_util
+from pymongo import monitoring
+
+# Latency buckets in seconds; the low end resolves sub-millisecond local queries.
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Documents (or increments) per group-committed write.
+BATCH_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+slow_query_logger = logging.getLogger("goldsmith.slow_query")
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Tuple[str, ...], values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self.values: Dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self, kind: str = "counter") -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {kind}"]
+        lines += [f"{self.name}{format_labels(self.labels, labels)} {value}" for labels, value in self.values.items()]
+        return lines
+
+
+class Gauge(Counter):
+    def dec(self, *labels):
+        self.inc(*labels, amount=-1)
+
+    def render(self, kind: str = "gauge") -> list:
+        return super().render(kind)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: tuple = BUCKETS):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self.values: Dict[tuple, list] = {}
+
+    def observe(self, seconds: float, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, seconds)] += 1
+        entry[1] += seconds
+        entry[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {count}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "HTTP request latency by route.", ("method", "route"))
+        self.requests = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+        self.errors = Counter(
+            "http_request_errors_total", "HTTP requests that failed with a 5xx or an exception.", ("method", "route"))
+        self.in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served.")
+        self.db_duration = Histogram(
+            "db_command_duration_seconds", "Database command latency by collection and command.", ("collection", "command"))
+        self.db_failures = Counter("db_command_failures_total", "Failed database commands.", ("collection", "command"))
+        self.slow_queries = Counter("db_slow_queries_total", "Database commands slower than the slow-query threshold.",
+                                    ("collection", "command"))
+        self.write_batch_size = Histogram("write_buffer_batch_size", "Writes coalesced into one batch by the write buffer.",
+                                          ("collection", "operation"), BATCH_BUCKETS)
+        self.write_wait = Histogram("write_buffer_wait_seconds", "Time from a write entering the write buffer to its "
+                                    "batch being acknowledged.", ("collection", "operation"))
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            for metric in (self.request_duration, self.requests, self.errors, self.in_flight,
+                           self.db_duration, self.db_failures, self.slow_queries, self.write_batch_size, self.write_wait):
+                lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method and route template.
+
+    The route template (not the raw path) keeps label cardinality bounded; requests that match
+    no route are recorded as "unmatched".
+    """
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+        self.routes = None
+
+    def route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        if self.routes is None:
+            self.routes = {
+                getattr(route, "endpoint", None): route.path for route in scope["app"].routes if hasattr(route, "path")
+            }
+        return self.routes.get(endpoint, "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics = self.metrics
+        metrics.in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.in_flight.dec()
+            method, route = scope["method"], self.route_label(scope)
+            metrics.request_duration.observe(elapsed, method, route)
+            metrics.requests.inc(method, route, status)
+            if status >= 500:
+                metrics.errors.inc(method, route)
+
+
+class CommandTimer(monitoring.CommandListener):
+    """pymongo command listener feeding db_command_duration_seconds and the slow-query log.
+
+    The query document is only kept between the started and finished events when a
+    slow-query threshold is set, and is only serialized for commands that exceed it.
+    """
+
+    # Fields of a command document that describe what it filtered or changed.
+    DETAIL_FIELDS = ("filter", "sort", "pipeline", "query", "updates", "deletes", "projection", "limit")
+
+    def __init__(self, metrics: Metrics, slow_query_ms: Optional[float] = None):
+        self.metrics = metrics
+        self.slow_query_seconds = slow_query_ms / 1000 if slow_query_ms else None
+        self.pending: Dict[tuple, tuple] = {}
+
+    def started(self, event):
+        collection = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        if not isinstance(collection, str):
+            collection = ""
+        detail = None
+        if self.slow_query_seconds is not None:
+            detail = {field: event.command[field] for field in self.DETAIL_FIELDS if field in event.command}
+        self.pending[(event.request_id, event.connection_id)] = (collection, detail)
+
+    def _finish(self, event, failed: bool):
+        collection, detail = self.pending.pop((event.request_id, event.connection_id), ("", None))
+        seconds = event.duration_micros / 1e6
+        slow = self.slow_query_seconds is not None and seconds >= self.slow_query_seconds
+        with self.metrics.lock:
+            self.metrics.db_duration.observe(seconds, collection, event.command_name)
+            if failed:
+                self.metrics.db_failures.inc(collection, event.command_name)
+            if slow:
+                self.metrics.slow_queries.inc(collection, event.command_name)
+        if slow:
+            slow_query_logger.warning("%s.%s took %.1f ms: %s", collection, event.command_name, seconds * 1000,
+                                      json_util.dumps(detail)[:2000])
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
@@ -1,31 +1,249 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response, UploadFile, File
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.middleware.gzip import GZipMiddleware
+from bson import Int64, json_util
+from events import RESYNC, EventBus, sse
+from metrics import CommandTimer, Metrics, MetricsMiddleware
+from statements import MEDIA_TYPES, render_statement
+from storage import ENTITY_COLLECTIONS, QueryAudit, Storage, create_storage, scaled_units
+from write_buffer import WriteBuffer
+import asyncio
+import multiprocessing
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import AfterValidator, BaseModel, Field, ValidationError
+from typing import Annotated, List, Literal, Optional
 import uuid
-from datetime import datetime, date as DateType
-from decimal import Decimal
+import base64
+import csv
+import io
+import json
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from datetime import datetime, timedelta, date as DateType
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder with identical output
+    orjson = None
+
+try:
+    import analytics
+except ImportError:  # pandas and numpy are only needed with ANALYTICS enabled
+    analytics = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Storage
+# LEDGER_STORAGE picks the backend: "mongo" (MONGO_URL/DB_NAME) or "sqlite" (SQLITE_PATH).
+# With LEDGER_COMPACT_SCHEMA enabled, the Mongo backend stores customers, transactions and
+# jobs in its compact layout; the API only ever sees the plain one. Mongo pool size, timeouts
+# and wire compression come from the MONGO_* variables in storage.MONGO_CLIENT_OPTIONS.
+COMPACT_SCHEMA = os.environ.get("LEDGER_COMPACT_SCHEMA", "").lower() in ("1", "true", "yes")
+
+# Metrics
+# Served at /metrics in the Prometheus text format. Mongo commands slower than SLOW_QUERY_MS
+# are logged with their filter to the goldsmith.slow_query logger (0 disables the log).
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+metrics = Metrics()
+command_timer = CommandTimer(metrics, float(os.environ.get("SLOW_QUERY_MS", "100")))
+
+# Query-plan audit
+# With QUERY_AUDIT enabled, the first query of every distinct shape is explained and the plans
+# are served at /api/admin/query-plans, collection scans and in-memory sorts first.
+QUERY_AUDIT = os.environ.get("QUERY_AUDIT", "").lower() in ("1", "true", "yes")
+
+def open_storage() -> Storage:
+    """Create the configured backend and its database client.
+
+    The API does this in its lifespan, so every worker process opens its own client after
+    it starts (pymongo clients must not be shared across a fork). Commands that use the
+    ledger functions without the API assign `storage` themselves.
+    """
+    opened = create_storage(compact=COMPACT_SCHEMA, event_listeners=[command_timer] if METRICS_ENABLED else [])
+    if QUERY_AUDIT:
+        opened.audit = QueryAudit()
+    return opened
+
+# Write buffer
+# With WRITE_BUFFER enabled, concurrent inserts and balance/rollup increments arriving within
+# WRITE_BUFFER_LINGER_MS are written as one batch per collection of up to
+# WRITE_BUFFER_MAX_BATCH documents (0 ms batches whatever is queued by the next event loop
+# turn). Requests are answered once their batch is acknowledged.
+WRITE_BUFFER = os.environ.get("WRITE_BUFFER", "").lower() in ("1", "true", "yes")
+WRITE_BUFFER_MAX_BATCH = int(os.environ.get("WRITE_BUFFER_MAX_BATCH", "100"))
+WRITE_BUFFER_LINGER_MS = float(os.environ.get("WRITE_BUFFER_LINGER_MS", "2"))
+
+def with_write_buffer(opened: Storage) -> Storage:
+    if not WRITE_BUFFER:
+        return opened
+    return WriteBuffer(opened, WRITE_BUFFER_MAX_BATCH, WRITE_BUFFER_LINGER_MS / 1000, metrics if METRICS_ENABLED else None)
+
+storage: Optional[Storage] = None
+
+# Lifespan
+# The app is live (/healthz) as soon as it accepts requests and ready (/readyz) once warmup has
+# reached the database, created any missing index and built the balances of a ledger written
+# before they were maintained; warmup retries until it succeeds.
+READY_TIMEOUT_SECONDS = float(os.environ.get("READY_TIMEOUT_SECONDS", "2"))
+readiness = {"ready": False, "error": None}
+
+async def warm_up():
+    delay = 0.5
+    while True:
+        try:
+            await storage.ping()
+            await ensure_indexes()
+            await bootstrap_derived()
+        except Exception as error:
+            readiness["error"] = str(error)
+            logger.warning("Warmup failed, retrying in %.1fs: %s", delay, error)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+        else:
+            readiness.update(ready=True, error=None)
+            logger.info("Database reachable and indexes in place; ready to serve")
+            return
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global storage
+    storage = with_write_buffer(open_storage())
+    tasks = [asyncio.create_task(warm_up())]
+    if DASHBOARD_EVENTS == "changes":
+        tasks.append(asyncio.create_task(follow_changes()))
+    if ANALYTICS:
+        tasks.append(asyncio.create_task(follow_analytics()))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        readiness.update(ready=False, error=None)
+        await close_statement_pool()
+        await storage.close()
+
+# Live dashboard
+# GET /api/stream/dashboard sends the dashboard totals as a "snapshot" event, then "delta"
+# events from an in-process bus that clients add to their totals. DASHBOARD_EVENTS picks who
+# publishes: "local" (the write routes of this process; enough for a single worker) or
+# "changes" (the storage change feed, which sees writes from every worker). A fresh snapshot
+# every STREAM_SNAPSHOT_SECONDS bounds any drift; idle streams only cost keepalives.
+DASHBOARD_EVENTS = os.environ.get("DASHBOARD_EVENTS", "local").lower()
+if DASHBOARD_EVENTS not in ("local", "changes"):
+    raise ValueError(f"Unknown DASHBOARD_EVENTS {DASHBOARD_EVENTS!r}, expected 'local' or 'changes'")
+STREAM_KEEPALIVE_SECONDS = float(os.environ.get("STREAM_KEEPALIVE_SECONDS", "15"))
+STREAM_SNAPSHOT_SECONDS = float(os.environ.get("STREAM_SNAPSHOT_SECONDS", "300"))
+event_bus = EventBus(max_queue=int(os.environ.get("STREAM_QUEUE_SIZE", "256")))
+SNAPSHOT_ATTEMPTS = 5  # reads retried while writes keep landing; the next snapshot corrects any drift
+
+# Read cache
+BOOT_ID = uuid.uuid4().hex[:12]
+
+class ReadCache:
+    """In-process LRU cache for hot read endpoints (dashboard, balances).
+
+    Entries are stamped with the global and per-customer write versions at the time they
+    were computed. Write routes bump those versions, so a local write makes every dependent
+    entry unreachable immediately; the TTL bounds staleness from writes in other processes.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, etag_lifetime: float = 0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.etag_lifetime = etag_lifetime
+        self.hits = 0
+        self.misses = 0
+        self.global_version = 0
+        self.customer_versions = {}
+        self.collection_versions = {}
+        self._entries = OrderedDict()
+
+    def etag(self, collection: Optional[str] = None) -> str:
+        """Weak ETag for a collection (or all collections) derived from write versions, not the body.
+
+        Weak because GZipMiddleware sends the same tag on compressed and identity bodies. The
+        process boot id keeps tags from colliding across restarts and workers. With an
+        etag_lifetime, an epoch rolls them over so writes made by other processes become visible.
+        """
+        version = self.global_version if collection is None else self.collection_versions.get(collection, 0)
+        epoch = int(time.time() // self.etag_lifetime) if self.etag_lifetime > 0 else 0
+        return f'W/"{BOOT_ID}-{collection or "all"}-{version}-{epoch}"'
+
+    def version(self, customer_id: Optional[str] = None) -> tuple:
+        if customer_id is None:
+            return (self.global_version,)
+        return (self.customer_versions.get(customer_id, 0),)
+
+    def invalidate(self, collection: str, *customer_ids: str):
+        """Record a write. Every write bumps the global and collection versions, plus the touched customers'."""
+        self.global_version += 1
+        self.collection_versions[collection] = self.collection_versions.get(collection, 0) + 1
+        for customer_id in customer_ids:
+            self.customer_versions[customer_id] = self.customer_versions.get(customer_id, 0) + 1
+
+    def get(self, key: tuple, version: tuple):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] != version or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key: tuple, version: tuple, value):
+        self._entries[key] = (version, time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "global_version": self.global_version,
+        }
+
+# ETags only change with this process's writes unless ETAG_LIFETIME_SECONDS is set. That
+# is exact for a single worker; with several (`manage.py serve` sets it for them) the
+# lifetime bounds how long a client can keep getting 304s for data another worker changed.
+ETAG_LIFETIME_SECONDS = float(os.environ.get("ETAG_LIFETIME_SECONDS", "0"))
+read_cache = ReadCache(
+    max_entries=int(os.environ.get("READ_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.environ.get("READ_CACHE_TTL_SECONDS", "5")),
+    etag_lifetime=ETAG_LIFETIME_SECONDS,
+)
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # Models
+def ledger_date(value: str) -> str:
+    """Accept only YYYY-MM-DD dates: periods, checkpoints and date ranges compare them as strings."""
+    try:
+        valid = DateType.fromisoformat(value).isoformat() == value
+    except ValueError:
+        valid = False
+    if not valid:
+        raise ValueError("Date must be a calendar date in YYYY-MM-DD format")
+    return value
+
+LedgerDate = Annotated[str, AfterValidator(ledger_date)]
+
 class Customer(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
@@ -42,7 +260,7 @@ class Transaction(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     customer_id: str
     customer_name: str
-    date: str = Field(default_factory=lambda: DateType.today().isoformat())
+    date: LedgerDate = Field(default_factory=lambda: DateType.today().isoformat())
     work_description: str
     gold_in: float = 0.0  # grams received from customer
     gold_out: float = 0.0  # grams given back to customer
@@ -59,7 +277,7 @@ class TransactionCreate(BaseModel):
     cash_in: float = 0.0
     labour_charge: float = 0.0
     remarks: Optional[str] = None
-    date: Optional[str] = None
+    date: Optional[LedgerDate] = None
 
 class Job(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -76,6 +294,26 @@ class JobCreate(BaseModel):
     status: str = "In Progress"
     expected_delivery: Optional[str] = None
 
+class CustomerBalance(BaseModel):
+    customer_id: str
+    gold_balance: float
+    money_balance: float
+
+class TransactionBatchResult(BaseModel):
+    index: int
+    transaction: Optional[Transaction] = None
+    error: Optional[str] = None
+
+class Rollup(BaseModel):
+    granularity: str
+    period: str
+    customer_id: Optional[str] = None
+    gold_in: float = 0.0
+    gold_out: float = 0.0
+    cash_in: float = 0.0
+    labour_charge: float = 0.0
+    transaction_count: int = 0
+
 class DashboardStats(BaseModel):
     total_gold_balance: float
     total_money_balance: float
@@ -83,42 +321,574 @@ class DashboardStats(BaseModel):
     total_customers: int
     total_transactions: int
 
+class SyncChange(BaseModel):
+    key: str  # idempotency key, unique per change; a retried change reuses it
+    collection: Literal["customers", "transactions", "jobs"]
+    op: Literal["upsert", "delete"]
+    id: Optional[str] = None  # for deletes
+    document: Optional[dict] = None  # for upserts, in the offline ledger or the API field names
+
+class SyncPush(BaseModel):
+    changes: List[SyncChange]
+
+class SyncResult(BaseModel):
+    key: str
+    status: str  # "created", "updated", "deleted", "unchanged" or "error"
+    id: Optional[str] = None
+    error: Optional[str] = None
+    replayed: bool = False  # the key was seen before; this is the original result
+
+# Fixed-point storage
+# With LEDGER_FIXED_POINT enabled, gold is stored as integer milligrams and money as integer
+# paise. The API keeps accepting and returning decimals; sums in Mongo are exact int64.
+FIXED_POINT = os.environ.get("LEDGER_FIXED_POINT", "").lower() in ("1", "true", "yes")
+GOLD_SCALE = 1000  # milligrams per gram
+MONEY_SCALE = 100  # paise per rupee
+AMOUNT_SCALES = {"gold_in": GOLD_SCALE, "gold_out": GOLD_SCALE, "cash_in": MONEY_SCALE, "labour_charge": MONEY_SCALE}
+
+def to_units(value: float, scale: int) -> Int64:
+    return Int64(scaled_units(value, scale))
+
+def stored(document: dict) -> dict:
+    """The document as it is written to Mongo: amounts converted to integer units in fixed-point mode."""
+    if not FIXED_POINT:
+        return document
+    document = dict(document)
+    for field, scale in AMOUNT_SCALES.items():
+        if document.get(field) is not None:
+            document[field] = to_units(document[field], scale)
+    return document
+
+def gold_value(value) -> float:
+    return round(value / GOLD_SCALE if FIXED_POINT else value, 3)
+
+def money_value(value) -> float:
+    return round(value / MONEY_SCALE if FIXED_POINT else value, 2)
+
+def amount_value(field: str, value) -> float:
+    """A stored gold_in/gold_out/cash_in/labour_charge amount (or sum of them) as returned by the API."""
+    return (gold_value if AMOUNT_SCALES[field] == GOLD_SCALE else money_value)(value)
+
+async def customer_names(customer_ids) -> dict:
+    """Map customer id -> name with a single $in query."""
+    customers = await storage.find("customers", {"id": {"$in": list(customer_ids)}}, fields=("id", "name"))
+    return {customer["id"]: customer["name"] for customer in customers}
+
+# Fast serialization
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value) -> bytes:
+    """Compact JSON with the same bytes FastAPI's JSONResponse would produce."""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":"), default=json_default).encode()
+
+def parse_fields(model, fields: Optional[str]) -> Optional[tuple]:
+    """Turn a `fields=a,b` query parameter into a tuple of model fields (in model order), or None for all."""
+    if not fields:
+        return None
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(model.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown field(s): {', '.join(sorted(unknown))}")
+    return tuple(field for field in model.model_fields if field in requested)
+
+def read_fields(model, fields: Optional[tuple] = None) -> tuple:
+    """The fields to read from storage for `model`: the requested subset, or all of them."""
+    return fields or tuple(model.model_fields)
+
+def field_decoder(name: str, info):
+    if FIXED_POINT and name in AMOUNT_SCALES:
+        scale = AMOUNT_SCALES[name]
+        return lambda value: value / scale
+    if info.annotation is float:
+        return float
+    return None
+
+@lru_cache(maxsize=None)
+def row_encoder(model, fields: Optional[tuple] = None):
+    """Build a function turning a Mongo document into the dict `model` would serialize to.
+
+    Fields come out in model order, floats are coerced the way validation would coerce them
+    (fixed-point amounts are scaled back to decimals) and missing fields take the model
+    default, without constructing a model per row. With `fields` only that subset is emitted,
+    so sparse fieldsets never fail validation.
+    """
+    fields = [
+        (name, field_decoder(name, info), info)
+        for name, info in model.model_fields.items()
+        if fields is None or name in fields
+    ]
+
+    def encode(document: dict) -> dict:
+        row = {}
+        for name, coerce, info in fields:
+            if name in document:
+                value = document[name]
+                if coerce is not None and value is not None:
+                    value = coerce(value)
+            else:
+                value = info.get_default(call_default_factory=True)
+            row[name] = value
+        return row
+
+    return encode
+
+def json_response(content, response: Optional[Response] = None) -> Response:
+    headers = {}
+    if response is not None:
+        headers = {key: value for key, value in response.headers.items() if key not in ("content-length", "content-type")}
+    return Response(dumps(content), media_type="application/json", headers=headers)
+
+def list_response(model, documents: List[dict], response: Response, fields: Optional[tuple] = None) -> Response:
+    """Serialize documents straight to JSON, skipping per-row model construction and response_model validation."""
+    encode = row_encoder(model, fields)
+    return json_response([encode(document) for document in documents], response)
+
+def partial_response(obj: BaseModel, fields: Optional[tuple], response: Optional[Response] = None):
+    """Return `obj` as is, or only the requested fields of it."""
+    if fields is None:
+        return obj
+    return json_response(obj.model_dump(mode="json", include=set(fields)), response)
+
+# Ledger bookkeeping
+def balance_delta(transaction: dict, sign: int = 1) -> dict:
+    """$inc document applying (sign=1) or reverting (sign=-1) a transaction on its customer's balance."""
+    return {
+        # Gold balance: gold_in (received from customer) - gold_out (given back to customer)
+        "gold_balance": sign * (transaction.get("gold_in", 0) - transaction.get("gold_out", 0)),
+        # Money balance: cash_in (received) + labour_charge (earned)
+        "money_balance": sign * (transaction.get("cash_in", 0) + transaction.get("labour_charge", 0)),
+        "transaction_count": sign,
+    }
+
+async def apply_balance_delta(transaction: dict, sign: int = 1, event: Optional[dict] = None):
+    """Apply (sign=1) or revert (sign=-1) a transaction on its customer's balance, rollups and checkpoints.
+
+    The dashboard `event` is published together with the invalidation that follows the
+    balance write (see stream_dashboard); the cache is invalidated once more when the
+    rollups and checkpoints are up to date.
+    """
+    await storage.increment("balances", [
+        (transaction["customer_id"], balance_delta(transaction, sign), {"updated_at": datetime.utcnow()})
+    ])
+    read_cache.invalidate("transactions", transaction["customer_id"])
+    if event is not None:
+        publish_delta(event)
+    await apply_rollup_deltas([transaction], sign)
+    await expire_checkpoints([transaction])
+    read_cache.invalidate("transactions", transaction["customer_id"])
+
+async def apply_balance_deltas(transactions: List[dict], sign: int = 1, event: Optional[dict] = None):
+    """Apply many transactions to the balances collection with one $inc per customer, like apply_balance_delta."""
+    totals = {}
+    for transaction in transactions:
+        delta = balance_delta(transaction, sign)
+        customer_totals = totals.setdefault(transaction["customer_id"], dict.fromkeys(delta, 0))
+        for field, value in delta.items():
+            customer_totals[field] += value
+    if not totals:
+        return
+    now = datetime.utcnow()
+    await storage.increment("balances", [
+        (customer_id, inc, {"updated_at": now}) for customer_id, inc in totals.items()
+    ])
+    read_cache.invalidate("transactions", *totals)
+    if event is not None:
+        publish_delta(event)
+    await apply_rollup_deltas(transactions, sign)
+    await expire_checkpoints(transactions)
+    read_cache.invalidate("transactions", *totals)
+
+async def rebuild_balances(fix: bool = False, tolerance: float = 1e-6) -> List[dict]:
+    """Recompute every balance from the raw ledger and report drift against the balances collection.
+
+    With fix=True the stored balances are overwritten with the recomputed values and
+    balances for customers without any transactions are removed.
+    """
+    expected = await storage.ledger_balances()
+    current = {row["_id"]: row for row in await storage.find("balances")}
+
+    drift = []
+    for customer_id in set(expected) | set(current):
+        want = expected.get(customer_id, {})
+        have = current.get(customer_id, {})
+        diffs = {}
+        for field in ("gold_balance", "money_balance", "transaction_count"):
+            want_value = want.get(field, 0)
+            have_value = have.get(field, 0)
+            if abs(want_value - have_value) > tolerance:
+                diffs[field] = {"expected": want_value, "stored": have_value}
+        if diffs:
+            drift.append({"customer_id": customer_id, "drift": diffs})
+
+    if fix:
+        for item in drift:
+            customer_id = item["customer_id"]
+            if customer_id in expected:
+                row = expected[customer_id]
+                await storage.replace_one("balances", customer_id, {
+                    "gold_balance": row["gold_balance"],
+                    "money_balance": row["money_balance"],
+                    "transaction_count": row["transaction_count"],
+                    "updated_at": datetime.utcnow(),
+                })
+            else:
+                await storage.delete_one("balances", {"_id": customer_id})
+        read_cache.invalidate("balances", *(item["customer_id"] for item in drift))
+
+    return drift
+
+# Rollups
+ROLLUP_GRANULARITIES = {"day": 10, "month": 7}  # period = prefix of the ISO transaction date
+ROLLUP_SUMS = ("gold_in", "gold_out", "cash_in", "labour_charge")
+SHOP_WIDE = "*"
+
+def rollup_id(granularity: str, customer_id: Optional[str], period: str) -> str:
+    return f"{granularity}|{customer_id or SHOP_WIDE}|{period}"
+
+async def apply_rollup_deltas(transactions: List[dict], sign: int = 1):
+    """Add (sign=1) or remove (sign=-1) transactions from the per-customer and shop-wide day/month rollups."""
+    totals = {}
+    for transaction in transactions:
+        for granularity, length in ROLLUP_GRANULARITIES.items():
+            period = transaction["date"][:length]
+            for customer_id in (transaction["customer_id"], None):
+                key = (granularity, customer_id, period)
+                inc = totals.setdefault(key, dict.fromkeys(ROLLUP_SUMS + ("transaction_count",), 0))
+                for field in ROLLUP_SUMS:
+                    inc[field] += sign * transaction.get(field, 0)
+                inc["transaction_count"] += sign
+    if not totals:
+        return
+    await storage.increment("rollups", [
+        (rollup_id(granularity, customer_id, period), inc,
+         {"granularity": granularity, "customer_id": customer_id, "period": period})
+        for (granularity, customer_id, period), inc in totals.items()
+    ])
+
+async def rebuild_rollups() -> int:
+    """Recompute every rollup document from the raw ledger. Returns the number of rollups written."""
+    await storage.delete_many("rollups", {})
+    written = 0
+    for granularity, length in ROLLUP_GRANULARITIES.items():
+        for per_customer in (True, False):
+            batch = []
+            async for row in storage.ledger_rollups(length, per_customer, ROLLUP_SUMS):
+                row.update(granularity=granularity, _id=rollup_id(granularity, row["customer_id"], row["period"]))
+                batch.append(row)
+                if len(batch) == 1000:
+                    await storage.insert_many("rollups", batch)
+                    written += len(batch)
+                    batch = []
+            if batch:
+                await storage.insert_many("rollups", batch)
+                written += len(batch)
+    return written
+
+async def migrate_fixed_point() -> dict:
+    """Convert float amounts to integer units in place, then rebuild everything derived from them."""
+    converted = await storage.convert_amounts(AMOUNT_SCALES)
+    await rebuild_balances(fix=True)
+    converted["rollups"] = await rebuild_rollups()
+    converted["checkpoints"] = await rebuild_checkpoints()
+    return converted
+
+async def migrate_compact_schema() -> dict:
+    """Rewrite customers, transactions and jobs in the compact layout and rebuild their indexes."""
+    result = await storage.migrate_compact_schema(EXPECTED_INDEXES)
+    for collection in ("customers", "transactions", "jobs"):
+        read_cache.invalidate(collection)
+    return result
+
+# Balance checkpoints
+def previous_month(month: str) -> str:
+    year, number = int(month[:4]), int(month[5:7])
+    if number == 1:
+        return f"{year - 1}-12"
+    return f"{year}-{number - 1:02d}"
+
+def checkpoint_id(customer_id: str, month: str) -> str:
+    return f"{customer_id}|{month}"
+
+async def checkpoint_generation(customer_id: str) -> int:
+    document = await storage.find_one("checkpoint_generations", {"_id": customer_id})
+    return document["generation"] if document else 0
+
+async def expire_checkpoints(transactions: List[dict]):
+    """Drop month-end checkpoints made stale by transactions dated in a closed month.
+
+    Checkpoints only exist for closed months, so current-month writes never touch them.
+    Dropped checkpoints are rebuilt from the monthly rollups by the next as-of query. The
+    customer's checkpoint generation is bumped first, so an as-of query that read the
+    rollups before this write can tell its checkpoint is stale (see balance_as_of).
+    """
+    current_month = DateType.today().isoformat()[:7]
+    earliest = {}
+    for transaction in transactions:
+        month = transaction["date"][:7]
+        if month < current_month and month < earliest.get(transaction["customer_id"], current_month):
+            earliest[transaction["customer_id"]] = month
+    now = datetime.utcnow()
+    await storage.increment("checkpoint_generations", [
+        (customer_id, {"generation": 1}, {"updated_at": now}) for customer_id in earliest
+    ])
+    for customer_id, month in earliest.items():
+        await storage.delete_many("balance_checkpoints", {"customer_id": customer_id, "month": {"$gte": month}})
+
+async def balance_as_of(customer_id: str, as_of: DateType) -> dict:
+    """Gold and money balance at the end of `as_of`.
+
+    Reads the nearest month-end checkpoint before as_of's month, the monthly rollups between
+    that checkpoint and the month, and only the month's own transactions up to as_of. The
+    checkpoint for the month before as_of is saved, so the next query starts from it.
+
+    A backdated write can land between reading the rollups and saving that checkpoint, and
+    its expire_checkpoints would then run before there is anything to drop. The save is
+    therefore conditional on the customer's checkpoint generation: if it moved while the
+    balance was computed, the checkpoint just saved is withdrawn again.
+    """
+    month = as_of.isoformat()[:7]
+    generation = await checkpoint_generation(customer_id)
+    checkpoint = await storage.find_one(
+        "balance_checkpoints", {"customer_id": customer_id, "month": {"$lt": month}}, sort=[("month", -1)]
+    )
+    gold = checkpoint["gold_balance"] if checkpoint else 0
+    money = checkpoint["money_balance"] if checkpoint else 0
+
+    period = {"$lt": month}
+    if checkpoint:
+        period["$gt"] = checkpoint["month"]
+    for rollup in await storage.find("rollups", {"granularity": "month", "customer_id": customer_id, "period": period}):
+        gold += rollup.get("gold_in", 0) - rollup.get("gold_out", 0)
+        money += rollup.get("cash_in", 0) + rollup.get("labour_charge", 0)
+
+    closed_month = previous_month(month)
+    if closed_month < DateType.today().isoformat()[:7] and (not checkpoint or checkpoint["month"] != closed_month):
+        await storage.replace_one("balance_checkpoints", checkpoint_id(customer_id, closed_month), {
+            "customer_id": customer_id, "month": closed_month, "gold_balance": gold, "money_balance": money,
+        })
+        if await checkpoint_generation(customer_id) != generation:
+            await storage.delete_one("balance_checkpoints", {"_id": checkpoint_id(customer_id, closed_month)})
+
+    query = {"customer_id": customer_id, "date": {"$gte": f"{month}-01", "$lte": as_of.isoformat()}}
+    for transaction in await storage.find("transactions", query, fields=ROLLUP_SUMS):
+        delta = balance_delta(transaction)
+        gold += delta["gold_balance"]
+        money += delta["money_balance"]
+    return {"gold_balance": gold, "money_balance": money}
+
+async def rebuild_checkpoints() -> int:
+    """Recompute month-end checkpoints for every customer and closed month with activity."""
+    current_month = DateType.today().isoformat()[:7]
+    await storage.delete_many("balance_checkpoints", {})
+    written = 0
+    customer_id, gold, money = None, 0, 0
+    query = {"granularity": "month", "customer_id": {"$ne": None}, "period": {"$lt": current_month}}
+    async for rollups in storage.iterate("rollups", query, sort=[("customer_id", 1), ("period", 1)]):
+        batch = []
+        for rollup in rollups:
+            if rollup["customer_id"] != customer_id:
+                customer_id, gold, money = rollup["customer_id"], 0, 0
+            gold += rollup.get("gold_in", 0) - rollup.get("gold_out", 0)
+            money += rollup.get("cash_in", 0) + rollup.get("labour_charge", 0)
+            batch.append({"_id": checkpoint_id(customer_id, rollup["period"]), "customer_id": customer_id,
+                          "month": rollup["period"], "gold_balance": gold, "money_balance": money})
+        await storage.insert_many("balance_checkpoints", batch)
+        written += len(batch)
+    return written
+
+async def bootstrap_derived():
+    """Build the balances and rollups of a ledger that has transactions but none yet, e.g. on first deploy.
+
+    Without this every balance and the dashboard totals read 0 until `manage.py
+    verify-balances --fix` is run, and reports and as-of balances leave out all earlier
+    history. Checkpoints are rebuilt with the rollups, since any saved so far summed none.
+    """
+    if not await storage.find_one("transactions", {}, sort=TRANSACTION_SORT, fields=("id",)):
+        return
+    if not await storage.find_one("balances", {}, sort=[("_id", 1)]):
+        logger.info("Balances are empty on a populated ledger; rebuilding them")
+        await rebuild_balances(fix=True)
+    if not await storage.find_one("rollups", {}, sort=[("_id", 1)]):
+        logger.info("Rollups are empty on a populated ledger; rebuilding them and the checkpoints")
+        await rebuild_rollups()
+        await rebuild_checkpoints()
+
+# Indexes
+EXPECTED_INDEXES = {
+    "customers": [
+        {"name": "id_1", "keys": [("id", 1)], "unique": True},
+        {"name": "name_1_id_1", "keys": [("name", 1), ("id", 1)]},
+    ],
+    "transactions": [
+        {"name": "id_1", "keys": [("id", 1)], "unique": True},
+        {"name": "customer_id_1_date_-1_id_-1", "keys": [("customer_id", 1), ("date", -1), ("id", -1)]},
+        {"name": "date_-1_id_-1", "keys": [("date", -1), ("id", -1)]},
+    ],
+    "rollups": [
+        {"name": "granularity_1_customer_id_1_period_1", "keys": [("granularity", 1), ("customer_id", 1), ("period", 1)]},
+    ],
+    "balance_checkpoints": [
+        {"name": "customer_id_1_month_-1", "keys": [("customer_id", 1), ("month", -1)]},
+    ],
+    "jobs": [
+        {"name": "id_1", "keys": [("id", 1)], "unique": True},
+        {"name": "status_1_created_at_-1_id_-1", "keys": [("status", 1), ("created_at", -1), ("id", -1)]},
+        {"name": "created_at_-1_id_-1", "keys": [("created_at", -1), ("id", -1)]},
+        {"name": "customer_id_1", "keys": [("customer_id", 1)]},  # delete_customer's job check
+    ],
+    "sync_log": [
+        {"name": "at_1__id_1", "keys": [("at", 1), ("_id", 1)]},
+    ],
+    "sync_keys": [
+        {"name": "at_1", "keys": [("at", 1)]},
+    ],
+}
+
+async def ensure_indexes():
+    """Create any missing index from EXPECTED_INDEXES. Existing indexes are left untouched."""
+    await storage.ensure_indexes(EXPECTED_INDEXES)
+
+async def index_report() -> dict:
+    """Expected versus actual indexes per collection, with on-disk index sizes."""
+    return await storage.index_report(EXPECTED_INDEXES)
+
+# Conditional GETs
+def opaque_tag(etag: str) -> str:
+    return etag.strip().removeprefix("W/")
+
+def check_etag(request: Request, response: Response, etag: str) -> Optional[Response]:
+    """Return a 304 response when the client already holds `etag`, otherwise tag `response`.
+
+    If-None-Match uses the weak comparison, so a W/ prefix on either side is ignored.
+    """
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*"
+                          or opaque_tag(etag) in [opaque_tag(tag) for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# Keyset pagination
+CUSTOMER_SORT = [("name", 1), ("id", 1)]
+TRANSACTION_SORT = [("date", -1), ("id", -1)]
+JOB_SORT = [("created_at", -1), ("id", -1)]
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(document: dict, sort: List[tuple]) -> str:
+    values = [document[field] for field, _ in sort]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode()).decode()
+
+CURSOR_TYPES = {"created_at": datetime, "at": datetime}  # sort fields that are not strings
+
+def decode_cursor(cursor: str, sort: List[tuple]) -> list:
+    """The cursor's sort key values. Each must have its field's type: anything else (a dict
+    would become a query operator) is rejected with 400."""
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(sort) or not all(
+        isinstance(value, CURSOR_TYPES.get(field, str)) for value, (field, _) in zip(values, sort)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def keyset_filter(values: list, sort: List[tuple]) -> dict:
+    """Filter matching documents that sort strictly after the cursor position.
+
+    The plain bound on the leading sort key is implied by the $or, but it is what lets the
+    index seek to the cursor: SQLite cannot derive a range from an OR and walks the whole index.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prev_field: values[j] for j, (prev_field, _) in enumerate(sort[:i])}
+        clause[field] = {"$gt" if direction == 1 else "$lt": values[i]}
+        clauses.append(clause)
+    leading, direction = sort[0]
+    return {leading: {"$gte" if direction == 1 else "$lte": values[0]}, "$or": clauses}
+
+async def fetch_page(collection: str, query: dict, sort: List[tuple], limit: int, after: Optional[str],
+                     response: Response, fields: Optional[tuple] = None) -> List[dict]:
+    """Read one page in sort order and set the X-Next-Cursor header when more documents follow.
+
+    Pages are located with a range filter on the sort keys rather than skip, so every page
+    is an index seek regardless of how deep into the list it is.
+    """
+    if after:
+        query = {"$and": [query, keyset_filter(decode_cursor(after, sort), sort)]}
+    if fields is not None:
+        # The cursor is built from the sort keys, so they are read even when not requested.
+        fields = fields + tuple(field for field, _ in sort if field not in fields)
+    documents = await storage.find(collection, query, sort, limit + 1, fields)
+    if len(documents) > limit:
+        documents = documents[:limit]
+        response.headers["X-Next-Cursor"] = encode_cursor(documents[-1], sort)
+    return documents
+
 # Customer Routes
+def invalidate_customer(customer_id: str):
+    """Record a change to a customer. In the compact schema transactions and jobs read the
+    customer's name from it, so their ETags have to change as well."""
+    read_cache.invalidate("customers", customer_id)
+    if COMPACT_SCHEMA:
+        read_cache.invalidate("transactions")
+        read_cache.invalidate("jobs")
+
 @api_router.post("/customers", response_model=Customer)
 async def create_customer(customer: CustomerCreate):
-    customer_dict = customer.dict()
+    customer_dict = customer.model_dump()
     customer_obj = Customer(**customer_dict)
-    await db.customers.insert_one(customer_obj.dict())
+    await storage.insert_one("customers", customer_obj.model_dump())
+    read_cache.invalidate("customers", customer_obj.id)
+    publish_delta(customer_event("customer_added", customer_obj.id, 1))
+    await record_changes("customers", [customer_obj.id])
     return customer_obj
 
 @api_router.get("/customers", response_model=List[Customer])
-async def get_customers():
-    customers = await db.customers.find().sort("name", 1).to_list(1000)
-    return [Customer(**customer) for customer in customers]
+async def get_customers(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    selected = parse_fields(Customer, fields)
+    not_modified = check_etag(request, response, read_cache.etag("customers"))
+    if not_modified:
+        return not_modified
+    customers = await fetch_page("customers", {}, CUSTOMER_SORT, limit, after, response, read_fields(Customer, selected))
+    return list_response(Customer, customers, response, selected)
 
 @api_router.get("/customers/{customer_id}", response_model=Customer)
-async def get_customer(customer_id: str):
-    customer = await db.customers.find_one({"id": customer_id})
+async def get_customer(customer_id: str, fields: Optional[str] = None):
+    selected = parse_fields(Customer, fields)
+    customer = await storage.find_one("customers", {"id": customer_id}, fields=read_fields(Customer, selected))
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return Customer(**customer)
+    return json_response(row_encoder(Customer, selected)(customer))
 
 @api_router.put("/customers/{customer_id}", response_model=Customer)
 async def update_customer(customer_id: str, customer_update: CustomerCreate):
-    result = await db.customers.update_one(
-        {"id": customer_id}, 
-        {"$set": customer_update.dict()}
-    )
-    if result.matched_count == 0:
+    matched = await storage.update_one("customers", {"id": customer_id}, customer_update.model_dump())
+    if not matched:
         raise HTTPException(status_code=404, detail="Customer not found")
+    invalidate_customer(customer_id)
+    await record_changes("customers", [customer_id])
     
-    updated_customer = await db.customers.find_one({"id": customer_id})
+    updated_customer = await storage.find_one("customers", {"id": customer_id})
     return Customer(**updated_customer)
 
 @api_router.delete("/customers/{customer_id}")
 async def delete_customer(customer_id: str):
     # Check if customer has transactions
-    transactions = await db.transactions.find({"customer_id": customer_id}).to_list(10)
+    transactions = await storage.find("transactions", {"customer_id": customer_id}, limit=10, fields=("id",))
     if transactions:
         raise HTTPException(
             status_code=400, 
@@ -126,147 +896,1026 @@ async def delete_customer(customer_id: str):
         )
     
     # Check if customer has jobs
-    jobs = await db.jobs.find({"customer_id": customer_id}).to_list(10)
+    jobs = await storage.find("jobs", {"customer_id": customer_id}, limit=10, fields=("id",))
     if jobs:
         raise HTTPException(
             status_code=400, 
             detail=f"Cannot delete customer. Customer has {len(jobs)} job(s). Delete jobs first."
         )
     
-    result = await db.customers.delete_one({"id": customer_id})
-    if result.deleted_count == 0:
+    deleted = await storage.delete_one("customers", {"id": customer_id})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Customer not found")
+    read_cache.invalidate("customers", customer_id)
+    publish_delta(customer_event("customer_deleted", customer_id, -1))
+    await storage.delete_one("balances", {"_id": customer_id})  # all zero, since it has no transactions
+    await record_changes("customers", [customer_id], deleted=True)
     return {"message": "Customer deleted successfully"}
 
 @api_router.delete("/transactions/{transaction_id}")
 async def delete_transaction(transaction_id: str):
-    result = await db.transactions.delete_one({"id": transaction_id})
-    if result.deleted_count == 0:
+    transaction = await storage.find_one_and_delete("transactions", {"id": transaction_id})
+    if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
+    await apply_balance_delta(transaction, -1, transaction_event("transaction_deleted", [transaction], -1))
+    await record_changes("transactions", [transaction_id], deleted=True)
     return {"message": "Transaction deleted successfully"}
 
 @api_router.delete("/jobs/{job_id}")
 async def delete_job(job_id: str):
-    result = await db.jobs.delete_one({"id": job_id})
-    if result.deleted_count == 0:
+    job = await storage.find_one_and_delete("jobs", {"id": job_id})
+    if not job:
         raise HTTPException(status_code=404, detail="Job not found")
+    read_cache.invalidate("jobs")
+    publish_delta(job_event("job_deleted", job_id, job.get("status"), None))
+    await record_changes("jobs", [job_id], deleted=True)
     return {"message": "Job deleted successfully"}
 
 # Transaction Routes
 @api_router.post("/transactions", response_model=Transaction)
 async def create_transaction(transaction: TransactionCreate):
     # Get customer details
-    customer = await db.customers.find_one({"id": transaction.customer_id})
+    customer = await storage.find_one("customers", {"id": transaction.customer_id}, fields=("id", "name"))
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
-    transaction_dict = transaction.dict()
+    transaction_dict = transaction.model_dump()
     if transaction_dict["date"] is None:
         transaction_dict["date"] = DateType.today().isoformat()
     
     transaction_dict["customer_name"] = customer["name"]
     transaction_obj = Transaction(**transaction_dict)
-    await db.transactions.insert_one(transaction_obj.dict())
+    document = stored(transaction_obj.model_dump())
+    await storage.insert_one("transactions", document)
+    await apply_balance_delta(document, event=transaction_event("transaction_added", [document], 1))
+    await record_changes("transactions", [document["id"]])
     return transaction_obj
 
+@api_router.post("/transactions/batch", response_model=List[TransactionBatchResult])
+async def create_transactions_batch(transactions: List[TransactionCreate]):
+    names = await customer_names({transaction.customer_id for transaction in transactions})
+
+    results = []
+    documents, positions = [], []
+    for index, transaction in enumerate(transactions):
+        if transaction.customer_id not in names:
+            results.append(TransactionBatchResult(index=index, error="Customer not found"))
+            continue
+        transaction_dict = transaction.model_dump()
+        if transaction_dict["date"] is None:
+            transaction_dict["date"] = DateType.today().isoformat()
+        transaction_dict["customer_name"] = names[transaction.customer_id]
+        transaction_obj = Transaction(**transaction_dict)
+        results.append(TransactionBatchResult(index=index, transaction=transaction_obj))
+        documents.append(stored(transaction_obj.model_dump()))
+        positions.append(index)
+    if not documents:
+        return results
+
+    failed = await storage.insert_many("transactions", documents)
+    for position, error in failed.items():
+        result = results[positions[position]]
+        result.transaction = None
+        result.error = error
+    inserted = [document for position, document in enumerate(documents) if position not in failed]
+    await apply_balance_deltas(inserted, event=transaction_event("transactions_added", inserted, 1))
+    await record_changes("transactions", [document["id"] for document in inserted])
+    return results
+
 @api_router.get("/transactions", response_model=List[Transaction])
-async def get_transactions(customer_id: Optional[str] = None):
+async def get_transactions(
+    request: Request,
+    response: Response,
+    customer_id: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    selected = parse_fields(Transaction, fields)
+    not_modified = check_etag(request, response, read_cache.etag("transactions"))
+    if not_modified:
+        return not_modified
     query = {}
     if customer_id:
         query["customer_id"] = customer_id
     
-    transactions = await db.transactions.find(query).sort("date", -1).to_list(1000)
-    return [Transaction(**transaction) for transaction in transactions]
+    transactions = await fetch_page("transactions", query, TRANSACTION_SORT, limit, after, response,
+                                    read_fields(Transaction, selected))
+    return list_response(Transaction, transactions, response, selected)
 
 @api_router.get("/transactions/{transaction_id}", response_model=Transaction)
-async def get_transaction(transaction_id: str):
-    transaction = await db.transactions.find_one({"id": transaction_id})
+async def get_transaction(transaction_id: str, fields: Optional[str] = None):
+    selected = parse_fields(Transaction, fields)
+    transaction = await storage.find_one("transactions", {"id": transaction_id}, fields=read_fields(Transaction, selected))
     if not transaction:
         raise HTTPException(status_code=404, detail="Transaction not found")
-    return Transaction(**transaction)
+    return json_response(row_encoder(Transaction, selected)(transaction))
 
 # Job Routes
 @api_router.post("/jobs", response_model=Job)
 async def create_job(job: JobCreate):
     # Get customer details
-    customer = await db.customers.find_one({"id": job.customer_id})
+    customer = await storage.find_one("customers", {"id": job.customer_id}, fields=("id", "name"))
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
-    job_dict = job.dict()
+    job_dict = job.model_dump()
     job_dict["customer_name"] = customer["name"]
     job_obj = Job(**job_dict)
-    await db.jobs.insert_one(job_obj.dict())
+    await storage.insert_one("jobs", job_obj.model_dump())
+    read_cache.invalidate("jobs")
+    publish_delta(job_event("job_added", job_obj.id, None, job_obj.status))
+    await record_changes("jobs", [job_obj.id])
     return job_obj
 
 @api_router.get("/jobs", response_model=List[Job])
-async def get_jobs(status: Optional[str] = None):
+async def get_jobs(
+    request: Request,
+    response: Response,
+    status: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    fields: Optional[str] = None,
+):
+    selected = parse_fields(Job, fields)
+    not_modified = check_etag(request, response, read_cache.etag("jobs"))
+    if not_modified:
+        return not_modified
     query = {}
     if status:
         query["status"] = status
     
-    jobs = await db.jobs.find(query).sort("created_at", -1).to_list(1000)
-    return [Job(**job) for job in jobs]
+    jobs = await fetch_page("jobs", query, JOB_SORT, limit, after, response, read_fields(Job, selected))
+    return list_response(Job, jobs, response, selected)
 
 @api_router.put("/jobs/{job_id}", response_model=Job)
 async def update_job_status(job_id: str, status: str):
-    result = await db.jobs.update_one(
-        {"id": job_id}, 
-        {"$set": {"status": status}}
-    )
-    if result.matched_count == 0:
+    # The status it replaced comes from the same atomic write, so concurrent changes each
+    # publish the transition they actually made.
+    previous = await storage.find_one_and_update("jobs", {"id": job_id}, {"status": status})
+    if not previous:
         raise HTTPException(status_code=404, detail="Job not found")
+    read_cache.invalidate("jobs")
+    publish_delta(job_event("job_status_changed", job_id, previous.get("status"), status))
+    await record_changes("jobs", [job_id])
     
-    updated_job = await db.jobs.find_one({"id": job_id})
+    updated_job = await storage.find_one("jobs", {"id": job_id})
     return Job(**updated_job)
 
 # Balance calculation endpoint
-@api_router.get("/customer/{customer_id}/balance")
-async def get_customer_balance(customer_id: str):
-    transactions = await db.transactions.find({"customer_id": customer_id}).to_list(1000)
-    
-    total_gold_balance = 0.0
-    total_money_balance = 0.0
-    
-    for transaction in transactions:
-        # Gold balance: gold_in (received from customer) - gold_out (given back to customer)
-        total_gold_balance += transaction.get("gold_in", 0) - transaction.get("gold_out", 0)
-        # Money balance: cash_in (received) + labour_charge (earned)
-        total_money_balance += transaction.get("cash_in", 0) + transaction.get("labour_charge", 0)
-    
-    return {
-        "customer_id": customer_id,
-        "gold_balance": round(total_gold_balance, 3),
-        "money_balance": round(total_money_balance, 2)
-    }
+@api_router.get("/customer/{customer_id}/balance", response_model=CustomerBalance)
+async def get_customer_balance(customer_id: str, as_of: Optional[DateType] = None, fields: Optional[str] = None):
+    selected = parse_fields(CustomerBalance, fields)
+    key = ("balance", customer_id, as_of)
+    version = read_cache.version(customer_id)
+    cached = read_cache.get(key, version)
+    if cached is not None:
+        return partial_response(cached, selected)
+
+    if as_of:
+        balance = await balance_as_of(customer_id, as_of)
+    else:
+        balance = await storage.find_one("balances", {"_id": customer_id}) or {}
+    result = CustomerBalance(
+        customer_id=customer_id,
+        gold_balance=gold_value(balance.get("gold_balance", 0)),
+        money_balance=money_value(balance.get("money_balance", 0))
+    )
+    read_cache.set(key, version, result)
+    return partial_response(result, selected)
 
 # Dashboard stats
+ACTIVE_JOB_STATUSES = ["In Progress", "Completed"]
+
+async def compute_dashboard_stats() -> DashboardStats:
+    """Totals come from the maintained balances (one row per customer), so the cost does not
+    grow with the number of transactions; job and customer counts come in the same round-trip."""
+    stats = await storage.dashboard_totals(ACTIVE_JOB_STATUSES)
+
+    return DashboardStats(
+        total_gold_balance=gold_value(stats.get("total_gold_balance", 0)),
+        total_money_balance=money_value(stats.get("total_money_balance", 0)),
+        active_jobs_count=stats.get("active_jobs_count", 0),
+        total_customers=stats.get("total_customers", 0),
+        total_transactions=stats.get("total_transactions", 0)
+    )
+
 @api_router.get("/dashboard", response_model=DashboardStats)
-async def get_dashboard_stats():
-    # Get all transactions for balance calculation
-    transactions = await db.transactions.find().to_list(10000)
-    
-    total_gold_balance = 0.0
-    total_money_balance = 0.0
-    
+async def get_dashboard_stats(request: Request, response: Response, fields: Optional[str] = None):
+    selected = parse_fields(DashboardStats, fields)
+    not_modified = check_etag(request, response, read_cache.etag())
+    if not_modified:
+        return not_modified
+
+    return partial_response(await cached_dashboard_stats(), selected, response)
+
+async def cached_dashboard_stats() -> DashboardStats:
+    key = ("dashboard",)
+    version = read_cache.version()
+    cached = read_cache.get(key, version)
+    if cached is None:
+        cached = await compute_dashboard_stats()
+        read_cache.set(key, version, cached)
+    return cached
+
+# Dashboard stream events
+def ledger_delta(transactions: List[dict], sign: int) -> dict:
+    gold = money = 0
     for transaction in transactions:
-        total_gold_balance += transaction.get("gold_in", 0) - transaction.get("gold_out", 0)
-        total_money_balance += transaction.get("cash_in", 0) + transaction.get("labour_charge", 0)
-    
-    # Count active jobs
-    active_jobs = await db.jobs.count_documents({"status": {"$in": ["In Progress", "Completed"]}})
-    
-    # Count customers and transactions
-    total_customers = await db.customers.count_documents({})
-    total_transactions = await db.transactions.count_documents({})
-    
-    return DashboardStats(
-        total_gold_balance=round(total_gold_balance, 3),
-        total_money_balance=round(total_money_balance, 2),
-        active_jobs_count=active_jobs,
-        total_customers=total_customers,
-        total_transactions=total_transactions
+        delta = balance_delta(transaction, sign)
+        gold += delta["gold_balance"]
+        money += delta["money_balance"]
+    return {
+        "total_gold_balance": gold_value(gold),
+        "total_money_balance": money_value(money),
+        "total_transactions": sign * len(transactions),
+    }
+
+def transaction_event(reason: str, transactions: List[dict], sign: int) -> dict:
+    return {
+        "reason": reason,
+        "customer_ids": sorted({transaction["customer_id"] for transaction in transactions}),
+        "delta": ledger_delta(transactions, sign),
+    }
+
+def job_event(reason: str, job_id: str, before: Optional[str], after: Optional[str]) -> dict:
+    active = (after in ACTIVE_JOB_STATUSES) - (before in ACTIVE_JOB_STATUSES)
+    return {"reason": reason, "job_id": job_id, "status": after, "delta": {"active_jobs_count": active}}
+
+def customer_event(reason: str, customer_id: str, sign: int) -> dict:
+    return {"reason": reason, "customer_id": customer_id, "delta": {"total_customers": sign}}
+
+def publish_delta(data: dict):
+    """Publish a write route's delta, unless the change feed publishes every worker's writes."""
+    if DASHBOARD_EVENTS == "local":
+        event_bus.publish("delta", data)
+
+def change_event(collection: str, operation: str, document: Optional[dict], before: Optional[dict]) -> Optional[dict]:
+    """The delta for a change feed entry; RESYNC when it cannot be derived (no pre-image), None
+    when the change does not affect the dashboard."""
+    if collection == "customers":
+        if operation in ("insert", "delete"):
+            customer_id = (document or before or {}).get("id")
+            return customer_event(f"customer_{'added' if operation == 'insert' else 'deleted'}", customer_id,
+                                  1 if operation == "insert" else -1)
+        return None
+    if collection == "transactions":
+        if operation == "insert":
+            return transaction_event("transaction_added", [document], 1)
+        if operation == "delete" and before:
+            return transaction_event("transaction_deleted", [before], -1)
+        return RESYNC
+    if operation == "insert":
+        return job_event("job_added", document.get("id"), None, document.get("status"))
+    if operation == "delete" and before:
+        return job_event("job_deleted", before.get("id"), before.get("status"), None)
+    if operation in ("update", "replace") and "status" not in (document or {}):
+        return None
+    if operation in ("update", "replace") and before:
+        return job_event("job_status_changed", before.get("id"), before.get("status"), document["status"])
+    return RESYNC
+
+async def follow_changes():
+    """Publish dashboard events for writes made by any process, from the storage change feed.
+
+    After a failure the feed is reopened and subscribers resync, since changes may have been missed.
+    """
+    delay = 1
+    while True:
+        try:
+            async for collection, operation, document, before in storage.changes(ENTITY_COLLECTIONS):
+                delay = 1
+                event = change_event(collection, operation, document, before)
+                if event == RESYNC:
+                    event_bus.publish(RESYNC, {})
+                elif event is not None:
+                    event_bus.publish("delta", event)
+        except NotImplementedError:
+            logger.error("This storage backend has no change feed; set DASHBOARD_EVENTS=local")
+            return
+        except Exception as error:
+            logger.warning("Change feed failed, reopening in %ds: %s", delay, error)
+        event_bus.publish(RESYNC, {})
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 60)
+
+@api_router.get("/stream/dashboard")
+async def stream_dashboard():
+    """Server-Sent Events: a "snapshot" of DashboardStats, then "delta" events to add to it.
+
+    Event ids are bus sequence numbers. Snapshots are re-sent every STREAM_SNAPSHOT_SECONDS and
+    whenever deltas were dropped; they come from the read cache, so many clients reconnecting
+    at once cost one dashboard query.
+    """
+    queue = event_bus.subscribe()
+
+    async def events():
+        try:
+            snapshot_due, snapshot_sequence, next_snapshot = True, 0, 0.0
+            while True:
+                if snapshot_due:
+                    # Writes invalidate the cache and publish their delta with no await in
+                    # between, so stats read while the version held still include exactly
+                    # the deltas up to the sequence number taken after them.
+                    for _ in range(SNAPSHOT_ATTEMPTS):
+                        version = read_cache.version()
+                        stats = await cached_dashboard_stats()
+                        if read_cache.version() == version:
+                            break
+                    snapshot_sequence = event_bus.sequence
+                    yield sse("snapshot", dumps(stats.model_dump()), snapshot_sequence)
+                    snapshot_due, next_snapshot = False, time.monotonic() + STREAM_SNAPSHOT_SECONDS
+                try:
+                    timeout = max(0.0, min(STREAM_KEEPALIVE_SECONDS, next_snapshot - time.monotonic()))
+                    sequence, event, data = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    if time.monotonic() >= next_snapshot:
+                        snapshot_due = True
+                    else:
+                        yield b": keepalive\n\n"
+                    continue
+                if event == RESYNC:
+                    snapshot_due = True
+                elif sequence > snapshot_sequence:  # older ones are already in the snapshot
+                    yield sse(event, dumps(data), sequence)
+        finally:
+            event_bus.unsubscribe(queue)
+
+    # The explicit Content-Encoding keeps GZipMiddleware from buffering events inside its compressor.
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache", "Content-Encoding": "identity", "X-Accel-Buffering": "no",
+    })
+
+# Reports
+@api_router.get("/reports/rollup", response_model=List[Rollup])
+async def get_rollup_report(
+    response: Response,
+    granularity: str = Query("month", pattern="^(day|month)$"),
+    customer_id: Optional[str] = None,
+    from_date: Optional[DateType] = Query(None, alias="from"),
+    to_date: Optional[DateType] = Query(None, alias="to"),
+):
+    """Gold and cash flow per day or month, for one customer or shop-wide (no customer_id).
+
+    Sums are rounded like balances (grams to 3 decimals, money to 2), since float sums
+    carry noise such as 0.30000000000000004.
+    """
+    length = ROLLUP_GRANULARITIES[granularity]
+    query = {"granularity": granularity, "customer_id": customer_id}
+    period = {}
+    if from_date:
+        period["$gte"] = from_date.isoformat()[:length]
+    if to_date:
+        period["$lte"] = to_date.isoformat()[:length]
+    if period:
+        query["period"] = period
+    rollups = await storage.find("rollups", query, sort=[("period", 1)], fields=read_fields(Rollup))
+    encode = row_encoder(Rollup)
+    return json_response([
+        {**encode(rollup), **{field: amount_value(field, rollup.get(field, 0)) for field in ROLLUP_SUMS}}
+        for rollup in rollups
+    ], response)
+
+# Import
+IMPORT_BATCH_SIZE = 1000
+IMPORT_FIELDS = {
+    # Offline ledger (camelCase) field -> server field
+    "customerId": "customer_id",
+    "workDescription": "work_description",
+    "goldIn": "gold_in",
+    "goldOut": "gold_out",
+    "cashIn": "cash_in",
+    "labourCharge": "labour_charge",
+    "expectedDelivery": "expected_delivery",
+    "createdAt": "created_at",
+}
+
+def import_document(row: dict) -> dict:
+    return {IMPORT_FIELDS.get(key, key): value for key, value in row.items()}
+
+async def import_batch(collection: str, model, rows: List[tuple], errors: List[dict]) -> int:
+    """Validate and insert one batch of (index, row) pairs, returning the number inserted.
+
+    Customer names for transactions and jobs are resolved with a single $in query.
+    """
+    names = {}
+    if collection != "customers":
+        names = await customer_names({row.get("customer_id") for _, row in rows if row.get("customer_id")})
+
+    documents, indexes = [], []
+    for index, row in rows:
+        if collection != "customers":
+            if row.get("customer_id") not in names:
+                errors.append({"collection": collection, "index": index, "id": row.get("id"), "error": "Customer not found"})
+                continue
+            row["customer_name"] = names[row["customer_id"]]
+        try:
+            documents.append(stored(model(**row).model_dump()) if collection == "transactions" else model(**row).model_dump())
+        except ValidationError as e:
+            errors.append({"collection": collection, "index": index, "id": row.get("id"), "error": str(e)})
+            continue
+        indexes.append(index)
+    if not documents:
+        return 0
+
+    failed = await storage.insert_many(collection, documents)
+    for position, error in failed.items():
+        errors.append({"collection": collection, "index": indexes[position],
+                       "id": documents[position].get("id"), "error": error})
+    inserted = [document for position, document in enumerate(documents) if position not in failed]
+    if collection == "transactions":
+        await apply_balance_deltas(inserted)
+    else:
+        read_cache.invalidate(collection)
+    await record_changes(collection, [document["id"] for document in inserted])
+    return len(inserted)
+
+@api_router.post("/import")
+async def import_ledger(file: UploadFile = File(...)):
+    """Import an offline ledger backup (the format written by exportData / sample-data.json)."""
+    try:
+        data = await asyncio.to_thread(json.load, file.file)  # large backups take seconds to parse
+    except ValueError:
+        raise HTTPException(status_code=400, detail="File is not valid JSON")
+    if not isinstance(data, dict):
+        raise HTTPException(status_code=400, detail="Expected a ledger backup object")
+
+    errors = []
+    summary = {}
+    # Customers first so transactions and jobs in the same file can resolve them.
+    for collection, model in (("customers", Customer), ("transactions", Transaction), ("jobs", Job)):
+        inserted = 0
+        batch = []
+        for index, row in enumerate(data.get(collection) or []):
+            if not isinstance(row, dict):
+                errors.append({"collection": collection, "index": index, "id": None, "error": "Expected an object"})
+                continue
+            batch.append((index, import_document(row)))
+            if len(batch) == IMPORT_BATCH_SIZE:
+                inserted += await import_batch(collection, model, batch, errors)
+                batch = []
+        if batch:
+            inserted += await import_batch(collection, model, batch, errors)
+        summary[collection] = inserted
+    if any(summary.values()) and DASHBOARD_EVENTS == "local":
+        event_bus.publish(RESYNC, {})
+    return {"inserted": summary, "errors": errors}
+
+# Export
+EXPORTS = {
+    "customers": (Customer, CUSTOMER_SORT, "created_at"),
+    "transactions": (Transaction, TRANSACTION_SORT, "date"),
+    "jobs": (Job, JOB_SORT, "created_at"),
+}
+EXPORT_CHUNK_ROWS = 500
+
+def export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+async def export_rows(chunks, model, format: str, fields: Optional[tuple] = None):
+    """Encode lists of documents read from storage into CSV/NDJSON chunks."""
+    encode = row_encoder(model, fields)
+    if format == "ndjson":
+        async for documents in chunks:
+            yield b"".join(dumps(encode(document)) + b"\n" for document in documents)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(list(fields or model.model_fields))
+    async for documents in chunks:
+        for document in documents:
+            writer.writerow([export_value(value) for value in encode(document).values()])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@api_router.get("/export/{collection}")
+async def export_collection(
+    collection: str,
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    customer_id: Optional[str] = None,
+    from_date: Optional[DateType] = Query(None, alias="from"),
+    to_date: Optional[DateType] = Query(None, alias="to"),
+    fields: Optional[str] = None,
+):
+    if collection not in EXPORTS:
+        raise HTTPException(status_code=404, detail="Unknown export")
+    model, sort, date_field = EXPORTS[collection]
+    selected = parse_fields(model, fields)
+
+    query = {}
+    if customer_id:
+        query["id" if collection == "customers" else "customer_id"] = customer_id
+    if from_date or to_date:
+        # Transactions carry a ledger date; customers and jobs only have created_at timestamps.
+        bounds = {}
+        if date_field == "date":
+            if from_date:
+                bounds["$gte"] = from_date.isoformat()
+            if to_date:
+                bounds["$lte"] = to_date.isoformat()
+        else:
+            if from_date:
+                bounds["$gte"] = datetime.combine(from_date, datetime.min.time())
+            if to_date:
+                bounds["$lt"] = datetime.combine(to_date + timedelta(days=1), datetime.min.time())
+        query[date_field] = bounds
+
+    chunks = storage.iterate(collection, query, sort, read_fields(model, selected), EXPORT_CHUNK_ROWS)
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"{collection}.{format}"
+    return StreamingResponse(
+        export_rows(chunks, model, format, selected),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+# Statements
+# GET /api/customer/{id}/statement renders the opening balance, the transactions with running
+# balances and the closing balance for a date range as PDF, CSV or HTML. Rendering runs in a
+# pool of STATEMENT_WORKERS processes, so page layout never blocks the event loop. Rendered
+# statements are cached per (customer, range, format) and stamped with the customer's ledger
+# version: the balances row's updated_at and transaction_count plus the name and phone printed
+# on the statement. The version is read from storage, so writes from any worker invalidate it.
+STATEMENT_WORKERS = int(os.environ.get("STATEMENT_WORKERS", str(min(4, os.cpu_count() or 1))))
+statement_cache = ReadCache(
+    max_entries=int(os.environ.get("STATEMENT_CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.environ.get("STATEMENT_CACHE_TTL_SECONDS", "3600")),
+)
+statement_pool: Optional[ProcessPoolExecutor] = None
+
+def statement_executor() -> ProcessPoolExecutor:
+    global statement_pool
+    if statement_pool is None:
+        # Spawned, not forked: a fork would copy the event loop and open database sockets.
+        statement_pool = ProcessPoolExecutor(STATEMENT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return statement_pool
+
+async def close_statement_pool():
+    # Waiting for running renders to exit blocks, so it happens off the event loop.
+    global statement_pool
+    pool, statement_pool = statement_pool, None
+    if pool is not None:
+        await asyncio.to_thread(pool.shutdown, cancel_futures=True)
+
+async def render_in_pool(statement: dict, format: str) -> bytes:
+    return await asyncio.get_running_loop().run_in_executor(statement_executor(), render_statement, statement, format)
+
+async def ledger_version(customer: dict) -> tuple:
+    balance = await storage.find_one("balances", {"_id": customer["id"]}) or {}
+    return (balance.get("updated_at"), balance.get("transaction_count", 0), customer["name"], customer.get("phone"))
+
+async def build_statement(customer: dict, from_date: Optional[DateType], to_date: DateType) -> dict:
+    """Plain statement data for the renderers, amounts in grams and rupees."""
+    gold = money = 0
+    if from_date:
+        opening = await balance_as_of(customer["id"], from_date - timedelta(days=1))
+        gold, money = opening["gold_balance"], opening["money_balance"]
+    statement = {
+        "customer": {"id": customer["id"], "name": customer["name"], "phone": customer.get("phone")},
+        "from": from_date.isoformat() if from_date else None,
+        "to": to_date.isoformat(),
+        "generated_at": datetime.utcnow().replace(microsecond=0).isoformat() + "Z",
+        "opening": {"gold_balance": gold_value(gold), "money_balance": money_value(money)},
+        "rows": [],
+    }
+    totals = dict.fromkeys(ROLLUP_SUMS, 0)
+    date = {"$lte": to_date.isoformat()}
+    if from_date:
+        date["$gte"] = from_date.isoformat()
+    transactions = await storage.find(
+        "transactions", {"customer_id": customer["id"], "date": date}, sort=[("date", 1), ("id", 1)],
+        fields=("date", "work_description", "remarks", *ROLLUP_SUMS),
     )
+    for transaction in transactions:
+        delta = balance_delta(transaction)
+        gold += delta["gold_balance"]
+        money += delta["money_balance"]
+        row = {"date": transaction["date"], "work_description": transaction["work_description"],
+               "remarks": transaction.get("remarks"), "gold_balance": gold_value(gold), "money_balance": money_value(money)}
+        for field in ROLLUP_SUMS:
+            totals[field] += transaction.get(field, 0)
+            row[field] = amount_value(field, transaction.get(field, 0))
+        statement["rows"].append(row)
+    statement["totals"] = {field: amount_value(field, total) for field, total in totals.items()}
+    statement["closing"] = {"gold_balance": gold_value(gold), "money_balance": money_value(money)}
+    return statement
+
+@api_router.get("/customer/{customer_id}/statement")
+async def get_customer_statement(
+    customer_id: str,
+    format: str = Query("pdf", pattern="^(pdf|csv|html)$"),
+    from_date: Optional[DateType] = Query(None, alias="from"),
+    to_date: Optional[DateType] = Query(None, alias="to"),
+):
+    """Statement from `from` (default: the first transaction) to `to` (default: today)."""
+    customer = await storage.find_one("customers", {"id": customer_id})
+    if not customer:
+        raise HTTPException(status_code=404, detail="Customer not found")
+    to_date = to_date or DateType.today()
+    if from_date and from_date > to_date:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+
+    key = ("statement", customer_id, from_date, to_date, format)
+    version = await ledger_version(customer)
+    content = statement_cache.get(key, version)
+    if content is None:
+        content = await render_in_pool(await build_statement(customer, from_date, to_date), format)
+        statement_cache.set(key, version, content)
+    disposition = "inline" if format == "html" else "attachment"
+    filename = f"statement-{customer_id}-{to_date.isoformat()}.{format}"
+    return Response(content, media_type=MEDIA_TYPES[format],
+                    headers={"Content-Disposition": f'{disposition}; filename="{filename}"'})
+
+def month_bounds(month: str) -> tuple:
+    first = DateType(int(month[:4]), int(month[5:7]), 1)
+    return first, (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+
+async def month_end_statements(month: str, format: str, output: Path, concurrency: int = 0) -> dict:
+    """Render every customer's statement for `month` (YYYY-MM) into `output`, in parallel.
+
+    Statement data is read `concurrency` customers at a time (default: twice the pool size),
+    which keeps every pool process busy while the next statements are being read.
+    """
+    from_date, to_date = month_bounds(month)
+    output.mkdir(parents=True, exist_ok=True)
+    limit = asyncio.Semaphore(concurrency or 2 * STATEMENT_WORKERS)
+    started = time.perf_counter()
+
+    async def write(customer: dict):
+        async with limit:
+            content = await render_in_pool(await build_statement(customer, from_date, to_date), format)
+            path = output / f"statement-{month}-{customer['id']}.{format}"
+            await asyncio.to_thread(path.write_bytes, content)
+            return len(content)
+
+    written = total_bytes = 0
+    async for customers in storage.iterate("customers", {}, CUSTOMER_SORT, ("id", "name", "phone")):
+        sizes = await asyncio.gather(*(write(customer) for customer in customers))
+        written += len(sizes)
+        total_bytes += sum(sizes)
+    return {"month": month, "format": format, "statements": written, "bytes": total_bytes,
+            "seconds": round(time.perf_counter() - started, 2), "output": str(output)}
+
+# Delta sync
+# Every write to customers, transactions and jobs appends (collection, document_id, deleted, at)
+# to sync_log. GET /api/sync?since= reads the log after the cursor and returns the current
+# version of each changed document, or a tombstone for deleted ones, so its cost follows the
+# number of changes rather than the ledger size. Entries younger than SYNC_SETTLE_SECONDS are
+# held back until writes that started before them (in any worker) have landed. Entries older
+# than SYNC_RETENTION_DAYS are removed by `manage.py prune-sync-log`; an older cursor gets 410
+# and the device downloads everything again.
+SYNC_MODELS = {"customers": Customer, "transactions": Transaction, "jobs": Job}
+SYNC_SORT = [("at", 1), ("_id", 1)]
+SYNC_SETTLE_SECONDS = float(os.environ.get("SYNC_SETTLE_SECONDS", "2"))
+SYNC_RETENTION_DAYS = float(os.environ.get("SYNC_RETENTION_DAYS", "90"))
+DEFAULT_SYNC_LIMIT = 1000
+MAX_SYNC_LIMIT = 10000
+
+async def record_changes(collection: str, ids: List[str], deleted: bool = False):
+    if not ids:
+        return
+    now = datetime.utcnow()
+    await storage.insert_many("sync_log", [
+        {"_id": str(uuid.uuid4()), "collection": collection, "document_id": document_id, "deleted": deleted, "at": now}
+        for document_id in ids
+    ])
+
+async def prune_sync_log(days: float = SYNC_RETENTION_DAYS) -> dict:
+    """Delete sync log entries and idempotency keys older than `days`."""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    return {collection: await storage.delete_many(collection, {"at": {"$lt": cutoff}})
+            for collection in ("sync_log", "sync_keys")}
+
+@api_router.get("/sync")
+async def get_sync(since: Optional[str] = None, limit: int = Query(DEFAULT_SYNC_LIMIT, ge=1, le=MAX_SYNC_LIMIT)):
+    """Changes after the `since` cursor: changed documents per collection and deleted ids.
+
+    Without `since` nothing is returned but a cursor for "now": a new device takes it first,
+    then downloads the ledger with /api/export/*, and syncs from the cursor afterwards
+    (changes made during the download come back again, which is harmless). Keep calling
+    with the returned cursor while `has_more` is true.
+    """
+    horizon = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    head = encode_cursor({"at": horizon, "_id": ""}, SYNC_SORT)
+    changed = {collection: [] for collection in SYNC_MODELS}
+    deleted = {collection: [] for collection in SYNC_MODELS}
+    if since is None:
+        return json_response({"cursor": head, "has_more": False, **changed, "deleted": deleted})
+
+    position = decode_cursor(since, SYNC_SORT)
+    if position[0] < datetime.utcnow() - timedelta(days=SYNC_RETENTION_DAYS):
+        raise HTTPException(status_code=410, detail="Sync cursor is older than the sync log; download the ledger again")
+    # The plain range on `at` lets the (at, _id) index serve the whole read in order.
+    query = {"at": {"$gte": position[0], "$lte": horizon}, "$and": [keyset_filter(position, SYNC_SORT)]}
+    entries = await storage.find("sync_log", query, SYNC_SORT, limit + 1)
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}  # (collection, id) -> deleted, for the last change to each document
+    for entry in entries:
+        latest[(entry["collection"], entry["document_id"])] = entry["deleted"]
+    for collection, model in SYNC_MODELS.items():
+        ids = [document_id for (name, document_id), gone in latest.items() if name == collection and not gone]
+        deleted[collection] = [document_id for (name, document_id), gone in latest.items() if name == collection and gone]
+        if ids:
+            encode = row_encoder(model)
+            changed[collection] = [encode(document) for document in await storage.find(collection, {"id": {"$in": ids}})]
+    return json_response({
+        "cursor": encode_cursor(entries[-1], SYNC_SORT) if has_more else head,
+        "has_more": has_more,
+        **changed,
+        "deleted": deleted,
+    })
+
+# Fields a pushed update cannot change: identity, ownership and creation time.
+SYNC_FIXED_FIELDS = ("id", "customer_id", "customer_name", "created_at")
+
+def invalidate_document(collection: str, document_id: str):
+    if collection == "customers":
+        invalidate_customer(document_id)
+    else:
+        read_cache.invalidate(collection)
+
+async def sync_upsert(collection: str, row: dict) -> tuple:
+    """Create the document under the client's id, or update the one already there.
+
+    Transactions are immutable once created (the offline ledger edits them as delete and
+    re-add), so a known transaction id is left unchanged.
+    """
+    document_id = row.get("id")
+    if not document_id:
+        raise ValueError("Pushed documents need an id")
+    existing = await storage.find_one(collection, {"id": document_id})
+    if existing and collection == "transactions":
+        return "unchanged", document_id
+
+    model = SYNC_MODELS[collection]
+    if existing:
+        fields = [field for field in row if field in model.model_fields and field not in SYNC_FIXED_FIELDS]
+        validated = model(**{**existing, **row}).model_dump()
+        changes = {field: validated[field] for field in fields}
+        previous = await storage.find_one_and_update(collection, {"id": document_id}, changes)
+        if previous is None:
+            return "unchanged", document_id  # deleted concurrently
+        invalidate_document(collection, document_id)
+        if collection == "jobs" and "status" in changes:
+            publish_delta(job_event("job_status_changed", document_id, previous.get("status"), changes["status"]))
+        await record_changes(collection, [document_id])
+        return "updated", document_id
+
+    if collection != "customers":
+        names = await customer_names([row.get("customer_id")])
+        if row.get("customer_id") not in names:
+            raise ValueError("Customer not found")
+        row["customer_name"] = names[row["customer_id"]]
+    document = model(**row).model_dump()
+    if collection == "transactions":
+        document = stored(document)
+    if await storage.insert_many(collection, [document]):
+        return "unchanged", document_id  # created concurrently by a retry of the same push
+    if collection == "transactions":
+        await apply_balance_delta(document, event=transaction_event("transaction_added", [document], 1))
+    else:
+        invalidate_document(collection, document_id)
+        publish_delta(customer_event("customer_added", document_id, 1) if collection == "customers"
+                      else job_event("job_added", document_id, None, document.get("status")))
+    await record_changes(collection, [document_id])
+    return "created", document_id
+
+SYNC_DELETES = {"customers": delete_customer, "transactions": delete_transaction, "jobs": delete_job}
+
+async def apply_sync_change(change: SyncChange) -> SyncResult:
+    try:
+        if change.op == "delete":
+            if not change.id:
+                raise ValueError("Deletes need an id")
+            try:
+                await SYNC_DELETES[change.collection](change.id)
+            except HTTPException as e:
+                if e.status_code != 404:
+                    raise ValueError(e.detail)
+                return SyncResult(key=change.key, status="unchanged", id=change.id)  # already gone
+            return SyncResult(key=change.key, status="deleted", id=change.id)
+        status, document_id = await sync_upsert(change.collection, import_document(change.document or {}))
+        return SyncResult(key=change.key, status=status, id=document_id)
+    except (ValueError, ValidationError) as e:
+        return SyncResult(key=change.key, status="error", id=change.id or (change.document or {}).get("id"), error=str(e))
+
+@api_router.post("/sync", response_model=List[SyncResult])
+async def push_sync(push: SyncPush):
+    """Apply a batch of offline changes in order and return one result per change.
+
+    A change whose idempotency key was already applied is not applied again; its original
+    result comes back with `replayed` set, so a device can retry a push after a timeout.
+    """
+    keys = [change.key for change in push.changes]
+    seen = {entry["_id"]: entry for entry in await storage.find("sync_keys", {"_id": {"$in": keys}})}
+    results, new_keys = [], []
+    for change in push.changes:
+        if change.key in seen:
+            entry = seen[change.key]
+            results.append(SyncResult(key=change.key, status=entry["status"], id=entry["document_id"],
+                                      error=entry["error"], replayed=True))
+            continue
+        result = await apply_sync_change(change)
+        results.append(result)
+        seen[change.key] = {"status": result.status, "document_id": result.id, "error": result.error}
+        new_keys.append({"_id": change.key, "status": result.status, "document_id": result.id,
+                         "error": result.error, "at": datetime.utcnow()})
+    if new_keys:
+        await storage.insert_many("sync_keys", new_keys)
+    return results
+
+# Analytics
+# With ANALYTICS enabled, /api/analytics/* answers from an in-memory columnar snapshot of the
+# transactions (analytics.py, pandas/NumPy) without querying storage. The lifespan loads the
+# snapshot from ANALYTICS_SNAPSHOT_PATH, or builds it in one pass over the transactions, then
+# every ANALYTICS_REFRESH_SECONDS applies the transactions written or deleted since its sync
+# log watermark; the file is rewritten at most every ANALYTICS_SAVE_SECONDS. Each worker keeps
+# its own snapshot; run `manage.py build-analytics` before starting many workers on a new ledger.
+ANALYTICS = os.environ.get("ANALYTICS", "").lower() in ("1", "true", "yes")
+if ANALYTICS and analytics is None:
+    raise RuntimeError("ANALYTICS needs pandas and numpy; install backend/requirements.txt")
+ANALYTICS_SNAPSHOT_PATH = Path(os.environ.get("ANALYTICS_SNAPSHOT_PATH", str(ROOT_DIR / "analytics_snapshot.npz")))
+ANALYTICS_REFRESH_SECONDS = float(os.environ.get("ANALYTICS_REFRESH_SECONDS", "5"))
+ANALYTICS_SAVE_SECONDS = float(os.environ.get("ANALYTICS_SAVE_SECONDS", "300"))
+ANALYTICS_READ_BATCH = 10000
+analytics_snapshot = None
+analytics_cache = ReadCache(max_entries=256, ttl=3600)
+
+async def transaction_frames(query: dict, sort: Optional[List[tuple]] = None) -> list:
+    """Transactions matching `query` as analytics frames, one per batch read."""
+    scales = {field: scale if FIXED_POINT else 1 for field, scale in AMOUNT_SCALES.items()}
+    fields = ("id", "customer_id", "date", *ROLLUP_SUMS)
+    return [analytics.transactions_frame(documents, scales)
+            async for documents in storage.iterate("transactions", query, sort, fields, ANALYTICS_READ_BATCH)]
+
+async def build_analytics_snapshot():
+    """Snapshot of every transaction. Changes made during the read are replayed from the sync log."""
+    watermark = encode_cursor({"at": datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS), "_id": ""}, SYNC_SORT)
+    frames = await transaction_frames({}, TRANSACTION_SORT)  # walks the date index rather than scanning
+    names = {customer["id"]: customer["name"]
+             async for customers in storage.iterate("customers", {}, CUSTOMER_SORT, ("id", "name"))
+             for customer in customers}
+    return await asyncio.to_thread(analytics.LedgerSnapshot.build, frames, names, watermark)
+
+async def refresh_analytics(snapshot):
+    """The snapshot with the transactions and customer names changed after its watermark."""
+    position = decode_cursor(snapshot.watermark, SYNC_SORT)
+    if position[0] < datetime.utcnow() - timedelta(days=SYNC_RETENTION_DAYS):
+        return await build_analytics_snapshot()  # the log may have been pruned past the watermark
+    horizon = datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)
+    touched = {collection: set() for collection in SYNC_MODELS}
+    last = None
+    while True:
+        query = {"at": {"$gte": position[0], "$lte": horizon}, "$and": [keyset_filter(position, SYNC_SORT)]}
+        entries = await storage.find("sync_log", query, SYNC_SORT, MAX_SYNC_LIMIT)
+        for entry in entries:
+            touched[entry["collection"]].add(entry["document_id"])
+        if entries:
+            last = entries[-1]
+            position = [last["at"], last["_id"]]
+        if len(entries) < MAX_SYNC_LIMIT:
+            break
+    if last is None:
+        return snapshot
+
+    # Transactions are removed and re-read whatever the change was, so deletes need no special case.
+    ids = sorted(touched["transactions"])
+    added = []
+    for start in range(0, len(ids), ANALYTICS_READ_BATCH):
+        added += await transaction_frames({"id": {"$in": ids[start:start + ANALYTICS_READ_BATCH]}})
+    names = await customer_names(touched["customers"]) if touched["customers"] else {}
+    return await asyncio.to_thread(snapshot.apply, ids, added, names, encode_cursor(last, SYNC_SORT))
+
+async def save_analytics_snapshot(snapshot):
+    await asyncio.to_thread(snapshot.save, ANALYTICS_SNAPSHOT_PATH)
+
+async def follow_analytics():
+    global analytics_snapshot
+    saved_version, saved_at = None, time.monotonic()
+    while True:
+        try:
+            if analytics_snapshot is None:
+                loaded = await asyncio.to_thread(analytics.LedgerSnapshot.load, ANALYTICS_SNAPSHOT_PATH)
+                if loaded is None:
+                    loaded = await build_analytics_snapshot()
+                    await save_analytics_snapshot(loaded)
+                saved_version, saved_at = loaded.version, time.monotonic()
+                analytics_snapshot = loaded
+                logger.info("Analytics snapshot ready: %s", loaded.stats())
+            analytics_snapshot = await refresh_analytics(analytics_snapshot)
+            if analytics_snapshot.version != saved_version and time.monotonic() - saved_at >= ANALYTICS_SAVE_SECONDS:
+                await save_analytics_snapshot(analytics_snapshot)
+                saved_version, saved_at = analytics_snapshot.version, time.monotonic()
+        except Exception:
+            logger.exception("Analytics refresh failed")
+        await asyncio.sleep(ANALYTICS_REFRESH_SECONDS)
+
+def cached_analytics(key: tuple, compute) -> Response:
+    if not ANALYTICS:
+        raise HTTPException(status_code=404, detail="Analytics are off; set ANALYTICS=1 to enable them")
+    snapshot = analytics_snapshot
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="The analytics snapshot is still loading")
+    version = (snapshot.version,)
+    result = analytics_cache.get(key, version)
+    if result is None:
+        result = compute(snapshot)
+        analytics_cache.set(key, version, result)
+    return json_response(result)
+
+@api_router.get("/analytics/status")
+async def get_analytics_status():
+    return cached_analytics(("status",), lambda snapshot: {
+        **snapshot.stats(), "changes_until": decode_cursor(snapshot.watermark, SYNC_SORT)[0].isoformat(),
+    })
+
+@api_router.get("/analytics/outstanding")
+async def get_outstanding(limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE)):
+    """Customers holding the most gold with the shop, with their money balance and last activity."""
+    return cached_analytics(("outstanding", limit), lambda snapshot: snapshot.outstanding(limit))
+
+@api_router.get("/analytics/aging")
+async def get_gold_aging(
+    as_of: Optional[DateType] = None,
+    buckets: str = Query("30,60,90", pattern=r"^\d+(,\d+)*$"),
+    customer_id: Optional[str] = None,
+):
+    """Gold still held, by days since it was received; returns settle the oldest gold first."""
+    edges = [int(edge) for edge in buckets.split(",")]
+    if edges != sorted(set(edges)):
+        raise HTTPException(status_code=400, detail="Bucket edges must be increasing")
+    as_of = as_of or DateType.today()
+    return cached_analytics(("aging", as_of, tuple(edges), customer_id),
+                            lambda snapshot: snapshot.aging(as_of, edges, customer_id))
+
+@api_router.get("/analytics/top-customers")
+async def get_top_customers(
+    metric: str = Query("labour_charge", pattern="^(gold_in|gold_out|cash_in|labour_charge)$"),
+    limit: int = Query(10, ge=1, le=MAX_PAGE_SIZE),
+    from_date: Optional[DateType] = Query(None, alias="from"),
+    to_date: Optional[DateType] = Query(None, alias="to"),
+):
+    return cached_analytics(("top", metric, limit, from_date, to_date),
+                            lambda snapshot: snapshot.top_customers(metric, limit, from_date, to_date))
+
+@api_router.get("/analytics/trends")
+async def get_trends(
+    customer_id: Optional[str] = None,
+    from_date: Optional[DateType] = Query(None, alias="from"),
+    to_date: Optional[DateType] = Query(None, alias="to"),
+):
+    """Monthly totals with the percent change from the month before."""
+    return cached_analytics(("trends", customer_id, from_date, to_date),
+                            lambda snapshot: snapshot.trends(from_date, to_date, customer_id))
+
+# Admin
+@api_router.get("/admin/indexes")
+async def get_indexes():
+    return await index_report()
+
+@api_router.get("/admin/query-plans")
+async def get_query_plans():
+    if storage.audit is None:
+        raise HTTPException(status_code=404, detail="Query audit is off; set QUERY_AUDIT=1 to enable it")
+    return storage.audit.report()
+
+@api_router.get("/admin/cache")
+async def get_cache_stats():
+    return read_cache.stats()
+
+@api_router.get("/admin/stream")
+async def get_stream_stats():
+    return {"source": DASHBOARD_EVENTS, **event_bus.stats()}
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the process is up and serving requests. Does not touch the database."""
+    return {"status": "ok"}
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz(response: Response):
+    """Readiness: warmup has finished and the database answers a ping right now."""
+    if not readiness["ready"]:
+        response.status_code = 503
+        return {"status": "starting", "error": readiness["error"]}
+    try:
+        await asyncio.wait_for(storage.ping(), READY_TIMEOUT_SECONDS)
+    except Exception as error:
+        response.status_code = 503
+        return {"status": "unavailable", "error": str(error) or type(error).__name__}
+    return {"status": "ready"}
 
 # Basic health check
 @api_router.get("/")
@@ -282,15 +1931,18 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
+app.add_middleware(GZipMiddleware, minimum_size=int(os.environ.get("GZIP_MINIMUM_SIZE", "1024")))
+
+if METRICS_ENABLED:
+    # Added last so it is the outermost middleware and times compression too.
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
-logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+logger = logging.getLogger(__name__)
\ No newline at end of file
@@ -0,0 +1,454 @@
+"""Embedded SQLite storage for single-shop installs that do not want to run MongoDB.
+
+One connection is shared by the process and used only from a dedicated thread, one call at
+a time: queries are local and usually finish in well under a millisecond, but a write waiting
+up to busy_timeout for another process's lock must not stall the event loop (and /healthz)
+with it. The connection runs in WAL mode, so maintenance commands can read while the API
+writes, and the statement cache keeps every query shape prepared after its first use.
+Columns are untyped, so float amounts and fixed-point integers keep their type.
+"""
+import asyncio
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+from storage import ENTITY_COLLECTIONS, Storage, scaled_units
+
+# Columns per table; the first one is the primary key.
+TABLES = {
+    "customers": ("id", "name", "phone", "notes", "created_at"),
+    "transactions": ("id", "customer_id", "customer_name", "date", "work_description",
+                     "gold_in", "gold_out", "cash_in", "labour_charge", "remarks", "created_at"),
+    "jobs": ("id", "customer_id", "customer_name", "work_description", "status", "expected_delivery", "created_at"),
+    "balances": ("_id", "gold_balance", "money_balance", "transaction_count", "updated_at"),
+    "rollups": ("_id", "granularity", "customer_id", "period",
+                "gold_in", "gold_out", "cash_in", "labour_charge", "transaction_count"),
+    "balance_checkpoints": ("_id", "customer_id", "month", "gold_balance", "money_balance"),
+    "checkpoint_generations": ("_id", "generation", "updated_at"),
+    "sync_log": ("_id", "collection", "document_id", "deleted", "at"),
+    "sync_keys": ("_id", "status", "document_id", "error", "at"),
+}
+DATETIME_COLUMNS = {"created_at", "updated_at", "at"}
+OPERATORS = {"$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def to_sql(value):
+    """Datetimes are stored as naive UTC ISO text with millisecond precision, like BSON dates,
+    so they sort correctly and cursors built from returned values match the stored ones."""
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat(timespec="milliseconds")
+    return value
+
+
+class SQLiteStorage(Storage):
+    def __init__(self, path: Path, busy_timeout: float = 5.0):
+        # busy_timeout is how long a write waits for another process's write lock (a
+        # maintenance command, or API workers sharing the file) before failing with
+        # "database is locked". The wait happens on the storage thread, not the event loop.
+        self.path = Path(path)
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self.connection = sqlite3.connect(str(self.path), timeout=busy_timeout, isolation_level=None,
+                                          check_same_thread=False, cached_statements=256)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        for table, columns in TABLES.items():
+            definition = ", ".join([f"{quote(columns[0])} TEXT PRIMARY KEY"] + [quote(column) for column in columns[1:]])
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {quote(table)} ({definition}) WITHOUT ROWID")
+
+    async def _run(self, function, *args):
+        """Call `function(*args)` on the storage thread; calls run one at a time, in order."""
+        return await asyncio.get_running_loop().run_in_executor(self._thread, function, *args)
+
+    def _fetchall(self, sql: str, params=()) -> list:
+        return self.connection.execute(sql, params).fetchall()
+
+    def _rowcount(self, sql: str, params=()) -> int:
+        return self.connection.execute(sql, params).rowcount
+
+    @contextmanager
+    def _transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    @staticmethod
+    def _column(table: str, field: str) -> str:
+        if field not in TABLES[table]:
+            raise ValueError(f"Unknown field {field!r} for {table}")
+        return quote(field)
+
+    def _where(self, table: str, query: dict, params: list) -> str:
+        """Compile a plain-layout query into a WHERE expression, appending its parameters."""
+        clauses = []
+        for field, condition in query.items():
+            if field in ("$or", "$and"):
+                parts = [f"({self._where(table, clause, params)})" for clause in condition]
+                if not parts:
+                    clauses.append("0" if field == "$or" else "1")
+                else:
+                    clauses.append("(" + (" OR " if field == "$or" else " AND ").join(parts) + ")")
+                continue
+            column = self._column(table, field)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, value in condition.items():
+                if operator == "$in":
+                    if not value:
+                        clauses.append("0")
+                        continue
+                    clauses.append(f"{column} IN ({', '.join('?' * len(value))})")
+                    params.extend(to_sql(item) for item in value)
+                elif operator in ("$eq", "$ne") and value is None:
+                    clauses.append(f"{column} IS {'NOT ' if operator == '$ne' else ''}NULL")
+                elif operator == "$eq":
+                    clauses.append(f"{column} = ?")
+                    params.append(to_sql(value))
+                elif operator == "$ne":
+                    clauses.append(f"({column} IS NULL OR {column} != ?)")
+                    params.append(to_sql(value))
+                elif operator in OPERATORS:
+                    clauses.append(f"{column} {OPERATORS[operator]} ?")
+                    params.append(to_sql(value))
+                else:
+                    raise ValueError(f"Unsupported query operator {operator!r}")
+        return " AND ".join(clauses) or "1"
+
+    def _select(self, table, query, sort, limit, fields, columns=None):
+        if columns is None:
+            columns = TABLES[table] if fields is None else tuple(field for field in fields if field in TABLES[table])
+        params = []
+        sql = f"SELECT {', '.join(quote(column) for column in columns)} FROM {quote(table)}"
+        sql += f" WHERE {self._where(table, query or {}, params)}"
+        if sort:
+            sql += " ORDER BY " + ", ".join(
+                f"{self._column(table, field)} {'ASC' if direction == 1 else 'DESC'}" for field, direction in sort
+            )
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return columns, sql, params
+
+    @staticmethod
+    def _documents(columns, rows) -> list:
+        datetimes = [column for column in columns if column in DATETIME_COLUMNS]
+        documents = []
+        for row in rows:
+            document = dict(zip(columns, row))
+            for column in datetimes:
+                if document[column] is not None:
+                    document[column] = datetime.fromisoformat(document[column])
+            documents.append(document)
+        return documents
+
+    def _key_filter(self, table: str, query: dict, params: list) -> str:
+        """WHERE expression matching only the first document `query` matches."""
+        key = quote(TABLES[table][0])
+        return f"{key} = (SELECT {key} FROM {quote(table)} WHERE {self._where(table, query, params)} LIMIT 1)"
+
+    def _insert_sql(self, table: str, verb: str = "INSERT") -> str:
+        columns = TABLES[table]
+        return (f"{verb} INTO {quote(table)} ({', '.join(quote(column) for column in columns)}) "
+                f"VALUES ({', '.join('?' * len(columns))})")
+
+    @staticmethod
+    def _row(table: str, document: dict) -> list:
+        return [to_sql(document.get(column)) for column in TABLES[table]]
+
+    # Reads
+    async def find(self, collection, query=None, sort=None, limit=None, fields=None):
+        await self._audit(collection, "find", query, sort, limit)
+        columns, sql, params = self._select(collection, query, sort, limit, fields)
+        return self._documents(columns, await self._run(self._fetchall, sql, params))
+
+    async def iterate(self, collection, query=None, sort=None, fields=None, batch_size=1000):
+        await self._audit(collection, "iterate", query, sort)
+        columns, sql, params = self._select(collection, query, sort, None, fields)
+        cursor = await self._run(self.connection.execute, sql, params)
+        try:
+            while True:
+                rows = await self._run(cursor.fetchmany, batch_size)
+                if not rows:
+                    break
+                yield self._documents(columns, rows)
+        finally:
+            await self._run(cursor.close)
+
+    async def explain(self, collection, query, sort, limit):
+        # EXPLAIN QUERY PLAN does not count rows, so only the plan, indexes and flags are reported.
+        _, sql, params = self._select(collection, query, sort, limit, None)
+        plan = [row[3] for row in await self._run(self._fetchall, f"EXPLAIN QUERY PLAN {sql}", params)]
+        # A filtered query should SEARCH an index; a SCAN, even one USING an index, reads all of it.
+        scans = [step for step in plan if step.startswith("SCAN ")]
+        flags = []
+        if any("INDEX" not in step for step in scans):
+            flags.append("COLLSCAN")
+        if query and any("INDEX" in step for step in scans):
+            flags.append("FULL_INDEX_SCAN")
+        if any("TEMP B-TREE" in step for step in plan):
+            flags.append("IN_MEMORY_SORT")
+        return {
+            "plan": plan,
+            "indexes": [match.group(1) for step in plan for match in [re.search(r'INDEX (\S+)', step)] if match],
+            "keys_examined": None,
+            "docs_examined": None,
+            "returned": None,
+            "flags": flags,
+        }
+
+    # Writes
+    async def insert_one(self, collection, document):
+        await self._run(self.connection.execute, self._insert_sql(collection), self._row(collection, document))
+
+    async def insert_many(self, collection, documents):
+        sql = self._insert_sql(collection)
+        rows = [self._row(collection, document) for document in documents]
+
+        def insert():
+            errors = {}
+            with self._transaction():
+                for position, row in enumerate(rows):
+                    try:
+                        self.connection.execute(sql, row)
+                    except sqlite3.IntegrityError as e:
+                        errors[position] = str(e)
+            return errors
+        return await self._run(insert)
+
+    async def update_one(self, collection, query, values):
+        await self._audit(collection, "update_one", query, limit=1)
+        params = [to_sql(value) for value in values.values()]
+        assignments = ", ".join(f"{self._column(collection, field)} = ?" for field in values)
+        sql = f"UPDATE {quote(collection)} SET {assignments} WHERE {self._key_filter(collection, query, params)}"
+        return await self._run(self._rowcount, sql, params) > 0
+
+    async def delete_one(self, collection, query):
+        await self._audit(collection, "delete_one", query, limit=1)
+        params = []
+        sql = f"DELETE FROM {quote(collection)} WHERE {self._key_filter(collection, query, params)}"
+        return await self._run(self._rowcount, sql, params) > 0
+
+    async def delete_many(self, collection, query):
+        await self._audit(collection, "delete_many", query)
+        params = []
+        sql = f"DELETE FROM {quote(collection)} WHERE {self._where(collection, query, params)}"
+        return await self._run(self._rowcount, sql, params)
+
+    async def find_one_and_delete(self, collection, query):
+        await self._audit(collection, "find_one_and_delete", query, limit=1)
+        columns, sql, params = self._select(collection, query, None, 1, None)
+
+        def delete():
+            with self._transaction():
+                row = self.connection.execute(sql, params).fetchone()
+                if row is not None:
+                    self.connection.execute(f"DELETE FROM {quote(collection)} WHERE {quote(columns[0])} = ?", (row[0],))
+            return row
+        row = await self._run(delete)
+        return None if row is None else self._documents(columns, [row])[0]
+
+    async def find_one_and_update(self, collection, query, values):
+        await self._audit(collection, "find_one_and_update", query, limit=1)
+        columns, sql, params = self._select(collection, query, None, 1, None)
+        assignments = ", ".join(f"{self._column(collection, field)} = ?" for field in values)
+        new_values = [to_sql(value) for value in values.values()]
+
+        def update():
+            with self._transaction():
+                row = self.connection.execute(sql, params).fetchone()
+                if row is not None:
+                    self.connection.execute(f"UPDATE {quote(collection)} SET {assignments} WHERE {quote(columns[0])} = ?",
+                                            [*new_values, row[0]])
+            return row
+        row = await self._run(update)
+        return None if row is None else self._documents(columns, [row])[0]
+
+    async def increment(self, collection, updates):
+        if not updates:
+            return
+        key = quote(TABLES[collection][0])
+        statements = []
+        for document_key, increments, values in updates:
+            columns = [self._column(collection, field) for field in (*increments, *values)]
+            assignments = [f"{column} = COALESCE({column}, 0) + excluded.{column}" for column in columns[:len(increments)]]
+            assignments += [f"{column} = excluded.{column}" for column in columns[len(increments):]]
+            sql = (f"INSERT INTO {quote(collection)} ({key}, {', '.join(columns)}) "
+                   f"VALUES ({', '.join('?' * (len(columns) + 1))}) "
+                   f"ON CONFLICT({key}) DO UPDATE SET {', '.join(assignments)}")
+            statements.append((sql, [document_key, *increments.values(), *(to_sql(value) for value in values.values())]))
+
+        def apply():
+            with self._transaction():
+                for sql, params in statements:
+                    self.connection.execute(sql, params)
+        await self._run(apply)
+
+    async def replace_one(self, collection, key, document):
+        await self._run(self.connection.execute, self._insert_sql(collection, "INSERT OR REPLACE"),
+                        self._row(collection, {**document, TABLES[collection][0]: key}))
+
+    # Aggregates
+    async def dashboard_totals(self, active_statuses):
+        [row] = await self._run(
+            self._fetchall,
+            "SELECT COALESCE(SUM(gold_balance), 0), COALESCE(SUM(money_balance), 0), COALESCE(SUM(transaction_count), 0), "
+            f"(SELECT COUNT(*) FROM jobs WHERE status IN ({', '.join('?' * len(active_statuses))})), "
+            "(SELECT COUNT(*) FROM customers) FROM balances",
+            active_statuses,
+        )
+        return dict(zip(("total_gold_balance", "total_money_balance", "total_transactions",
+                         "active_jobs_count", "total_customers"), row))
+
+    async def ledger_balances(self):
+        rows = await self._run(
+            self._fetchall,
+            "SELECT customer_id, SUM(COALESCE(gold_in, 0) - COALESCE(gold_out, 0)), "
+            "SUM(COALESCE(cash_in, 0) + COALESCE(labour_charge, 0)), COUNT(*) FROM transactions GROUP BY customer_id",
+        )
+        return {
+            customer_id: {"gold_balance": gold, "money_balance": money, "transaction_count": count}
+            for customer_id, gold, money, count in rows
+        }
+
+    async def ledger_rollups(self, length, per_customer, sums):
+        customer = "customer_id" if per_customer else "NULL"
+        totals = ", ".join(f"SUM(COALESCE({self._column('transactions', field)}, 0))" for field in sums)
+        rows = await self._run(
+            self._fetchall,
+            f"SELECT {customer}, substr(date, 1, ?) AS period, COUNT(*), {totals} FROM transactions "
+            f"GROUP BY {'customer_id, ' if per_customer else ''}period",
+            (length,),
+        )
+        for customer_id, period, count, *values in rows:
+            yield {"customer_id": customer_id, "period": period, "transaction_count": count, **dict(zip(sums, values))}
+
+    async def convert_amounts(self, scales):
+        # SQL ROUND works on the scaled double and rounds half away from zero only by luck of
+        # its binary value, so rows are converted with the API's own rule.
+        columns = {field: self._column("transactions", field) for field in scales}
+
+        def convert():
+            converted = {}
+            self.connection.create_function("scaled_units", 2, scaled_units, deterministic=True)
+            with self._transaction():
+                for field, scale in scales.items():
+                    column = columns[field]
+                    converted[field] = self.connection.execute(
+                        f"UPDATE transactions SET {column} = scaled_units({column}, ?) WHERE typeof({column}) = 'real'",
+                        (scale,),
+                    ).rowcount
+            return converted
+        return await self._run(convert)
+
+    # Indexes and maintenance
+    @staticmethod
+    def _index_name(collection: str, spec: dict) -> str:
+        # SQLite index names are database-wide, so they are prefixed with the table.
+        return f"{collection}.{spec['name']}"
+
+    @staticmethod
+    def _primary(collection: str, spec: dict) -> bool:
+        return spec["keys"] == [(TABLES[collection][0], 1)]
+
+    async def ensure_indexes(self, indexes):
+        """Create any missing index. Unique id indexes are served by the primary key."""
+        await self._run(self._ensure_indexes, indexes)
+
+    def _ensure_indexes(self, indexes):
+        for collection, specs in indexes.items():
+            for spec in specs:
+                if self._primary(collection, spec):
+                    continue
+                keys = ", ".join(
+                    f"{self._column(collection, field)} {'ASC' if direction == 1 else 'DESC'}"
+                    for field, direction in spec["keys"]
+                )
+                unique = "UNIQUE " if spec.get("unique") else ""
+                name = quote(self._index_name(collection, spec))
+                self.connection.execute(f"CREATE {unique}INDEX IF NOT EXISTS {name} ON {quote(collection)} ({keys})")
+        self.connection.execute("PRAGMA optimize")
+
+    def _sizes(self) -> dict:
+        """Bytes used per table and index, from the dbstat virtual table when SQLite was built with it."""
+        try:
+            return dict(self.connection.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name"))
+        except sqlite3.OperationalError:
+            return {}
+
+    def _indexes(self, collection: str) -> dict:
+        actual = {}
+        for _, name, unique, *_ in self.connection.execute(f"PRAGMA index_list({quote(collection)})").fetchall():
+            keys = [
+                (column, -1 if descending else 1)
+                for _, _, column, descending, _, key in self.connection.execute(f"PRAGMA index_xinfo({quote(name)})").fetchall()
+                if key
+            ]
+            actual[name] = {"keys": keys, "unique": bool(unique)}
+        return actual
+
+    async def index_report(self, indexes):
+        """Expected versus actual indexes per table, with on-disk index sizes."""
+        return await self._run(self._index_report, indexes)
+
+    def _index_report(self, indexes):
+        sizes = self._sizes()
+        report = {}
+        for collection, specs in indexes.items():
+            actual = self._indexes(collection)
+            report[collection] = {
+                "expected": [
+                    {"name": spec["name"], "keys": spec["keys"], "unique": spec.get("unique", False),
+                     "present": self._primary(collection, spec) or self._index_name(collection, spec) in actual}
+                    for spec in specs
+                ],
+                "actual": [
+                    {"name": name, "keys": info["keys"], "unique": info["unique"], "size_bytes": sizes.get(name)}
+                    for name, info in actual.items()
+                ],
+            }
+        return report
+
+    async def storage_report(self):
+        """Row count, table size and index size per table, from dbstat."""
+        return await self._run(self._storage_report)
+
+    def _storage_report(self):
+        sizes = self._sizes()
+        report = {}
+        for collection in ENTITY_COLLECTIONS:
+            count = self.connection.execute(f"SELECT COUNT(*) FROM {quote(collection)}").fetchone()[0]
+            size = sizes.get(collection)
+            report[collection] = {
+                "count": count,
+                "size": size,
+                "avgObjSize": size // count if size and count else None,
+                "storageSize": size,
+                "totalIndexSize": sum(sizes.get(name, 0) for name in self._indexes(collection)) if sizes else None,
+            }
+        return report
+
+    async def ping(self):
+        await self._run(self._fetchall, "SELECT 1")
+
+    async def close(self):
+        await self._run(self.connection.execute, "PRAGMA optimize")
+        await self._run(self.connection.close)
+        self._thread.shutdown()
+
+    async def drop(self):
+        await self._run(self.connection.close)
+        self._thread.shutdown()
+        for suffix in ("", "-wal", "-shm"):
+            Path(f"{self.path}{suffix}").unlink(missing_ok=True)
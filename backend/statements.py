@@ -0,0 +1,163 @@
+"""Customer statement rendering (CSV, HTML and PDF).
+
+These functions only take and return plain data, so the API can run them in a process pool
+without importing the server. The PDF writer is self-contained: one monospaced font from the
+PDF standard set, text laid out line by line and A4 pages, which is all a statement needs
+and avoids a layout library dependency.
+"""
+import csv
+import html
+import io
+from typing import List
+
+COLUMNS = [
+    # (key, title, width in characters for the PDF table)
+    ("date", "Date", 10),
+    ("work_description", "Description", 24),
+    ("gold_in", "Gold in", 9),
+    ("gold_out", "Gold out", 9),
+    ("cash_in", "Cash in", 10),
+    ("labour_charge", "Labour", 9),
+    ("gold_balance", "Gold bal.", 10),
+    ("money_balance", "Money bal.", 11),
+]
+AMOUNT_DECIMALS = {"gold_in": 3, "gold_out": 3, "gold_balance": 3,
+                   "cash_in": 2, "labour_charge": 2, "money_balance": 2}
+
+
+def amount(key: str, value) -> str:
+    return f"{value:.{AMOUNT_DECIMALS[key]}f}"
+
+
+def period(statement: dict) -> str:
+    return f"{statement['from'] or 'first entry'} to {statement['to']}"
+
+
+def summary_lines(statement: dict) -> List[tuple]:
+    opening, closing, totals = statement["opening"], statement["closing"], statement["totals"]
+    return [
+        ("Opening gold balance (g)", amount("gold_balance", opening["gold_balance"])),
+        ("Opening money balance", amount("money_balance", opening["money_balance"])),
+        ("Gold received / returned (g)", f"{amount('gold_in', totals['gold_in'])} / {amount('gold_out', totals['gold_out'])}"),
+        ("Cash received / labour", f"{amount('cash_in', totals['cash_in'])} / {amount('labour_charge', totals['labour_charge'])}"),
+        ("Closing gold balance (g)", amount("gold_balance", closing["gold_balance"])),
+        ("Closing money balance", amount("money_balance", closing["money_balance"])),
+    ]
+
+
+def render_csv(statement: dict) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([title for _, title, _ in COLUMNS] + ["Remarks"])
+    opening = statement["opening"]
+    writer.writerow([statement["from"] or "", "Opening balance", "", "", "", "",
+                     amount("gold_balance", opening["gold_balance"]), amount("money_balance", opening["money_balance"]), ""])
+    for row in statement["rows"]:
+        writer.writerow([amount(key, row[key]) if key in AMOUNT_DECIMALS else row[key] for key, _, _ in COLUMNS]
+                        + [row.get("remarks") or ""])
+    return buffer.getvalue().encode()
+
+
+def render_html(statement: dict) -> bytes:
+    customer = statement["customer"]
+    numeric = ' class="n"'
+    head = "".join(f"<th{numeric if key in AMOUNT_DECIMALS else ''}>{title}</th>" for key, title, _ in COLUMNS)
+    rows = []
+    for row in statement["rows"]:
+        cells = []
+        for key, _, _ in COLUMNS:
+            if key in AMOUNT_DECIMALS:
+                cells.append(f"<td{numeric}>{amount(key, row[key])}</td>")
+            else:
+                cells.append(f"<td>{html.escape(str(row[key]))}</td>")
+        rows.append(f"<tr>{''.join(cells)}</tr>")
+    summary = "".join(f"<tr><th>{label}</th><td{numeric}>{value}</td></tr>" for label, value in summary_lines(statement))
+    document = f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Statement - {html.escape(customer['name'])}</title>
+<style>body{{font-family:sans-serif;margin:2em}}table{{border-collapse:collapse;margin-bottom:1.5em}}
+th,td{{border:1px solid #ccc;padding:4px 8px;text-align:left}}.n{{text-align:right}}</style></head>
+<body><h1>Customer statement</h1>
+<p><strong>{html.escape(customer['name'])}</strong>{' &middot; ' + html.escape(customer['phone']) if customer.get('phone') else ''}<br>
+Period: {period(statement)}<br>Generated: {statement['generated_at']}</p>
+<table>{summary}</table>
+<table><thead><tr>{head}</tr></thead><tbody>{''.join(rows)}</tbody></table>
+</body></html>
+"""
+    return document.encode()
+
+
+# PDF layout, in points
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4
+MARGIN = 40
+FONT_SIZE = 8
+LEADING = 11
+LINES_PER_PAGE = int((PAGE_HEIGHT - 2 * MARGIN) / LEADING)
+
+
+def pdf_text(text: str) -> str:
+    # The standard fonts only cover Latin-1; anything else is replaced rather than dropped.
+    text = text.encode("latin-1", "replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def statement_lines(statement: dict) -> List[str]:
+    customer = statement["customer"]
+    lines = ["CUSTOMER STATEMENT", "",
+             f"Customer: {customer['name']}" + (f"   Phone: {customer['phone']}" if customer.get("phone") else ""),
+             f"Period:   {period(statement)}",
+             f"Generated: {statement['generated_at']}", ""]
+    lines += [f"{label:<30}{value:>24}" for label, value in summary_lines(statement)]
+    lines.append("")
+    header = " ".join(f"{title:<{width}}" if key not in AMOUNT_DECIMALS else f"{title:>{width}}"
+                      for key, title, width in COLUMNS)
+    lines += [header, "-" * len(header)]
+    for row in statement["rows"]:
+        cells = []
+        for key, _, width in COLUMNS:
+            if key in AMOUNT_DECIMALS:
+                cells.append(f"{amount(key, row[key]):>{width}}")
+            else:
+                cells.append(f"{str(row[key])[:width]:<{width}}")
+        lines.append(" ".join(cells))
+    if not statement["rows"]:
+        lines.append("No transactions in this period.")
+    return lines
+
+
+def render_pdf(statement: dict) -> bytes:
+    lines = statement_lines(statement)
+    pages = [lines[start:start + LINES_PER_PAGE] for start in range(0, len(lines), LINES_PER_PAGE)] or [[]]
+    # Objects: 1 catalog, 2 page tree, 3 font, then a page and its content stream per page.
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>"]
+    page_ids = []
+    for number, page in enumerate(pages, 1):
+        footer = f"Page {number} of {len(pages)}"
+        text = [f"BT /F1 {FONT_SIZE} Tf {LEADING} TL {MARGIN} {PAGE_HEIGHT - MARGIN} Td"]
+        text += [f"({pdf_text(line)}) Tj T*" for line in page]
+        text.append(f"ET BT /F1 {FONT_SIZE} Tf {MARGIN} {MARGIN // 2} Td ({footer}) Tj ET")
+        stream = "\n".join(text).encode("latin-1")
+        page_ids.append(len(objects) + 1)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects) + 2} 0 R >>".encode())
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(f'{id} 0 R' for id in page_ids)}] /Count {len(pages)} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for id, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % id + body + b"\nendobj\n"
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+RENDERERS = {"csv": render_csv, "html": render_html, "pdf": render_pdf}
+MEDIA_TYPES = {"csv": "text/csv", "html": "text/html; charset=utf-8", "pdf": "application/pdf"}
+
+
+def render_statement(statement: dict, format: str) -> bytes:
+    return RENDERERS[format](statement)
@@ -0,0 +1,688 @@
+"""Storage backends for the Goldsmith Ledger API.
+
+Routes read and write documents in one plain layout (string ids, ISO transaction dates,
+customer names on transactions and jobs) and filter them with a small Mongo-style query
+vocabulary: equality, None, $in, $gt/$gte/$lt/$lte/$ne, $or and $and. Each backend maps
+that onto its own storage. The backend is picked with LEDGER_STORAGE (mongo or sqlite).
+"""
+import json
+import os
+import uuid
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+
+from bson import Binary, Decimal128
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import IndexModel, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
+
+ROOT_DIR = Path(__file__).parent
+ENTITY_COLLECTIONS = ("customers", "transactions", "jobs")
+# explain() flags an index scan as UNSELECTIVE_INDEX when it examines more than SCAN_RATIO
+# keys per document returned, and at least SCAN_MIN_KEYS in all.
+SCAN_RATIO = 10
+SCAN_MIN_KEYS = 100
+
+
+def scaled_units(value: float, scale: int) -> int:
+    """`value` in integer units of 1/scale: its decimal form (0.0005, not the nearest double)
+    scaled and rounded half away from zero. Amounts written by the API and amounts converted
+    by convert_amounts both go through this rule."""
+    return int((Decimal(str(value)) * scale).to_integral_value(ROUND_HALF_UP))
+
+
+def query_shape(query: dict) -> dict:
+    """The query with every value replaced by "?" (None is kept, since it changes the plan)."""
+    shape = {}
+    for field, condition in query.items():
+        if field in ("$or", "$and"):
+            shape[field] = [query_shape(clause) for clause in condition]
+        elif isinstance(condition, dict):
+            shape[field] = {operator: "?" for operator in condition}
+        else:
+            shape[field] = None if condition is None else "?"
+    return shape
+
+
+class QueryAudit:
+    """Explain output for the first query of every distinct shape a backend is asked to run.
+
+    Enabled with QUERY_AUDIT=1 (or by `manage.py audit-queries`). Each shape is explained once,
+    so the cost is one extra round-trip per new shape rather than per query.
+    """
+
+    def __init__(self):
+        self.shapes = {}
+
+    def observe(self, collection: str, operation: str, query: Optional[dict], sort: Optional[List[tuple]],
+                limit: Optional[int]) -> Optional[dict]:
+        """Count a query; returns a new entry to fill with the plan when its shape is new."""
+        shape = query_shape(query or {})
+        sort = [list(key) for key in sort] if sort else None
+        key = json.dumps([collection, operation, shape, sort, bool(limit)])
+        entry = self.shapes.get(key)
+        if entry is not None:
+            entry["count"] += 1
+            return None
+        entry = self.shapes[key] = {
+            "collection": collection, "operation": operation, "filter": shape, "sort": sort, "limit": limit, "count": 1,
+        }
+        return entry
+
+    def report(self) -> List[dict]:
+        """Every shape seen, flagged ones (collection or whole-index scans, in-memory sorts) first."""
+        return sorted(self.shapes.values(), key=lambda entry: (not entry.get("flags"), entry["collection"], entry["operation"]))
+
+
+class Storage:
+    """Operations the API needs from a backend. All documents are in the plain layout."""
+
+    audit: Optional[QueryAudit] = None
+
+    async def _audit(self, collection: str, operation: str, query: Optional[dict],
+                     sort: Optional[List[tuple]] = None, limit: Optional[int] = None):
+        if self.audit is None:
+            return
+        entry = self.audit.observe(collection, operation, query, sort, limit)
+        if entry is not None:
+            entry.update(await self.explain(collection, query, sort, limit))
+
+    async def explain(self, collection: str, query: Optional[dict], sort: Optional[List[tuple]],
+                      limit: Optional[int]) -> dict:
+        """Plan for a find: plan stages, indexes used, keys and documents examined, documents
+        returned and flags (COLLSCAN, IN_MEMORY_SORT, and FULL_INDEX_SCAN or UNSELECTIVE_INDEX
+        for an index that does not narrow the filter)."""
+        raise NotImplementedError
+
+    async def find(self, collection: str, query: Optional[dict] = None, sort: Optional[List[tuple]] = None,
+                   limit: Optional[int] = None, fields: Optional[tuple] = None) -> List[dict]:
+        raise NotImplementedError
+
+    async def find_one(self, collection: str, query: dict, sort: Optional[List[tuple]] = None,
+                       fields: Optional[tuple] = None) -> Optional[dict]:
+        documents = await self.find(collection, query, sort, 1, fields)
+        return documents[0] if documents else None
+
+    def iterate(self, collection: str, query: Optional[dict] = None, sort: Optional[List[tuple]] = None,
+                fields: Optional[tuple] = None, batch_size: int = 1000) -> AsyncIterator[List[dict]]:
+        """Read matching documents in lists of up to batch_size, without loading them all at once."""
+        raise NotImplementedError
+
+    async def insert_one(self, collection: str, document: dict):
+        raise NotImplementedError
+
+    async def insert_many(self, collection: str, documents: List[dict]) -> Dict[int, str]:
+        """Insert every document that can be inserted; returns {position: error} for those that could not."""
+        raise NotImplementedError
+
+    async def update_one(self, collection: str, query: dict, values: dict) -> bool:
+        """Set `values` on the first matching document; returns whether one matched."""
+        raise NotImplementedError
+
+    async def delete_one(self, collection: str, query: dict) -> bool:
+        raise NotImplementedError
+
+    async def delete_many(self, collection: str, query: dict) -> int:
+        raise NotImplementedError
+
+    async def find_one_and_delete(self, collection: str, query: dict) -> Optional[dict]:
+        raise NotImplementedError
+
+    async def find_one_and_update(self, collection: str, query: dict, values: dict) -> Optional[dict]:
+        """Set `values` on the first matching document atomically; returns it as it was before."""
+        raise NotImplementedError
+
+    async def increment(self, collection: str, updates: List[tuple]):
+        """Apply (key, increments, values) upserts to documents keyed by _id."""
+        raise NotImplementedError
+
+    async def replace_one(self, collection: str, key: str, document: dict):
+        """Store `document` under _id `key`, replacing any existing one."""
+        raise NotImplementedError
+
+    async def dashboard_totals(self, active_statuses: List[str]) -> dict:
+        """Balance and transaction totals plus active job and customer counts, in one round-trip."""
+        raise NotImplementedError
+
+    async def ledger_balances(self) -> Dict[str, dict]:
+        """Gold balance, money balance and transaction count per customer, summed from the raw ledger."""
+        raise NotImplementedError
+
+    def ledger_rollups(self, length: int, per_customer: bool, sums: tuple) -> AsyncIterator[dict]:
+        """Transaction count and `sums` grouped by the first `length` characters of the date
+        (and by customer when per_customer, otherwise with customer_id None)."""
+        raise NotImplementedError
+
+    async def convert_amounts(self, scales: Dict[str, int]) -> Dict[str, int]:
+        """Convert decimal transaction amounts to integer units; returns the number converted per field."""
+        raise NotImplementedError
+
+    async def ensure_indexes(self, indexes: dict):
+        raise NotImplementedError
+
+    async def index_report(self, indexes: dict) -> dict:
+        raise NotImplementedError
+
+    async def storage_report(self) -> dict:
+        raise NotImplementedError
+
+    async def migrate_compact_schema(self, indexes: dict) -> dict:
+        raise NotImplementedError("The compact schema only applies to the Mongo backend")
+
+    def changes(self, collections: Iterable[str]) -> AsyncIterator[tuple]:
+        """Follow writes to `collections` made by any process, as (collection, operation, document,
+        before) in the plain layout. `operation` is insert, update, replace or delete; `document`
+        is the new version (only the changed fields for updates) and `before` the previous one,
+        or None where the backend cannot provide it."""
+        raise NotImplementedError
+
+    async def ping(self):
+        """Round-trip to the database; raises if it cannot be reached."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+    async def drop(self):
+        """Delete all stored data (used by the benchmarks for their scratch databases)."""
+        raise NotImplementedError
+
+
+class MongoStorage(Storage):
+    """Motor-backed storage.
+
+    With `compact`, customers, transactions and jobs keep their id in _id (as binary: a 16-byte
+    UUID where it is one) instead of next to an ObjectId, references use the same encoding,
+    transaction dates are BSON dates and customer names are not duplicated into transactions
+    and jobs. Documents are packed on write, unpacked on read and queries are translated, so
+    callers only ever see the plain layout.
+    """
+
+    def __init__(self, url: str, database: str, compact: bool = False, event_listeners=(), **client_options):
+        self.client = AsyncIOMotorClient(url, event_listeners=list(event_listeners), **client_options)
+        self.db = self.client[database]
+        self.compact = compact
+
+    # Compact layout
+    def encode_id(self, value):
+        """Every id as BinData, so all ids compare as one BSON type (Mongo orders mixed types by
+        type, which would break keyset cursors): canonical UUID strings as a 16-byte UUID, any
+        other id (e.g. created offline) as its UTF-8 bytes."""
+        if not self.compact or not isinstance(value, str):
+            return value
+        try:
+            parsed = uuid.UUID(value)
+        except ValueError:
+            parsed = None
+        # Only canonical UUID strings round-trip unchanged through the UUID subtype.
+        if parsed is not None and str(parsed) == value:
+            return Binary.from_uuid(parsed)
+        return Binary(value.encode(), 0)
+
+    @staticmethod
+    def decode_id(value):
+        if isinstance(value, Binary) and value.subtype == 4:
+            return str(value.as_uuid())
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        if isinstance(value, bytes):  # subtype 0 reads back as bytes
+            return bytes(value).decode()
+        return value
+
+    def _compact(self, collection: str) -> bool:
+        return self.compact and collection in ENTITY_COLLECTIONS
+
+    def _field(self, collection: str, field: str) -> str:
+        return "_id" if field == "id" and self._compact(collection) else field
+
+    def _value(self, field: str, value):
+        if field in ("id", "customer_id"):
+            return self.encode_id(value)
+        if field == "date" and self.compact and isinstance(value, str):
+            return datetime.strptime(value, "%Y-%m-%d")
+        return value
+
+    def _translate(self, collection: str, query: dict) -> dict:
+        translated = {}
+        for field, condition in query.items():
+            if field in ("$or", "$and"):
+                translated[field] = [self._translate(collection, clause) for clause in condition]
+                continue
+            if isinstance(condition, dict):
+                condition = {
+                    operator: [self._value(field, item) for item in value] if operator == "$in" else self._value(field, value)
+                    for operator, value in condition.items()
+                }
+            else:
+                condition = self._value(field, condition)
+            translated[self._field(collection, field)] = condition
+        return translated
+
+    def _query(self, collection: str, query: Optional[dict]) -> dict:
+        if not query or not self._compact(collection):
+            return query or {}
+        return self._translate(collection, query)
+
+    def _sort(self, collection: str, sort: List[tuple]) -> List[tuple]:
+        return [(self._field(collection, field), direction) for field, direction in sort]
+
+    def _projection(self, collection: str, fields: Optional[tuple]) -> Optional[dict]:
+        if fields is None:
+            return None
+        projection = {self._field(collection, field): 1 for field in fields}
+        if self._compact(collection) and "customer_name" in fields:
+            projection["customer_id"] = 1  # names are looked up by customer
+        projection.setdefault("_id", 0)
+        return projection
+
+    def pack(self, collection: str, document: dict) -> dict:
+        """The document in its stored layout."""
+        document = dict(document)
+        if not self._compact(collection):
+            return document
+        document["_id"] = self.encode_id(document.pop("id"))
+        if "customer_id" in document:
+            document["customer_id"] = self.encode_id(document["customer_id"])
+            document.pop("customer_name", None)
+        if isinstance(document.get("date"), str):
+            document["date"] = self._value("date", document["date"])
+        return document
+
+    def unpack(self, document: dict) -> dict:
+        """Inverse of pack: the document in the plain layout."""
+        document = dict(document)
+        if "_id" in document:
+            document["id"] = self.decode_id(document.pop("_id"))
+        if "customer_id" in document:
+            document["customer_id"] = self.decode_id(document["customer_id"])
+        if isinstance(document.get("date"), datetime):
+            document["date"] = document["date"].date().isoformat()
+        return document
+
+    async def _documents(self, collection: str, documents: List[dict], fields: Optional[tuple]) -> List[dict]:
+        """Unpack stored documents and, in compact mode, fill in customer names with one lookup."""
+        if not self._compact(collection):
+            return documents
+        documents = [self.unpack(document) for document in documents]
+        if collection in ("transactions", "jobs") and (fields is None or "customer_name" in fields):
+            customer_ids = {document["customer_id"] for document in documents if "customer_id" in document}
+            names = {}
+            async for customer in self.db.customers.find(self._query("customers", {"id": {"$in": list(customer_ids)}}),
+                                                         {"_id": 1, "name": 1}):
+                names[self.decode_id(customer["_id"])] = customer["name"]
+            for document in documents:
+                if "customer_id" in document:
+                    document["customer_name"] = names.get(document["customer_id"], "")
+        return documents
+
+    # Reads
+    def _cursor(self, collection, query, sort, fields):
+        cursor = self.db[collection].find(self._query(collection, query), self._projection(collection, fields))
+        if sort:
+            cursor = cursor.sort(self._sort(collection, sort))
+        return cursor
+
+    async def find(self, collection, query=None, sort=None, limit=None, fields=None):
+        await self._audit(collection, "find", query, sort, limit)
+        cursor = self._cursor(collection, query, sort, fields)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await self._documents(collection, await cursor.to_list(limit), fields)
+
+    async def iterate(self, collection, query=None, sort=None, fields=None, batch_size=1000):
+        await self._audit(collection, "iterate", query, sort)
+        chunk = []
+        async for document in self._cursor(collection, query, sort, fields).batch_size(batch_size):
+            chunk.append(document)
+            if len(chunk) == batch_size:
+                yield await self._documents(collection, chunk, fields)
+                chunk = []
+        if chunk:
+            yield await self._documents(collection, chunk, fields)
+
+    async def explain(self, collection, query, sort, limit):
+        command = {"find": collection, "filter": self._query(collection, query)}
+        if sort:
+            command["sort"] = dict(self._sort(collection, sort))
+        if limit:
+            command["limit"] = limit
+        result = await self.db.command({"explain": command, "verbosity": "executionStats"})
+        winning = result["queryPlanner"]["winningPlan"]
+        stages, indexes = [], []
+
+        def walk(stage):
+            stages.append(stage["stage"])
+            if "indexName" in stage:
+                indexes.append(stage["indexName"])
+            for child in [stage.get("inputStage"), *stage.get("inputStages", [])]:
+                if child:
+                    walk(child)
+
+        walk(winning.get("queryPlan", winning))  # slot-based engine plans nest the classic tree
+        stats = result.get("executionStats", {})
+        keys, returned = stats.get("totalKeysExamined", 0), stats.get("nReturned", 0)
+        flags = [flag for flag, stage in (("COLLSCAN", "COLLSCAN"), ("IN_MEMORY_SORT", "SORT")) if stage in stages]
+        if "IXSCAN" in stages and keys >= SCAN_MIN_KEYS and keys > SCAN_RATIO * max(returned, 1):
+            flags.append("UNSELECTIVE_INDEX")
+        return {
+            "plan": stages,
+            "indexes": indexes,
+            "keys_examined": stats.get("totalKeysExamined"),
+            "docs_examined": stats.get("totalDocsExamined"),
+            "returned": stats.get("nReturned"),
+            "flags": flags,
+        }
+
+    # Writes
+    async def insert_one(self, collection, document):
+        await self.db[collection].insert_one(self.pack(collection, document))
+
+    async def insert_many(self, collection, documents):
+        if not documents:
+            return {}
+        try:
+            await self.db[collection].insert_many([self.pack(collection, document) for document in documents], ordered=False)
+        except BulkWriteError as e:
+            return {error["index"]: error.get("errmsg") for error in e.details.get("writeErrors", [])}
+        return {}
+
+    async def update_one(self, collection, query, values):
+        await self._audit(collection, "update_one", query, limit=1)
+        result = await self.db[collection].update_one(
+            self._query(collection, query),
+            {"$set": {self._field(collection, field): self._value(field, value) for field, value in values.items()}}
+        )
+        return result.matched_count > 0
+
+    async def delete_one(self, collection, query):
+        await self._audit(collection, "delete_one", query, limit=1)
+        result = await self.db[collection].delete_one(self._query(collection, query))
+        return result.deleted_count > 0
+
+    async def delete_many(self, collection, query):
+        await self._audit(collection, "delete_many", query)
+        result = await self.db[collection].delete_many(self._query(collection, query))
+        return result.deleted_count
+
+    async def find_one_and_delete(self, collection, query):
+        await self._audit(collection, "find_one_and_delete", query, limit=1)
+        document = await self.db[collection].find_one_and_delete(self._query(collection, query))
+        if document is None:
+            return None
+        return (await self._documents(collection, [document], None))[0]
+
+    async def find_one_and_update(self, collection, query, values):
+        await self._audit(collection, "find_one_and_update", query, limit=1)
+        document = await self.db[collection].find_one_and_update(
+            self._query(collection, query),
+            {"$set": {self._field(collection, field): self._value(field, value) for field, value in values.items()}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if document is None:
+            return None
+        return (await self._documents(collection, [document], None))[0]
+
+    async def increment(self, collection, updates):
+        if not updates:
+            return
+        await self.db[collection].bulk_write([
+            UpdateOne({"_id": key}, {"$inc": increments, "$set": values}, upsert=True)
+            for key, increments, values in updates
+        ], ordered=False)
+
+    async def replace_one(self, collection, key, document):
+        await self.db[collection].replace_one({"_id": key}, document, upsert=True)
+
+    # Aggregates
+    def dashboard_pipeline(self, active_statuses: List[str]) -> List[dict]:
+        """Single round-trip dashboard aggregation.
+
+        Totals come from the maintained balances collection (one document per customer), so the
+        cost does not grow with the number of transactions. Job and customer counts are unioned in.
+        """
+        return [
+            {"$group": {
+                "_id": None,
+                "total_gold_balance": {"$sum": "$gold_balance"},
+                "total_money_balance": {"$sum": "$money_balance"},
+                "total_transactions": {"$sum": "$transaction_count"},
+            }},
+            {"$unionWith": {"coll": "jobs", "pipeline": [
+                {"$match": {"status": {"$in": active_statuses}}},
+                {"$count": "active_jobs_count"},
+            ]}},
+            {"$unionWith": {"coll": "customers", "pipeline": [
+                {"$count": "total_customers"},
+            ]}},
+        ]
+
+    async def dashboard_totals(self, active_statuses):
+        totals = {}
+        async for row in self.db.balances.aggregate(self.dashboard_pipeline(active_statuses)):
+            totals.update(row)
+        totals.pop("_id", None)
+        return totals
+
+    async def ledger_balances(self):
+        pipeline = [
+            {"$group": {
+                "_id": "$customer_id",
+                "gold_balance": {"$sum": {"$subtract": [{"$ifNull": ["$gold_in", 0]}, {"$ifNull": ["$gold_out", 0]}]}},
+                "money_balance": {"$sum": {"$add": [{"$ifNull": ["$cash_in", 0]}, {"$ifNull": ["$labour_charge", 0]}]}},
+                "transaction_count": {"$sum": 1},
+            }}
+        ]
+        balances = {}
+        async for row in self.db.transactions.aggregate(pipeline):
+            balances[self.decode_id(row.pop("_id"))] = row
+        return balances
+
+    async def ledger_rollups(self, length, per_customer, sums):
+        day = {"$dateToString": {"format": "%Y-%m-%d", "date": "$date"}} if self.compact else "$date"
+        group = {
+            "_id": {"customer_id": "$customer_id" if per_customer else None, "period": {"$substrCP": [day, 0, length]}},
+            "transaction_count": {"$sum": 1},
+        }
+        group.update({field: {"$sum": {"$ifNull": [f"${field}", 0]}} for field in sums})
+        async for row in self.db.transactions.aggregate([{"$group": group}]):
+            key = row.pop("_id")
+            row["customer_id"] = self.decode_id(key["customer_id"])
+            row["period"] = key["period"]
+            yield row
+
+    async def convert_amounts(self, scales):
+        # scaled_units in the pipeline: $round would round half to even, and scaling the double
+        # itself would turn 1.0005 into 1000.4999..., so the decimal form is scaled and rounded
+        # half away from zero by hand.
+        converted = {}
+        for field, scale in scales.items():
+            rounded = {"$let": {
+                "vars": {"scaled": {"$multiply": [{"$toDecimal": f"${field}"}, scale]}},
+                "in": {"$cond": [{"$gte": ["$$scaled", 0]},
+                                 {"$floor": {"$add": ["$$scaled", Decimal128("0.5")]}},
+                                 {"$ceil": {"$subtract": ["$$scaled", Decimal128("0.5")]}}]},
+            }}
+            result = await self.db.transactions.update_many(
+                {field: {"$type": ["double", "int", "decimal"]}},
+                [{"$set": {field: {"$toLong": rounded}}}]
+            )
+            converted[field] = result.modified_count
+        return converted
+
+    # Indexes and maintenance
+    def expected_indexes(self, indexes: dict) -> dict:
+        """`indexes` for the active layout; the compact layout keys everything on _id instead of id."""
+        if not self.compact:
+            return indexes
+        compact = {}
+        for collection, specs in indexes.items():
+            compact[collection] = []
+            for spec in specs:
+                if spec["keys"] == [("id", 1)]:
+                    continue  # _id is already unique
+                keys = [(self._field(collection, field), direction) for field, direction in spec["keys"]]
+                name = "_".join(f"{field}_{direction}" for field, direction in keys)
+                compact[collection].append({**spec, "name": name, "keys": keys})
+        return compact
+
+    async def ensure_indexes(self, indexes):
+        """Create any missing index. Existing indexes are left untouched."""
+        for collection, specs in self.expected_indexes(indexes).items():
+            models = [
+                IndexModel(spec["keys"], name=spec["name"], unique=spec.get("unique", False))
+                for spec in specs
+            ]
+            if models:
+                await self.db[collection].create_indexes(models)
+
+    async def index_report(self, indexes):
+        """Expected versus actual indexes per collection, with on-disk index sizes."""
+        report = {}
+        for collection, specs in self.expected_indexes(indexes).items():
+            actual = await self.db[collection].index_information()
+            try:
+                stats = await self.db.command("collStats", collection)
+                sizes = stats.get("indexSizes", {})
+            except OperationFailure:
+                sizes = {}
+            report[collection] = {
+                "expected": [
+                    {"name": spec["name"], "keys": spec["keys"], "unique": spec.get("unique", False),
+                     "present": spec["name"] in actual}
+                    for spec in specs
+                ],
+                "actual": [
+                    {"name": name, "keys": info["key"], "unique": info.get("unique", False),
+                     "size_bytes": sizes.get(name)}
+                    for name, info in actual.items()
+                ],
+            }
+        return report
+
+    async def storage_report(self):
+        """Document count, data size and index size per collection, from collStats."""
+        report = {}
+        for collection in ENTITY_COLLECTIONS:
+            stats = await self.db.command("collStats", collection)
+            report[collection] = {
+                field: stats.get(field) for field in ("count", "size", "avgObjSize", "storageSize", "totalIndexSize")
+            }
+        return report
+
+    async def migrate_compact_schema(self, indexes):
+        """Rewrite customers, transactions and jobs in the compact layout and rebuild their indexes.
+
+        Each collection is copied into a scratch collection and renamed over the original, so
+        an interrupted run leaves the existing data untouched. Already compact documents are
+        unpacked and packed again, which makes the migration safe to re-run and moves ids stored
+        as strings by earlier versions to the binary encoding.
+        """
+        before = await self.storage_report()
+        for collection in ENTITY_COLLECTIONS:
+            scratch = f"{collection}_compact_migration"
+            await self.db[scratch].drop()
+            copied = 0
+            batch = []
+            async for document in self.db[collection].find():
+                batch.append(self.pack(collection, document if "id" in document else self.unpack(document)))
+                if len(batch) == 1000:
+                    await self.db[scratch].insert_many(batch)
+                    copied += len(batch)
+                    batch = []
+            if batch:
+                await self.db[scratch].insert_many(batch)
+                copied += len(batch)
+            if copied:
+                await self.db[scratch].rename(collection, dropTarget=True)
+        await self.ensure_indexes(indexes)
+        return {"before": before, "after": await self.storage_report()}
+
+    def _plain(self, collection: str, document: Optional[dict]) -> Optional[dict]:
+        if document is None:
+            return None
+        if self._compact(collection):
+            return self.unpack(document)
+        return {field: value for field, value in document.items() if field != "_id"}
+
+    async def changes(self, collections):
+        # Needs a replica set. Pre-images for deletes and updates need MongoDB 6.0 with
+        # changeStreamPreAndPostImages enabled on the collection; without them `before` is None.
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(collections)},
+            "operationType": {"$in": ["insert", "update", "replace", "delete"]},
+        }}]
+        async with self.db.watch(pipeline, full_document_before_change="whenAvailable") as stream:
+            async for change in stream:
+                collection, operation = change["ns"]["coll"], change["operationType"]
+                if operation == "update":
+                    document = change["updateDescription"]["updatedFields"]
+                else:
+                    document = change.get("fullDocument")
+                yield (collection, operation, self._plain(collection, document),
+                       self._plain(collection, change.get("fullDocumentBeforeChange")))
+
+    async def ping(self):
+        await self.client.admin.command("ping")
+
+    async def close(self):
+        self.client.close()
+
+    async def drop(self):
+        await self.client.drop_database(self.db.name)
+
+
+def write_concern(value: str):
+    return int(value) if value.isdigit() else value
+
+
+def flag(value: str) -> bool:
+    return value.lower() in ("1", "true", "yes")
+
+
+# Environment variable -> (client option, type). Unset variables keep pymongo's defaults
+# (100 connections per worker, 20s connect and server selection timeouts, no compression,
+# the server's default write concern). MONGO_COMPRESSORS takes a comma-separated list: zlib
+# needs nothing extra, zstd and snappy need the zstandard and python-snappy packages.
+# MONGO_WRITE_CONCERN is a node count or "majority"; MONGO_JOURNAL waits for the journal.
+MONGO_CLIENT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGO_COMPRESSORS": ("compressors", str),
+    "MONGO_WRITE_CONCERN": ("w", write_concern),
+    "MONGO_JOURNAL": ("journal", flag),
+}
+
+
+def mongo_client_options() -> dict:
+    return {
+        option: kind(os.environ[variable])
+        for variable, (option, kind) in MONGO_CLIENT_OPTIONS.items() if os.environ.get(variable)
+    }
+
+
+def create_storage(name: Optional[str] = None, compact: bool = False, event_listeners=()) -> Storage:
+    """The backend selected by LEDGER_STORAGE.
+
+    `name` replaces the configured database name (DB_NAME for Mongo, the file name of
+    SQLITE_PATH for SQLite), which the benchmarks use for scratch databases. The pymongo
+    `event_listeners` are attached to the Mongo client.
+    """
+    backend = os.environ.get("LEDGER_STORAGE", "mongo").lower()
+    if backend == "sqlite":
+        from sqlite_storage import SQLiteStorage
+
+        path = Path(os.environ.get("SQLITE_PATH", ROOT_DIR / "goldsmith-ledger.db"))
+        if name:
+            path = path.with_name(f"{name}.db")
+        return SQLiteStorage(path, busy_timeout=float(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000")) / 1000)
+    if backend != "mongo":
+        raise ValueError(f"Unknown LEDGER_STORAGE {backend!r}, expected 'mongo' or 'sqlite'")
+    return MongoStorage(os.environ["MONGO_URL"], name or os.environ["DB_NAME"], compact=compact,
+                        event_listeners=event_listeners, **mongo_client_options())
@@ -0,0 +1,112 @@
+"""Group commit for bursts of small concurrent writes.
+
+WriteBuffer wraps a Storage. insert_one/insert_many and increment calls arriving within the
+linger time are coalesced into one unordered insert_many or one increment per collection;
+increments to the same key are summed first. Each caller is resumed only once the batch
+write has returned, i.e. after the backend acknowledged it (with Mongo, under the client's
+write concern), so a request never answers before its data is written. Everything else is
+passed straight to the wrapped storage.
+"""
+import asyncio
+import time
+from typing import Dict, List
+
+
+class WriteBuffer:
+    def __init__(self, storage, max_batch: int = 100, linger: float = 0.002, metrics=None):
+        self.storage = storage
+        self.max_batch = max_batch
+        self.linger = linger
+        self.metrics = metrics
+        # (operation, collection) -> [(items, future, enqueued at)]
+        self.pending: Dict[tuple, list] = {}
+        self.writing = set()
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    async def insert_one(self, collection: str, document: dict):
+        failed = await self._submit("insert", collection, [document])
+        if failed:
+            raise ValueError(failed[0])
+
+    async def insert_many(self, collection: str, documents: List[dict]) -> Dict[int, str]:
+        if len(documents) >= self.max_batch:
+            return await self.storage.insert_many(collection, documents)
+        return await self._submit("insert", collection, documents) if documents else {}
+
+    async def increment(self, collection: str, updates: List[tuple]):
+        if updates:
+            await self._submit("increment", collection, updates)
+
+    def _submit(self, operation: str, collection: str, items: list) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        key = (operation, collection)
+        batch = self.pending.get(key)
+        if batch is None:
+            batch = self.pending[key] = []
+            if self.linger > 0:
+                loop.call_later(self.linger, self._flush, key, batch)
+            else:
+                loop.call_soon(self._flush, key, batch)
+        future = loop.create_future()
+        batch.append((items, future, time.perf_counter()))
+        if sum(len(entry[0]) for entry in batch) >= self.max_batch:
+            self._flush(key, batch)
+        return future
+
+    def _flush(self, key: tuple, batch: list):
+        if self.pending.get(key) is not batch:
+            return  # already flushed because it filled up before the linger timer fired
+        del self.pending[key]
+        task = asyncio.get_running_loop().create_task(self._write(key, batch))
+        self.writing.add(task)
+        task.add_done_callback(self.writing.discard)
+
+    async def _write(self, key: tuple, batch: list):
+        operation, collection = key
+        try:
+            if operation == "insert":
+                failed = await self.storage.insert_many(collection, [item for items, _, _ in batch for item in items])
+            else:
+                await self.storage.increment(collection, merge_increments(items for items, _, _ in batch))
+                failed = {}
+        except Exception as error:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        finished = time.perf_counter()
+        offset = 0
+        for items, future, enqueued in batch:
+            if not future.done():
+                future.set_result({position: failed[offset + position]
+                                   for position in range(len(items)) if offset + position in failed})
+            offset += len(items)
+            if self.metrics is not None:
+                self.metrics.write_wait.observe(finished - enqueued, collection, operation)
+        if self.metrics is not None:
+            self.metrics.write_batch_size.observe(offset, collection, operation)
+
+    async def close(self):
+        for key, batch in list(self.pending.items()):
+            self._flush(key, batch)
+        if self.writing:
+            await asyncio.gather(*self.writing, return_exceptions=True)
+        await self.storage.close()
+
+
+def merge_increments(batches) -> List[tuple]:
+    """One (key, increments, values) per key: increments summed, the latest values kept."""
+    merged: Dict[str, tuple] = {}
+    for updates in batches:
+        for key, increments, values in updates:
+            if key not in merged:
+                merged[key] = (key, dict(increments), dict(values))
+                continue
+            totals, latest = merged[key][1], merged[key][2]
+            for field, amount in increments.items():
+                totals[field] = totals.get(field, 0) + amount
+            latest.update(values)
+    return list(merged.values())
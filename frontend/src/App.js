@@ -5,6 +5,18 @@ import './App.css';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+// List endpoints are cursor-paginated; follow X-Next-Cursor until the last page.
+const fetchAllPages = async (url, params = {}) => {
+  let items = [];
+  let after;
+  do {
+    const response = await axios.get(url, { params: { ...params, limit: 1000, after } });
+    items = items.concat(response.data);
+    after = response.headers['x-next-cursor'];
+  } while (after);
+  return items;
+};
+
 function App() {
   const [activeTab, setActiveTab] = useState('dashboard');
   const [customers, setCustomers] = useState([]);
@@ -46,8 +58,7 @@ function App() {
 
   const fetchCustomers = async () => {
     try {
-      const response = await axios.get(`${API}/customers`);
-      setCustomers(response.data);
+      setCustomers(await fetchAllPages(`${API}/customers`));
     } catch (error) {
       console.error('Error fetching customers:', error);
     }
@@ -55,8 +66,7 @@ function App() {
 
   const fetchTransactions = async () => {
     try {
-      const response = await axios.get(`${API}/transactions`);
-      setTransactions(response.data);
+      setTransactions(await fetchAllPages(`${API}/transactions`));
     } catch (error) {
       console.error('Error fetching transactions:', error);
     }
@@ -64,8 +74,7 @@ function App() {
 
   const fetchJobs = async () => {
     try {
-      const response = await axios.get(`${API}/jobs`);
-      setJobs(response.data);
+      setJobs(await fetchAllPages(`${API}/jobs`));
     } catch (error) {
       console.error('Error fetching jobs:', error);
     }
@@ -73,11 +82,11 @@ function App() {
 
   const fetchCustomerDetails = async (customerId) => {
     try {
-      const [transactionsResponse, balanceResponse] = await Promise.all([
-        axios.get(`${API}/transactions?customer_id=${customerId}`),
+      const [transactionsList, balanceResponse] = await Promise.all([
+        fetchAllPages(`${API}/transactions`, { customer_id: customerId }),
         axios.get(`${API}/customer/${customerId}/balance`)
       ]);
-      setCustomerTransactions(transactionsResponse.data);
+      setCustomerTransactions(transactionsList);
       setCustomerBalance(balanceResponse.data);
     } catch (error) {
       console.error('Error fetching customer details:', error);
@@ -0,0 +1,41 @@
+"""Fixtures running the API in process against a scratch SQLite ledger per test."""
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ["LEDGER_STORAGE"] = "sqlite"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path) -> Path:
+    return tmp_path / "ledger.db"
+
+
+@pytest.fixture
+def client(db_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_PATH", str(db_path))
+    # The read cache is process-wide; a fresh one keeps entries from leaking between ledgers.
+    monkeypatch.setattr(server, "read_cache", server.ReadCache(max_entries=1024, ttl=5))
+    with TestClient(server.app) as client:
+        deadline = time.monotonic() + 10
+        while client.get("/readyz").status_code != 200:
+            assert time.monotonic() < deadline, "API did not become ready"
+            time.sleep(0.02)
+        yield client
+
+
+@pytest.fixture
+def fixed_point(monkeypatch):
+    # Row encoders are built (and cached) for the fixed-point setting of the process.
+    monkeypatch.setattr(server, "FIXED_POINT", True)
+    server.row_encoder.cache_clear()
+    yield
+    server.row_encoder.cache_clear()
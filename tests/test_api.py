@@ -0,0 +1,278 @@
+import asyncio
+import base64
+import json
+import sqlite3
+from collections import defaultdict
+from datetime import date as date_type
+
+import httpx
+import pytest
+
+import server
+
+
+def add_customer(client, name: str) -> str:
+    response = client.post("/api/customers", json={"name": name})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def add_transaction(client, customer_id: str, date: str, **amounts) -> dict:
+    response = client.post("/api/transactions", json={
+        "customer_id": customer_id, "work_description": "Work", "date": date, **amounts,
+    })
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def all_pages(client, path: str, limit: int, **params) -> list:
+    rows, after = [], None
+    while True:
+        response = client.get(path, params={**params, "limit": limit, **({"after": after} if after else {})})
+        assert response.status_code == 200
+        rows += response.json()
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            return rows
+
+
+def expected_balances(transactions: list) -> dict:
+    balances = defaultdict(lambda: [0.0, 0.0])
+    for transaction in transactions:
+        balance = balances[transaction["customer_id"]]
+        balance[0] += transaction["gold_in"] - transaction["gold_out"]
+        balance[1] += transaction["cash_in"] + transaction["labour_charge"]
+    return balances
+
+
+def assert_totals(client, customer_ids):
+    """Every balance and the dashboard totals match a recomputation from the raw transactions."""
+    transactions = all_pages(client, "/api/transactions", 1000)
+    expected = expected_balances(transactions)
+    for customer_id in customer_ids:
+        balance = client.get(f"/api/customer/{customer_id}/balance").json()
+        gold, money = expected[customer_id]
+        assert balance["gold_balance"] == pytest.approx(gold)
+        assert balance["money_balance"] == pytest.approx(money)
+    dashboard = client.get("/api/dashboard").json()
+    assert dashboard["total_gold_balance"] == pytest.approx(sum(gold for gold, _ in expected.values()))
+    assert dashboard["total_money_balance"] == pytest.approx(sum(money for _, money in expected.values()))
+    assert dashboard["total_transactions"] == len(transactions)
+
+
+def test_balances_and_dashboard_follow_every_write(client):
+    asha, ravi = add_customer(client, "Asha"), add_customer(client, "Ravi")
+    first = add_transaction(client, asha, "2024-03-01", gold_in=10.5, labour_charge=250)
+    add_transaction(client, ravi, "2024-03-02", gold_in=4, cash_in=1000)
+    assert_totals(client, [asha, ravi])
+
+    results = client.post("/api/transactions/batch", json=[
+        {"customer_id": asha, "work_description": "Ring", "date": "2024-03-03", "gold_out": 2.25},
+        {"customer_id": "missing", "work_description": "Chain"},
+        {"customer_id": ravi, "work_description": "Chain", "date": "2024-03-04", "labour_charge": 80.5},
+    ]).json()
+    assert [result["error"] for result in results] == [None, "Customer not found", None]
+    assert_totals(client, [asha, ravi])
+
+    assert client.put(f"/api/customers/{asha}", json={"name": "Asha Rao"}).status_code == 200
+    assert_totals(client, [asha, ravi])
+
+    assert client.delete(f"/api/transactions/{first['id']}").status_code == 200
+    assert_totals(client, [asha, ravi])
+
+    backup = {
+        "customers": [{"id": "imported", "name": "Imported", "createdAt": "2024-01-01T00:00:00"}],
+        "transactions": [
+            {"id": "i1", "customerId": "imported", "workDescription": "Bangle", "date": "2024-02-10", "goldIn": 7.125},
+            {"id": "i2", "customerId": ravi, "workDescription": "Repair", "date": "2024-02-11", "cashIn": 50},
+            {"id": "i3", "customerId": ravi, "workDescription": "Bad date", "date": "11/02/2024"},
+        ],
+    }
+    response = client.post("/api/import", files={"file": ("backup.json", json.dumps(backup))})
+    assert response.json()["inserted"] == {"customers": 1, "transactions": 2, "jobs": 0}
+    assert [error["id"] for error in response.json()["errors"]] == ["i3"]
+    assert_totals(client, [asha, ravi, "imported"])
+
+
+def test_balance_as_of_matches_recomputation(client):
+    customer_id = add_customer(client, "Meena")
+    dates = ["2023-11-20", "2024-01-05", "2024-01-31", "2024-02-14", "2024-04-01", "2024-04-30", "2024-06-15"]
+    for number, date in enumerate(dates):
+        add_transaction(client, customer_id, date, gold_in=number + 1, gold_out=0.5, cash_in=100 * number)
+
+    def assert_as_of(as_of: str):
+        transactions = [row for row in all_pages(client, "/api/transactions", 1000) if row["date"] <= as_of]
+        gold, money = expected_balances(transactions)[customer_id]
+        balance = client.get(f"/api/customer/{customer_id}/balance", params={"as_of": as_of}).json()
+        assert balance["gold_balance"] == pytest.approx(gold), as_of
+        assert balance["money_balance"] == pytest.approx(money), as_of
+
+    as_of_dates = ["2023-10-01", "2024-01-31", "2024-03-01", "2024-04-15", "2024-05-01", "2024-12-31"]
+    for as_of in as_of_dates * 2:  # the second pass starts from the checkpoints the first one saved
+        assert_as_of(as_of)
+    add_transaction(client, customer_id, "2024-02-01", gold_in=3, labour_charge=40)  # backdated into a checkpointed month
+    for as_of in as_of_dates:
+        assert_as_of(as_of)
+
+
+def test_pagination_returns_every_row_once_with_tied_sort_keys(client):
+    customer_ids = [add_customer(client, "Same name") for _ in range(13)]
+    ids = [add_transaction(client, customer_ids[number % 3], "2024-05-01", gold_in=1)["id"] for number in range(23)]
+    ids += [add_transaction(client, customer_ids[0], "2024-04-30", cash_in=1)["id"] for _ in range(4)]
+
+    transactions = all_pages(client, "/api/transactions", 5)
+    assert [row["id"] for row in transactions] == sorted(ids[:23], reverse=True) + sorted(ids[23:], reverse=True)
+    customers = all_pages(client, "/api/customers", 4)
+    assert [row["id"] for row in customers] == sorted(customer_ids)
+    per_customer = all_pages(client, "/api/transactions", 3, customer_id=customer_ids[0])
+    assert len(per_customer) == len({row["id"] for row in per_customer}) == 8 + 4
+
+
+def test_sync_push_replay_is_not_applied_twice(client):
+    push = {"changes": [
+        {"key": "k1", "collection": "customers", "op": "upsert", "document": {"id": "c1", "name": "Offline"}},
+        {"key": "k2", "collection": "transactions", "op": "upsert",
+         "document": {"id": "t1", "customerId": "c1", "workDescription": "Ring", "date": "2024-07-01", "goldIn": 5}},
+        {"key": "k3", "collection": "transactions", "op": "upsert",
+         "document": {"id": "t2", "customerId": "c1", "workDescription": "Bad", "date": "2024/07/01"}},
+    ]}
+    first = client.post("/api/sync", json=push).json()
+    assert [result["status"] for result in first] == ["created", "created", "error"]
+    assert not any(result["replayed"] for result in first)
+
+    replay = client.post("/api/sync", json=push).json()
+    assert [(result["status"], result["id"]) for result in replay] == [(result["status"], result["id"]) for result in first]
+    assert all(result["replayed"] for result in replay)
+    assert client.get("/api/customer/c1/balance").json()["gold_balance"] == 5
+    assert_totals(client, ["c1"])
+
+
+def test_fixed_point_amounts_round_trip_exactly(client, fixed_point, db_path):
+    customer_id = add_customer(client, "Fixed")
+    amounts = [{"gold_in": 0.1, "cash_in": 0.1}, {"gold_in": 0.2, "labour_charge": 0.2},
+               {"gold_out": 1234.567, "cash_in": 99999.99}]
+    created = [add_transaction(client, customer_id, "2024-08-01", **row) for row in amounts]
+    for transaction, row in zip(created, amounts):
+        fetched = client.get(f"/api/transactions/{transaction['id']}").json()
+        for field, value in row.items():
+            assert fetched[field] == value
+
+    balance = client.get(f"/api/customer/{customer_id}/balance").json()
+    assert balance == {"customer_id": customer_id, "gold_balance": -1234.267, "money_balance": 100000.29}
+    stored = sqlite3.connect(db_path).execute("SELECT gold_in, gold_out, cash_in FROM transactions ORDER BY gold_out, gold_in").fetchall()
+    assert stored == [(100, 0, 10), (200, 0, 0), (0, 1234567, 9999999)]
+
+
+def test_rollup_sums_are_rounded_like_balances(client):
+    customer_id = add_customer(client, "Rollup")
+    add_transaction(client, customer_id, "2024-09-01", gold_in=0.1, cash_in=0.1)
+    add_transaction(client, customer_id, "2024-09-02", gold_in=0.2, cash_in=0.2)
+    [month] = client.get("/api/reports/rollup", params={"customer_id": customer_id}).json()
+    assert (month["gold_in"], month["cash_in"], month["transaction_count"]) == (0.3, 0.3, 2)
+
+
+@pytest.mark.parametrize("values", [[{"$ne": None}, "a"], ["2024-01-01", ["a"]], ["2024-01-01"], "2024-01-01"])
+def test_malformed_cursor_is_rejected(client, values):
+    cursor = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+    assert client.get("/api/transactions", params={"after": cursor}).status_code == 400
+    assert client.get("/api/sync", params={"since": cursor}).status_code == 400
+
+
+def test_backdated_write_expires_later_checkpoints(client, db_path):
+    customer_id = add_customer(client, "Checkpoint")
+    for date in ["2024-01-10", "2024-02-10", "2024-03-10", "2024-04-10"]:
+        add_transaction(client, customer_id, date, gold_in=1, cash_in=10)
+    assert client.get(f"/api/customer/{customer_id}/balance", params={"as_of": "2024-04-30"}).json()["gold_balance"] == 4
+
+    def checkpoints():
+        return [month for month, in sqlite3.connect(db_path).execute(
+            "SELECT month FROM balance_checkpoints WHERE customer_id = ? ORDER BY month", (customer_id,))]
+    assert checkpoints() == ["2024-03"]
+    client.get(f"/api/customer/{customer_id}/balance", params={"as_of": "2024-02-15"})
+    assert checkpoints() == ["2024-01", "2024-03"]
+
+    add_transaction(client, customer_id, "2024-02-20", gold_out=0.5, labour_charge=5)
+    assert checkpoints() == ["2024-01"]  # every checkpoint from the backdated month on is dropped
+    balance = client.get(f"/api/customer/{customer_id}/balance", params={"as_of": "2024-04-30"}).json()
+    assert balance == {"customer_id": customer_id, "gold_balance": 3.5, "money_balance": 45}
+    assert checkpoints() == ["2024-01", "2024-03"]
+
+
+def test_write_changes_the_etag_and_repeats_get_304(client):
+    customer_id = add_customer(client, "Tagged")
+    add_transaction(client, customer_id, "2024-05-01", gold_in=1)
+    for path in ["/api/transactions", "/api/dashboard"]:
+        first = client.get(path)
+        etag = first.headers["ETag"]
+        repeat = client.get(path, headers={"If-None-Match": etag})
+        assert repeat.status_code == 304 and repeat.headers["ETag"] == etag
+
+    etags = {path: client.get(path).headers["ETag"] for path in ["/api/transactions", "/api/dashboard", "/api/customers"]}
+    add_transaction(client, customer_id, "2024-05-02", cash_in=20)
+    for path in ["/api/transactions", "/api/dashboard"]:
+        changed = client.get(path, headers={"If-None-Match": etags[path]})
+        assert changed.status_code == 200 and changed.headers["ETag"] != etags[path], path
+        assert client.get(path, headers={"If-None-Match": changed.headers["ETag"]}).status_code == 304
+    assert client.get("/api/customers", headers={"If-None-Match": etags["/api/customers"]}).status_code == 304
+
+
+def test_dashboard_stream_snapshot_and_deltas_add_up(client, monkeypatch):
+    """Deltas published while the snapshot is read are either in it or sent after it, never both."""
+    monkeypatch.setattr(server, "STREAM_KEEPALIVE_SECONDS", 0.05)  # wakes the reader once the writes are done
+    customer_id = add_customer(client, "Streamed")
+
+    async def stream_during_writes():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://test") as api:
+            async def write():
+                for number in range(6):
+                    await api.post("/api/transactions", json={
+                        "customer_id": customer_id, "work_description": "Work", "gold_in": 1.25, "cash_in": number,
+                    })
+                job = (await api.post("/api/jobs", json={"customer_id": customer_id, "work_description": "Repair"})).json()
+                await api.put(f"/api/jobs/{job['id']}", params={"status": "Delivered"})
+
+            response = await server.stream_dashboard()  # subscribes before the writes start
+            writes = asyncio.create_task(write())
+            while server.event_bus.sequence < 4:  # some deltas are queued before the snapshot is read
+                await asyncio.sleep(0.001)
+            events = []
+            async for chunk in response.body_iterator:
+                fields = dict(line.split(": ", 1) for line in chunk.decode().splitlines() if line and line[0] != ":")
+                if fields:
+                    events.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+                if writes.done() and events[-1][0] == server.event_bus.sequence:
+                    break
+            await writes
+            await response.body_iterator.aclose()
+            return events, (await api.get("/api/dashboard")).json()
+
+    events, dashboard = client.portal.call(stream_during_writes)
+    (snapshot_id, kind, totals), deltas = events[0], events[1:]
+    assert kind == "snapshot" and all(event == "delta" for _, event, _ in deltas)
+    assert [id for id, _, _ in deltas] == sorted(id for id, _, _ in deltas)
+    assert all(id > snapshot_id for id, _, _ in deltas)
+    for _, _, data in deltas:
+        for field, amount in data["delta"].items():
+            totals[field] += amount
+    assert totals == pytest.approx(dashboard)
+
+
+def test_statement_opens_and_closes_on_the_as_of_balances(client):
+    customer_id = add_customer(client, "Statement")
+    for date, amounts in [("2024-01-05", {"gold_in": 1.1}), ("2024-02-03", {"gold_in": 2.2, "cash_in": 100}),
+                          ("2024-02-20", {"gold_out": 0.3, "labour_charge": 12.5}), ("2024-03-01", {"gold_in": 4})]:
+        add_transaction(client, customer_id, date, **amounts)
+    customer = {"id": customer_id, "name": "Statement"}
+    statement = client.portal.call(server.build_statement, customer, date_type(2024, 2, 1), date_type(2024, 2, 29))
+
+    def as_of(date: str) -> dict:
+        balance = client.get(f"/api/customer/{customer_id}/balance", params={"as_of": date}).json()
+        return {field: balance[field] for field in ("gold_balance", "money_balance")}
+    assert statement["opening"] == as_of("2024-01-31") == {"gold_balance": 1.1, "money_balance": 0}
+    assert statement["closing"] == as_of("2024-02-29") == {"gold_balance": 3.0, "money_balance": 112.5}
+    assert [(row["date"], row["gold_balance"]) for row in statement["rows"]] == [("2024-02-03", 3.3), ("2024-02-20", 3.0)]
+    assert statement["totals"] == {"gold_in": 2.2, "gold_out": 0.3, "cash_in": 100, "labour_charge": 12.5}
+
+    assert client.get("/api/customer/missing/statement", params={"format": "csv"}).status_code == 404
+    assert client.get(f"/api/customer/{customer_id}/statement",
+                      params={"format": "csv", "from": "2024-03-01", "to": "2024-02-01"}).status_code == 400
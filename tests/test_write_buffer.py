@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from sqlite_storage import SQLiteStorage
+from write_buffer import WriteBuffer
+
+
+class RecordingStorage(SQLiteStorage):
+    """SQLite storage that records the batches the buffer hands it."""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.calls = []
+
+    async def insert_many(self, collection, documents):
+        self.calls.append(("insert_many", collection, len(documents)))
+        return await super().insert_many(collection, documents)
+
+    async def increment(self, collection, updates):
+        self.calls.append(("increment", collection, len(updates)))
+        return await super().increment(collection, updates)
+
+
+def run_buffered(db_path, scenario):
+    async def main():
+        storage = RecordingStorage(db_path)
+        buffer = WriteBuffer(storage, max_batch=100, linger=0.01)
+        try:
+            return storage.calls, await scenario(buffer)
+        finally:
+            await buffer.close()
+    return asyncio.run(main())
+
+
+def test_concurrent_increments_are_merged_into_one_write(db_path):
+    async def scenario(buffer):
+        await asyncio.gather(*[
+            buffer.increment("balances", [(customer_id, {"gold_balance": amount, "transaction_count": 1},
+                                           {"updated_at": None})])
+            for customer_id, amount in [("a", 1.5), ("b", 2), ("a", 0.25), ("a", -1), ("b", 3)]
+        ])
+        return {row["_id"]: row for row in await buffer.find("balances")}
+
+    calls, balances = run_buffered(db_path, scenario)
+    assert calls == [("increment", "balances", 2)]
+    assert (balances["a"]["gold_balance"], balances["a"]["transaction_count"]) == (0.75, 3)
+    assert (balances["b"]["gold_balance"], balances["b"]["transaction_count"]) == (5, 2)
+
+
+def test_insert_failures_reach_only_their_callers(db_path):
+    async def scenario(buffer):
+        await buffer.insert_one("customers", {"id": "taken", "name": "First"})
+        return await asyncio.gather(
+            buffer.insert_one("customers", {"id": "new", "name": "New"}),
+            buffer.insert_one("customers", {"id": "taken", "name": "Duplicate"}),
+            buffer.insert_many("customers", [{"id": "other", "name": "Other"}, {"id": "new", "name": "Again"}]),
+            return_exceptions=True,
+        )
+
+    calls, (inserted, duplicate, many) = run_buffered(db_path, scenario)
+    assert calls == [("insert_many", "customers", 1), ("insert_many", "customers", 4)]
+    assert inserted is None
+    assert isinstance(duplicate, ValueError) and "UNIQUE" in str(duplicate)
+    assert list(many) == [1]
+
+
+@pytest.mark.parametrize("max_batch", [1, 3])
+def test_full_batches_are_written_without_waiting_for_the_linger(db_path, max_batch):
+    async def main():
+        storage = RecordingStorage(db_path)
+        buffer = WriteBuffer(storage, max_batch=max_batch, linger=60)
+        try:
+            await asyncio.wait_for(asyncio.gather(*[
+                buffer.insert_one("customers", {"id": str(number), "name": "Customer"}) for number in range(max_batch)
+            ]), 5)
+            return storage.calls
+        finally:
+            await buffer.close()
+
+    assert asyncio.run(main()) == [("insert_many", "customers", max_batch)]